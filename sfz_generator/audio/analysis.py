@@ -0,0 +1,107 @@
+import numpy as np
+
+PEAK_BLOCK = 256
+PEAK_FACTOR = 4
+PEAK_MIN_LEVEL_SIZE = 512
+ZERO_THRESHOLD = 1e-10
+
+
+class SampleAnalysis:
+    """Derived data for a loaded sample, computed in one streaming pass.
+
+    ``peaks`` is a pyramid of ``(block_frames, mins, maxs)`` levels, finest first, used to
+    draw zoomed-out views without touching the audio. ``zero_crossings`` holds the frame
+    indices where the signal changes sign.
+    """
+
+    def __init__(self, peaks=None, zero_crossings=None, root_pitch=None):
+        self.peaks = peaks or []
+        self.zero_crossings = zero_crossings
+        self.root_pitch = root_pitch
+
+    def peak_level(self, frames_per_pixel):
+        """Returns the coarsest level whose blocks are not wider than a pixel."""
+        best = None
+        for level in self.peaks:
+            if level[0] > frames_per_pixel:
+                break
+            best = level
+        return best
+
+
+def reduce_extents(mins, maxs, width):
+    """Reduces ``mins``/``maxs`` to ``width`` pixel columns, returns per-pixel min and max arrays."""
+    edges = (np.arange(width) * (len(mins) / width)).astype(np.intp)
+    return np.minimum.reduceat(mins, edges), np.maximum.reduceat(maxs, edges)
+
+
+def build_peak_pyramid(mins, maxs):
+    """Builds the coarser peak levels on top of the finest ``PEAK_BLOCK`` level."""
+    levels = [(PEAK_BLOCK, mins, maxs)]
+    block = PEAK_BLOCK
+    while len(mins) > PEAK_MIN_LEVEL_SIZE:
+        pad = -len(mins) % PEAK_FACTOR
+        if pad:
+            mins = np.concatenate([mins, np.repeat(mins[-1:], pad)])
+            maxs = np.concatenate([maxs, np.repeat(maxs[-1:], pad)])
+        mins = mins.reshape(-1, PEAK_FACTOR).min(axis=1)
+        maxs = maxs.reshape(-1, PEAK_FACTOR).max(axis=1)
+        block *= PEAK_FACTOR
+        levels.append((block, mins, maxs))
+    return levels
+
+
+def analyze_source(source, stop_event=None):
+    """Builds the peak pyramid and zero-crossing index of ``source`` in a single pass.
+
+    Returns None if ``stop_event`` is set before the pass completes.
+    """
+    mins, maxs, crossings = [], [], []
+    previous_negative = None
+    for offset, block in source.iter_blocks(PEAK_BLOCK * 1024):
+        if stop_event is not None and stop_event.is_set():
+            return None
+
+        pad = -len(block) % PEAK_BLOCK
+        padded = np.pad(block, (0, pad), mode="edge") if pad else block
+        frames = padded.reshape(-1, PEAK_BLOCK)
+        mins.append(frames.min(axis=1))
+        maxs.append(frames.max(axis=1))
+
+        negative = _negative_mask(block)
+        if previous_negative is None or previous_negative != negative[0]:
+            crossings.append(np.array([offset]))
+        crossings.append(np.flatnonzero(negative[1:] != negative[:-1]) + (offset + 1))
+        previous_negative = negative[-1]
+
+    if not mins:
+        return SampleAnalysis(zero_crossings=np.zeros(0, dtype=np.int64))
+
+    index_dtype = np.uint32 if len(source) < 2**32 else np.int64
+    zero_crossings = np.concatenate(crossings).astype(index_dtype)
+    return SampleAnalysis(build_peak_pyramid(np.concatenate(mins), np.concatenate(maxs)), zero_crossings)
+
+
+def nearest_zero_crossing(zero_crossings, position):
+    """Returns the entry of the sorted ``zero_crossings`` index closest to ``position``."""
+    if zero_crossings is None or len(zero_crossings) == 0:
+        return int(position)
+    i = int(np.searchsorted(zero_crossings, position))
+    candidates = zero_crossings[max(0, i - 1) : i + 1]
+    return int(candidates[np.argmin(np.abs(candidates.astype(np.int64) - int(position)))])
+
+
+def _negative_mask(block):
+    return np.signbit(block) & (np.abs(block) > ZERO_THRESHOLD)
+
+
+def zero_crossings_of(block, offset=0):
+    """Zero crossings inside an in-memory ``block`` whose first frame is at ``offset``."""
+    negative = _negative_mask(block)
+    return np.flatnonzero(negative[1:] != negative[:-1]) + (offset + 1)
+
+
+def local_zero_crossings(source, position, radius=4096):
+    """Zero crossings of ``source`` within ``radius`` frames of ``position``, read on demand."""
+    start = max(0, int(position) - radius)
+    return zero_crossings_of(source[start : int(position) + radius], start)
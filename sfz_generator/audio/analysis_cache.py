@@ -0,0 +1,109 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from sfz_generator.audio.analysis import SampleAnalysis, build_peak_pyramid
+from sfz_generator.utils import user_cache_dir
+
+CACHE_VERSION = 1
+MAX_CACHE_BYTES = 256 << 20
+# Bytes hashed at the head, middle and tail of a file to detect content changes
+HASH_SAMPLE_BYTES = 1 << 20
+
+
+def cache_dir():
+    return user_cache_dir("analysis")
+
+
+def content_hash(path, size):
+    """Hashes the size plus head, middle and tail samples of the file, cheap even for multi-GB recordings."""
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= 3 * HASH_SAMPLE_BYTES:
+            digest.update(f.read())
+        else:
+            for offset in (0, (size - HASH_SAMPLE_BYTES) // 2, size - HASH_SAMPLE_BYTES):
+                f.seek(offset)
+                digest.update(f.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def cache_key(path):
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    identity = f"{CACHE_VERSION}\0{path}\0{st.st_size}\0{st.st_mtime_ns}\0{content_hash(path, st.st_size)}"
+    return hashlib.blake2b(identity.encode(), digest_size=20).hexdigest()
+
+
+def _entry_path(path):
+    return os.path.join(cache_dir(), cache_key(path) + ".npz")
+
+
+def load_analysis(path):
+    """Returns the cached SampleAnalysis for ``path``, or None if the file is unknown or has changed."""
+    try:
+        entry = _entry_path(path)
+        with np.load(entry, allow_pickle=False) as data:
+            mins = data["mins"].astype(np.float32)
+            maxs = data["maxs"].astype(np.float32)
+            zero_crossings = np.cumsum(data["zero_crossing_deltas"], dtype=np.int64)
+            root_pitch = tuple(float(v) for v in data["root_pitch"]) or None
+        # Refresh the access time used for eviction
+        os.utime(entry)
+    except (OSError, KeyError, ValueError):
+        return None
+
+    index_dtype = np.uint32 if len(zero_crossings) == 0 or zero_crossings[-1] < 2**32 else np.int64
+    peaks = build_peak_pyramid(mins, maxs) if len(mins) else []
+    return SampleAnalysis(peaks, zero_crossings.astype(index_dtype), root_pitch)
+
+
+def store_analysis(path, analysis):
+    """Writes ``analysis`` for ``path`` to the cache, then evicts old entries above the size cap."""
+    try:
+        entry = _entry_path(path)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        if analysis.peaks:
+            _, mins, maxs = analysis.peaks[0]
+        else:
+            mins = maxs = np.zeros(0, dtype=np.float32)
+        zero_crossings = analysis.zero_crossings if analysis.zero_crossings is not None else np.zeros(0, dtype=np.int64)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    mins=mins.astype(np.float16),
+                    maxs=maxs.astype(np.float16),
+                    zero_crossing_deltas=np.diff(zero_crossings.astype(np.int64), prepend=0).astype(np.uint32),
+                    root_pitch=np.array(analysis.root_pitch or (), dtype=np.float32),
+                )
+            os.replace(tmp_path, entry)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        evict(MAX_CACHE_BYTES)
+    except OSError as e:
+        print(f"Error writing analysis cache: {e}")
+
+
+def evict(max_bytes):
+    """Deletes the least recently used cache entries until the cache fits in ``max_bytes``."""
+    directory = cache_dir()
+    try:
+        entries = [e for e in os.scandir(directory) if e.name.endswith(".npz")]
+    except OSError:
+        return
+    stats = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries), reverse=True)
+    total = 0
+    for _, size, entry_path in stats:
+        total += size
+        if total > max_bytes:
+            try:
+                os.unlink(entry_path)
+            except OSError:
+                pass
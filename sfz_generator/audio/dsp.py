@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def crossfade_tail(source, loop_start, loop_end, crossfade_frames):
+    """Returns the last frames of the ``[loop_start, loop_end)`` loop crossfaded into the pre-loop audio.
+
+    Like SFZ ``loop_crossfade``, the last ``crossfade_frames`` of the loop fade out while the
+    frames just before ``loop_start`` fade in (equal power), so wrapping back to ``loop_start``
+    continues the faded-in material without a discontinuity. Only the tail is built, the rest
+    of the loop plays from ``source`` unchanged; it is shorter than ``crossfade_frames`` when
+    the loop or the audio before it are.
+    """
+    fade = max(0, min(int(crossfade_frames), loop_start, loop_end - loop_start))
+    t = (np.arange(fade, dtype=np.float32) + 0.5) / fade if fade else np.empty(0, dtype=np.float32)
+    return source[loop_end - fade : loop_end] * np.sqrt(1 - t) + source[loop_start - fade : loop_start] * np.sqrt(t)
+
+
+class Envelope:
+    """SFZ ``ampeg_*`` DAHDSR envelope evaluated block by block as a gain curve.
+
+    The delay/attack/hold/decay part and the release ramp are precomputed once, blocks
+    are then filled by slicing them so no per-block allocation is needed. Segments are
+    linear, as drawn by the envelope widget.
+    """
+
+    def __init__(self, sample_rate, delay=0.0, attack=0.0, hold=0.0, decay=0.0, sustain=1.0, release=0.0):
+        self.sample_rate = sample_rate
+        self.sustain = float(sustain)
+        self.release_frames = int(release * sample_rate)
+        self.release_curve = np.linspace(1, 0, self.release_frames, endpoint=False, dtype=np.float32)
+
+        def frames(seconds):
+            return int(seconds * sample_rate)
+
+        self.curve = np.concatenate(
+            [
+                np.zeros(frames(delay), dtype=np.float32),
+                np.linspace(0, 1, frames(attack), endpoint=False, dtype=np.float32),
+                np.ones(frames(hold), dtype=np.float32),
+                np.linspace(1, self.sustain, frames(decay), endpoint=False, dtype=np.float32),
+            ]
+        )
+
+    @property
+    def is_flat(self):
+        return len(self.curve) == 0 and self.sustain == 1.0 and self.release_frames == 0
+
+    def level(self, position):
+        """Gain ``position`` frames after note-on, before release."""
+        return float(self.curve[position]) if position < len(self.curve) else self.sustain
+
+    def gain(self, position, out):
+        """Fills ``out`` with the gain from ``position`` frames after note-on."""
+        head = self.curve[position : position + len(out)]
+        out[: len(head)] = head
+        out[len(head) :] = self.sustain
+
+    def release_gain(self, level, position, out):
+        """Fills ``out`` with the release ramp from ``level``, ``position`` frames after note-off.
+
+        Returns False once the release ends within this block.
+        """
+        head = self.release_curve[position : position + len(out)]
+        np.multiply(head, level, out=out[: len(head)])
+        out[len(head) :] = 0
+        return position + len(out) < self.release_frames
@@ -1,154 +1,480 @@
 import atexit
-import queue
 import subprocess
 import threading
-import time
 
 import jack
+import numpy as np
+
+from sfz_generator.audio.mixer import MIXER_SAMPLE_RATE, Mixer
+from sfz_generator.audio.preview import plan_preview_note, render_preview_notes, voice_loop
+from sfz_generator.audio.render_pool import RenderCancelled
 
 PREVIEW_CLIENT_NAME = "sfz_preview"
+PREVIEW_INPUT_PORT = f"{PREVIEW_CLIENT_NAME}:input"
+CLIENT_NAME = "sfz_generator"
+ENGINE_CLIENT_NAME = "sfz_engine"
+# How long sfizz_jack gets to register its ports before the start is reported as failed
+PORT_TIMEOUT = 5.0
+# Delay between attempts to reach the JACK server while it is down
+RECONNECT_INTERVAL = 2.0
+# Keys the native engine renders ahead, the 88 keys of a piano
+ENGINE_NOTES = range(21, 109)
+# Notes rendered per batch, the engine checks for cancellation between batches
+ENGINE_BATCH = 12
+
+# Preview states reported to listeners
+STOPPED = "stopped"
+STARTING = "starting"
+READY = "ready"
+ERROR = "error"
+
+
+def _stop_process_gracefully(proc):
+    if not proc or proc.poll() is not None:
+        return None
+
+    try:
+        proc.stdin.write(b"quit\n")
+        proc.stdin.flush()
+        proc.wait(timeout=1.0)
+        return None  # Success
+    except (subprocess.TimeoutExpired, BrokenPipeError, OSError):
+        pass  # Didn't quit gracefully, proceed to kill
+
+    if proc.poll() is None:
+        try:
+            proc.terminate()  # SIGTERM
+            proc.wait(timeout=1.0)
+            return None
+        except (subprocess.TimeoutExpired, OSError):
+            pass  # Didn't terminate, proceed to force kill
+
+    if proc.poll() is None:
+        try:
+            proc.kill()  # SIGKILL
+            proc.wait()
+        except OSError:
+            pass  # Already dead
+    return None
+
+
+class NativeEngine:
+    """Plays MIDI from its own JACK ports, without spawning sfizz_jack.
+
+    Every key of the instrument is rendered ahead by ``load_instrument`` into a table of
+    note buffers, then the process callback only starts voices from that table and mixes
+    them into preallocated buffers, so notes sound on the next period. It takes no lock and
+    its audio buffers are preallocated, but being Python it still creates small objects each
+    period (MIDI event tuples, views on the port buffers). Velocity is ignored, notes are
+    rendered at the preview velocity.
+
+    The engine runs on a JACK client of its own, active only between ``attach`` and ``detach``:
+    a process callback waits for this process's GIL, which must not hold up the JACK graph
+    while the engine is off.
+
+    Loads run on ``render_pool`` through ``request_load``, a newer request cancels the older one.
+    """
+
+    def __init__(self, render_pool=None):
+        self.render_pool = render_pool
+        self.client = None
+        self.midi_in = None
+        self.outputs = []
+        self.attached = False
+        self.sample_rate = MIXER_SAMPLE_RATE
+        # Per MIDI note: (buffer, loop, ignore_note_off, release_frames) or None, replaced as a whole
+        self.notes = [None] * 128
+        self.notes_rate = None
+        self.instrument = None
+        self.mixer = Mixer(sample_rate=self.sample_rate, output=False)
+        self._buffer = np.zeros((0, 2), dtype=np.float32)
+
+    def attach(self):
+        """Opens and activates the engine client, and connects its outputs to the system playback."""
+        client = jack.Client(ENGINE_CLIENT_NAME, no_start_server=True)
+        try:
+            self.sample_rate = client.samplerate
+            self.mixer = Mixer(sample_rate=self.sample_rate, channels=2, output=False)
+            self.prepare(client.blocksize)
+            client.set_blocksize_callback(self.prepare)
+            client.set_process_callback(self.process)
+            self.midi_in = client.midi_inports.register("midi_in")
+            self.outputs = [client.outports.register(f"out_{channel + 1}") for channel in range(2)]
+            client.activate()
+        except jack.JackError:
+            client.close()
+            self.midi_in = None
+            self.outputs = []
+            raise
+        playback = client.get_ports(is_physical=True, is_input=True, is_audio=True)
+        for output, port in zip(self.outputs, playback):
+            try:
+                client.connect(output, port)
+            except jack.JackError as e:
+                print(f"Failed to connect engine output: {e}")
+        self.client = client
+        self.attached = True
+        if self.instrument is not None and self.notes_rate != self.sample_rate:
+            self.request_load(*self.instrument)
+
+    def detach(self, server_lost=False):
+        """Closes the engine client with its ports, once deactivated so that ``process`` is no longer running."""
+        self.attached = False
+        client, self.client = self.client, None
+        if client is not None:
+            if not server_lost:
+                try:
+                    client.deactivate()
+                except jack.JackError as e:
+                    print(f"Failed to deactivate the engine: {e}")
+            try:
+                client.close()
+            except jack.JackError as e:
+                if not server_lost:
+                    print(f"Failed to close the engine client: {e}")
+        self.midi_in = None
+        self.outputs = []
+
+    @property
+    def midi_input_name(self):
+        return self.midi_in.name if self.midi_in is not None else None
+
+    def prepare(self, blocksize):
+        # Called outside the process callback, which then never allocates
+        if len(self._buffer) < blocksize:
+            self._buffer = np.zeros((blocksize, 2), dtype=np.float32)
+        self.mixer.prepare(blocksize)
+
+    def request_load(self, sfz_content, instrument_base_dir):
+        """Queues ``load_instrument`` on the render pool, replacing a load that is still pending or running."""
+        self.instrument = (sfz_content, instrument_base_dir)
+        if self.render_pool is not None:
+            self.render_pool.submit("engine", self.load_instrument, sfz_content, instrument_base_dir)
+
+    def load_instrument(self, sfz_content, instrument_base_dir, job=None):
+        """Renders every key of the instrument, then swaps the note table the engine plays from."""
+        self.instrument = (sfz_content, instrument_base_dir)
+        sample_rate = self.sample_rate
+        notes = [None] * 128
+        batch = []
+        for note in ENGINE_NOTES:
+            batch.append(note)
+            if len(batch) < ENGINE_BATCH and note != ENGINE_NOTES[-1]:
+                continue
+            if job is not None and job.cancelled.is_set():
+                raise RenderCancelled()
+            plans = {note: plan_preview_note(sfz_content, instrument_base_dir, note, sample_rate) for note in batch}
+            buffers = render_preview_notes(sfz_content, instrument_base_dir, plans, sample_rate, job=job) or {}
+            for note, data in buffers.items():
+                plan = plans[note]
+                notes[note] = (data, voice_loop(plan, data), plan.ignore_note_off, plan.release_frames)
+            batch = []
+        if sample_rate != self.sample_rate:
+            return  # The server rate changed meanwhile, attach queued a render at the new rate
+        self.notes = notes
+        self.notes_rate = sample_rate
+
+    def process(self, frames):
+        # JACK process thread of the engine client: no locks, no audio buffer allocations
+        mixer, notes, midi_in, outputs = self.mixer, self.notes, self.midi_in, self.outputs
+        if midi_in is None:
+            return
+        for _, data in midi_in.incoming_midi_events():
+            if len(data) != 3:
+                continue
+            status = data[0] & 0xF0
+            if status == 0x90 and data[2] > 0:
+                entry = notes[data[1]]
+                if entry is not None:
+                    mixer.note_on(data[1], entry[0], loop=entry[1], ignore_note_off=entry[2], release_frames=entry[3])
+            elif status in (0x80, 0x90):
+                mixer.note_off(data[1])
+        if frames > len(self._buffer):
+            return
+        buffer = self._buffer[:frames]
+        mixer.mix(buffer, frames)
+        for channel, output in enumerate(outputs):
+            output.get_array()[:] = buffer[:, channel]
 
 
 class JackClient:
-    def __init__(self):
+    """Drives the sfizz_jack live preview from a worker thread.
+
+    Callers only describe the wanted outcome (instrument, MIDI port) and the worker
+    reconciles the running process with the latest wish, so a burst of start/connect
+    calls collapses into the last one without touching any queue from outside the
+    worker. The worker waits for ``sfz_preview:input`` through JACK's port registration
+    callback, and state changes are reported to listeners added with ``add_state_listener``,
+    called from the worker thread.
+
+    A single JACK client serves the whole process. When the server goes away the worker
+    drops it and tries to reconnect every few seconds; listeners added with
+    ``add_ports_listener`` are told whenever the available ports may have changed.
+
+    With ``set_native_engine(True)`` the MIDI port drives ``engine`` instead of sfizz_jack;
+    its instrument is loaded with ``engine.request_load``, rendering on ``render_pool``. The
+    shared client has no process callback, only the engine's own client has one.
+    """
+
+    def __init__(self, render_pool=None):
         self.client = None
-        self.command_queue = queue.Queue()
+        self.state = STOPPED
+        self.state_listeners = []
+        self.ports_listeners = []
+        self._condition = threading.Condition()
+        self._server_lost = False
+        self.engine = NativeEngine(render_pool)
+        # Wanted instrument as (sfz_file, cwd), MIDI port, and whether the native engine plays it
+        self._wanted_sfz = None
+        self._wanted_port = None
+        self._wanted_engine = False
+        self._generation = 0
+        self._port_ready = False
         self._closed = False
+        self._shutdown = False
         self._close_lock = threading.Lock()
+        self._open_client()
         self.worker_thread = threading.Thread(target=self._worker, daemon=True)
         self.worker_thread.start()
         atexit.register(self.close)
 
-    def _worker(self):
-        preview_process = None
-        worker_client = None
+    def _open_client(self):
+        """Connects to the JACK server, returns False if it is not running."""
+        try:
+            client = jack.Client(CLIENT_NAME, no_start_server=True)
+            client.set_port_registration_callback(self._on_port_registration)
+            client.set_shutdown_callback(self._on_server_shutdown)
+            client.activate()
+            port_ready = bool(client.get_ports(PREVIEW_INPUT_PORT, is_midi=True, is_input=True))
+        except jack.JackError:
+            return False
+        with self._condition:
+            self.client = client
+            self._port_ready = port_ready
+            self._server_lost = False
+        self._notify_ports_changed()
+        return True
 
-        def _get_worker_client():
-            nonlocal worker_client
-            if worker_client is None:
-                # Use a different name for the client in the worker thread
-                worker_client = jack.Client("sfz_generator_worker_client")
-            return worker_client
+    def add_ports_listener(self, callback):
+        """``callback()`` is called, from a JACK or the worker thread, when ports come and go."""
+        self.ports_listeners.append(callback)
 
-        def _stop_process_gracefully(proc):
-            if not proc or proc.poll() is not None:
-                return None
+    def _notify_ports_changed(self):
+        for callback in self.ports_listeners:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error in JACK ports listener: {e}")
+
+    def add_state_listener(self, callback):
+        """``callback(state, message)`` is called on every preview state change."""
+        self.state_listeners.append(callback)
 
+    def _set_state(self, state, message=None):
+        self.state = state
+        for callback in self.state_listeners:
             try:
-                proc.stdin.write(b"quit\n")
-                proc.stdin.flush()
-                proc.wait(timeout=1.0)
-                return None  # Success
-            except (subprocess.TimeoutExpired, BrokenPipeError, OSError):
-                pass  # Didn't quit gracefully, proceed to kill
-
-            if proc.poll() is None:
+                callback(state, message)
+            except Exception as e:
+                print(f"Error in JACK state listener: {e}")
+
+    def _wish(self, **changes):
+        with self._condition:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self._generation += 1
+            self._condition.notify_all()
+
+    def _on_port_registration(self, port, register):
+        # Called from a JACK thread, which must not call back into the client
+        if port.name == PREVIEW_INPUT_PORT:
+            with self._condition:
+                self._port_ready = register
+                self._condition.notify_all()
+        if port.is_midi and port.is_output:
+            self._notify_ports_changed()
+
+    def _on_server_shutdown(self, status, reason):
+        # Called from a JACK thread, the worker closes the client and reconnects
+        with self._condition:
+            self._server_lost = True
+            self._port_ready = False
+            self._generation += 1
+            self._condition.notify_all()
+
+    def _worker(self):
+        preview_process = None
+        # Instrument loaded in the running sfizz_jack, and MIDI port connected to an input
+        loaded_sfz = None
+        connected_port = None
+        connected_input = None
+        # Last wish the worker acted on, and the instrument that failed to start
+        seen_generation = -1
+        failed_sfz = None
+
+        def _disconnect():
+            nonlocal connected_port
+            if connected_port is not None and self.client is not None:
                 try:
-                    proc.terminate()  # SIGTERM
-                    proc.wait(timeout=1.0)
-                    return None
-                except (subprocess.TimeoutExpired, OSError):
-                    pass  # Didn't terminate, proceed to force kill
+                    self.client.disconnect(connected_port, connected_input)
+                except jack.JackError as e:
+                    print(f"Failed to disconnect: {e}")
+            connected_port = None
 
-            if proc.poll() is None:
+        def _connect(wanted_port, midi_input):
+            nonlocal connected_port, connected_input
+            if (wanted_port, midi_input) == (connected_port, connected_input):
+                return
+            _disconnect()
+            connected_input = midi_input
+            if wanted_port is not None:
                 try:
-                    proc.kill()  # SIGKILL
-                    proc.wait()
-                except OSError:
-                    pass  # Already dead
-            return None
+                    self.client.connect(wanted_port, midi_input)
+                    connected_port = wanted_port
+                except jack.JackError as e:
+                    print(f"Failed to connect: {e}")
 
         while True:
+            with self._condition:
+                while self._generation == seen_generation and not self._shutdown:
+                    if not self._condition.wait(timeout=RECONNECT_INTERVAL if self.client is None else None):
+                        break  # Time to retry the server
+                if self._shutdown:
+                    break
+                seen_generation = self._generation
+                wanted_sfz, wanted_port, wanted_engine = self._wanted_sfz, self._wanted_port, self._wanted_engine
+                server_lost = self._server_lost
+
+            if server_lost:
+                client, self.client = self.client, None
+                try:
+                    client.close()
+                except Exception:
+                    pass
+                # sfizz_jack went down with the server, it is started again once it is back
+                preview_process = _stop_process_gracefully(preview_process)
+                loaded_sfz = connected_port = failed_sfz = None
+                self.engine.detach(server_lost=True)
+                self._notify_ports_changed()
+                self._set_state(ERROR, "JACK server stopped")
+            if self.client is None:
+                if not self._open_client():
+                    continue
+                self._set_state(STOPPED)
+
             try:
-                command_tuple = self.command_queue.get()
-                cmd, *args = command_tuple
+                if wanted_engine:
+                    # The engine replaces sfizz_jack and stays up without a MIDI device, for manual patching
+                    preview_process = _stop_process_gracefully(preview_process)
+                    loaded_sfz = failed_sfz = None
+                    if not self.engine.attached:
+                        _disconnect()
+                        self.engine.attach()
+                    _connect(wanted_port, self.engine.midi_input_name)
+                    if self.state != READY:
+                        self._set_state(READY)
+                    continue
+                if self.engine.attached:
+                    _disconnect()
+                    self.engine.detach()
 
-                if cmd == "start":
+                if wanted_sfz is None:
+                    _disconnect()
                     preview_process = _stop_process_gracefully(preview_process)
+                    loaded_sfz = failed_sfz = None
+                    if self.state != STOPPED:
+                        self._set_state(STOPPED)
+                    continue
+
+                sfz_file, cwd = wanted_sfz
+                if preview_process is not None and preview_process.poll() is None:
+                    if sfz_file != loaded_sfz:
+                        # Hot-reload in the running instance, which keeps its ports and connections
+                        try:
+                            preview_process.stdin.write(f"load_instrument {sfz_file}\n".encode())
+                            preview_process.stdin.flush()
+                            loaded_sfz = sfz_file
+                        except (BrokenPipeError, OSError):
+                            preview_process = _stop_process_gracefully(preview_process)
 
-                    sfz_file, cwd = args[0]
-                    command = [
-                        "sfizz_jack",
-                        "--jack_autoconnect",
-                        "1",
-                        "--client_name",
-                        PREVIEW_CLIENT_NAME,
-                        sfz_file,
-                    ]
+                if preview_process is None or preview_process.poll() is not None:
+                    if sfz_file == failed_sfz:
+                        continue  # Wait for another instrument rather than retrying in a loop
+                    self._set_state(STARTING)
+                    connected_port = None
+                    with self._condition:
+                        # The unregistration of a dead instance's port may not have been reported yet
+                        self._port_ready = False
                     preview_process = subprocess.Popen(
-                        command,
+                        [
+                            "sfizz_jack",
+                            "--jack_autoconnect",
+                            "1",
+                            "--client_name",
+                            PREVIEW_CLIENT_NAME,
+                            sfz_file,
+                        ],
                         stdin=subprocess.PIPE,
                         stdout=subprocess.DEVNULL,
                         stderr=subprocess.DEVNULL,
                         cwd=cwd,
                     )
-                    # Wait a bit for sfizz to start and register its ports
-                    time.sleep(0.5)
+                    loaded_sfz = sfz_file
+                    with self._condition:
+                        # Newer wishes are handled once the process is up, a respawn would not be faster
+                        ready = self._condition.wait_for(
+                            lambda: self._port_ready or self._shutdown or preview_process.poll() is not None, timeout=PORT_TIMEOUT
+                        )
+                        ready = ready and self._port_ready
+                    if not ready:
+                        preview_process = _stop_process_gracefully(preview_process)
+                        failed_sfz = sfz_file
+                        self._set_state(ERROR, "sfizz_jack did not register its MIDI input")
+                        continue
+                failed_sfz = None
 
-                elif cmd == "stop":
-                    preview_process = _stop_process_gracefully(preview_process)
+                _connect(wanted_port, PREVIEW_INPUT_PORT)
+                if self.state != READY:
+                    self._set_state(READY)
 
-                elif cmd == "connect":
-                    midi_port = args[0]
-                    client = _get_worker_client()
-                    try:
-                        preview_port = f"{PREVIEW_CLIENT_NAME}:input"
-                        client.connect(midi_port, preview_port)
-                    except jack.JackError as e:
-                        print(f"Failed to connect: {e}")
-
-                elif cmd == "disconnect":
-                    midi_port = args[0]
-                    if worker_client is None:
-                        continue  # No client, so can't be connected.
-                    try:
-                        preview_port = f"{PREVIEW_CLIENT_NAME}:input"
-                        worker_client.disconnect(midi_port, preview_port)
-                    except jack.JackError as e:
-                        print(f"Failed to disconnect: {e}")
-
-                elif cmd == "shutdown":
-                    preview_process = _stop_process_gracefully(preview_process)
-                    if worker_client:
-                        worker_client.close()
-                    break
             except Exception as e:
                 print(f"Error in JackClient worker thread: {e}")
-                # Ensure shutdown command still exits the loop
-                if "cmd" in locals() and cmd == "shutdown":
-                    if worker_client:
-                        worker_client.close()
-                    break
+                self._set_state(ERROR, str(e))
+
+        _disconnect()
+        _stop_process_gracefully(preview_process)
+        if self.engine.attached:
+            self.engine.detach()
 
     def get_midi_ports(self):
-        if not self.is_jack_server_running():
+        client = self.client
+        if client is None:
             return []
         try:
-            if not self.client:
-                self.client = jack.Client("sfz_generator_client")
-            return self.client.get_ports(is_midi=True, is_output=True)
+            return client.get_ports(is_midi=True, is_output=True)
         except jack.JackError:
             return []
 
     def start_preview(self, sfz_file, cwd=None):
-        self.command_queue.queue.clear()
-        self.command_queue.put(("start", (sfz_file, cwd)))
+        self._wish(_wanted_sfz=(sfz_file, cwd))
 
     def stop_preview(self):
-        self.command_queue.put(("stop",))
+        self._wish(_wanted_sfz=None)
+
+    def set_native_engine(self, enabled):
+        self._wish(_wanted_engine=enabled)
 
     def connect(self, midi_port):
-        self.command_queue.put(("connect", midi_port))
+        self._wish(_wanted_port=midi_port)
 
     def disconnect(self, midi_port):
-        self.command_queue.put(("disconnect", midi_port))
+        with self._condition:
+            if self._wanted_port != midi_port:
+                return
+        self._wish(_wanted_port=None)
 
     def is_jack_server_running(self):
-        try:
-            jack.Client("ping")
-            return True
-        except jack.JackError:
-            return False
+        return self.client is not None
 
     def close(self):
         with self._close_lock:
@@ -156,15 +482,18 @@ class JackClient:
                 return
             self._closed = True
 
-        self.command_queue.put(("shutdown",))
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
         try:
             # Add a timeout to join to avoid hanging on exit
             self.worker_thread.join(timeout=3.0)
         except Exception as e:
             print(f"Error joining worker thread: {e}")
 
-        if self.client:
+        client, self.client = self.client, None
+        if client:
             try:
-                self.client.close()
+                client.close()
             except Exception as e:
                 print(f"Error closing jack client: {e}")
@@ -0,0 +1,149 @@
+import numpy as np
+
+from sfz_generator.audio.analysis import zero_crossings_of
+
+# Number of loop end candidates correlated against the search window
+END_CANDIDATES = 24
+# Coarse matches per end candidate refined at full rate
+COARSE_MATCHES = 3
+# Target rate of the coarse correlation pass
+COARSE_RATE = 11025
+SPECTRAL_WEIGHT = 0.5
+
+
+# Hann windows by length, shared by the loop search and the seam meter
+_windows = {}
+
+
+def _hann(length):
+    window = _windows.get(length)
+    if window is None:
+        window = _windows[length] = np.hanning(length).astype(np.float32)
+    return window
+
+
+def _normalized_spectrum(frame):
+    magnitude = np.log1p(np.abs(np.fft.rfft(frame * _hann(len(frame)))))
+    norm = np.linalg.norm(magnitude)
+    return magnitude / norm if norm > 0 else magnitude
+
+
+def _seam_similarity(region, start, end, half):
+    """Normalized correlation between the neighbourhoods of ``start`` and ``end``, in region coordinates."""
+    a = region[end - half : end + half]
+    b = region[start - half : start + half]
+    norm = np.sqrt(np.dot(a, a) * np.dot(b, b))
+    return float(np.dot(a, b) / norm) if norm > 0 else 0.0
+
+
+def find_loop_points(source, sample_rate, zero_crossings, search_start, search_end, min_length, count=5, seam=1024):
+    """Ranks loop points inside ``[search_start, search_end)`` by continuity at the seam.
+
+    Candidate ends are rising zero crossings, each one's neighbourhood is cross-correlated
+    against the whole window at once through the FFT on a decimated copy, and the best
+    matches are refined on the zero-crossing index at full rate. The final score mixes that
+    waveform correlation with a spectral distance between both sides of the seam.
+
+    Returns up to ``count`` ``(loop_start, loop_end, score)`` tuples, best first.
+    """
+    search_start = max(int(search_start), seam)
+    search_end = min(int(search_end), len(source) - seam)
+    if search_end - search_start <= min_length:
+        return []
+
+    offset = search_start - seam
+    region = source[offset : search_end + seam]
+
+    if zero_crossings is None:
+        zero_crossings = zero_crossings_of(region, offset)
+    crossings = np.asarray(zero_crossings, dtype=np.int64)
+    crossings = crossings[(crossings >= search_start) & (crossings < search_end)] - offset
+    # Only rising crossings, so both sides of the seam share the same slope direction
+    crossings = crossings[region[crossings] >= 0]
+    if len(crossings) < 2:
+        return []
+
+    ends = crossings[crossings >= seam + min_length]
+    if len(ends) == 0:
+        return []
+    ends = ends[np.unique(np.linspace(0, len(ends) - 1, min(END_CANDIDATES, len(ends))).astype(np.intp))]
+
+    # Coarse pass on a boxcar-decimated copy of the window
+    factor = max(1, sample_rate // COARSE_RATE)
+    usable = len(region) // factor * factor
+    coarse = region[:usable].reshape(-1, factor).mean(axis=1)
+    half = max(seam // factor, 1)
+    template_length = 2 * half
+    n_fft = 1 << int(np.ceil(np.log2(len(coarse) + template_length)))
+    coarse_spectrum = np.fft.rfft(coarse, n_fft)
+    squares = np.cumsum(np.concatenate([[0.0], coarse.astype(np.float64) ** 2]))
+    window_energy = squares[template_length:] - squares[:-template_length]
+
+    candidates = []
+    for end in ends:
+        center = end // factor
+        template = coarse[center - half : center + half]
+        template_norm = np.linalg.norm(template)
+        if len(template) < template_length or template_norm == 0:
+            continue
+        correlation = np.fft.irfft(coarse_spectrum * np.conj(np.fft.rfft(template, n_fft)), n_fft)[: len(window_energy)]
+        ncc = correlation / (template_norm * np.sqrt(np.maximum(window_energy, 1e-12)))
+
+        # Window k covers coarse[k:k + template_length], centered on k + half
+        last = (end - min_length) // factor - half
+        if last <= 0:
+            continue
+        ncc = ncc[:last]
+        peaks = np.flatnonzero((ncc[1:-1] >= ncc[:-2]) & (ncc[1:-1] >= ncc[2:])) + 1
+        for k in peaks[np.argsort(ncc[peaks])[::-1][:COARSE_MATCHES]]:
+            approx = (k + half) * factor
+            lo, hi = np.searchsorted(crossings, [approx - 2 * factor, approx + 2 * factor + 1])
+            for start in crossings[lo:hi]:
+                if seam <= start <= end - min_length:
+                    candidates.append((_seam_similarity(region, start, end, seam), int(start), int(end)))
+
+    if not candidates:
+        return []
+
+    # Spectral continuity for the best waveform matches only
+    candidates.sort(reverse=True)
+    results = []
+    for similarity, start, end in candidates[: count * 8]:
+        before = _normalized_spectrum(region[end - seam : end]) - _normalized_spectrum(region[start - seam : start])
+        after = _normalized_spectrum(region[end : end + seam]) - _normalized_spectrum(region[start : start + seam])
+        spectral_distance = 0.5 * (np.linalg.norm(before) + np.linalg.norm(after))
+        results.append((similarity - SPECTRAL_WEIGHT * spectral_distance, start + offset, end + offset))
+
+    results.sort(reverse=True)
+    unique = []
+    for score, start, end in results:
+        if all(abs(start - s) > seam or abs(end - e) > seam for s, e, _ in unique):
+            unique.append((start, end, float(score)))
+        if len(unique) == count:
+            break
+    return unique
+
+
+def seam_quality(source, loop_start, loop_end, window=256):
+    """Measures how audible the jump from ``loop_end`` back to ``loop_start`` is, in O(window).
+
+    ``loop_end`` is exclusive: the seam replaces the frame at ``loop_end`` by the one at
+    ``loop_start``. Returns ``(score, jump, slope, spectral)`` where the components are the
+    amplitude jump and slope mismatch relative to the local RMS, and the log-spectrum distance
+    between the frames preceding both points. ``score`` is 1 for a perfect seam and tends to 0.
+    Returns None when either point is too close to the sample edges.
+    """
+    if loop_start < window or loop_end + 2 > len(source) or loop_end - loop_start < 2:
+        return None
+    before_start = source[loop_start - window : loop_start + 2]
+    before_end = source[loop_end - window : loop_end + 2]
+
+    rms = np.sqrt(0.5 * (np.dot(before_start, before_start) + np.dot(before_end, before_end)) / len(before_end))
+    if rms <= 0:
+        return 1.0, 0.0, 0.0, 0.0
+    # Frame played after the seam versus the frame it replaces, and their slopes
+    jump = abs(before_start[window] - before_end[window]) / rms
+    slope = abs((before_start[window + 1] - before_start[window]) - (before_end[window + 1] - before_end[window])) / rms
+    spectral = float(np.linalg.norm(_normalized_spectrum(before_end[:window]) - _normalized_spectrum(before_start[:window])))
+    score = 1.0 / (1.0 + 2.0 * jump + slope + 4.0 * spectral)
+    return float(score), float(jump), float(slope), spectral
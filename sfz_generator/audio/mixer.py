@@ -0,0 +1,206 @@
+import itertools
+from collections import deque
+
+import numpy as np
+import sounddevice as sd
+
+MIXER_SAMPLE_RATE = 48000
+MIXER_CHANNELS = 2
+VOICE_COUNT = 16
+# Fade applied when a voice is cut by a note-off or stolen, avoids clicks
+NOTE_OFF_FADE = 0.005
+
+
+class Voice:
+    """One playing buffer in the mixer's fixed-size pool."""
+
+    def __init__(self):
+        self.active = False
+        self.id = None
+        self.note = None
+        self.buffer = None
+        self.position = 0
+        self.loop = None
+        self.ignore_note_off = False
+        self.release_frames = 0
+        self.releasing = False
+        self.release_position = 0
+        self.pending = False
+        self.started = 0
+
+    def start(self, voice_id, note, buffer, loop, ignore_note_off, release_frames, pending, started):
+        self.id = voice_id
+        self.note = note
+        self.buffer = buffer if buffer.ndim == 2 else buffer[:, None]
+        self.position = 0
+        self.loop = loop
+        self.ignore_note_off = ignore_note_off
+        self.release_frames = max(1, release_frames)
+        self.releasing = False
+        self.release_position = 0
+        self.pending = pending
+        self.started = started
+        self.active = True
+
+    def release(self):
+        if not self.releasing:
+            self.releasing = True
+            self.release_position = 0
+
+
+class Mixer:
+    """Long-lived output stream mixing a fixed pool of voices.
+
+    Note-on/off messages are pushed to a deque, whose append and popleft are atomic, and
+    drained at the start of each audio callback, so callers never block on the audio
+    thread and notes play concurrently. ``finished_callback(note)`` is called from the
+    audio thread when a voice ends.
+
+    With ``output`` False no stream is opened: the owner calls ``mix`` from its own audio
+    callback, after sizing the scratch buffers with ``prepare``.
+    """
+
+    def __init__(self, finished_callback=None, sample_rate=MIXER_SAMPLE_RATE, channels=MIXER_CHANNELS, voices=VOICE_COUNT, output=True):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.finished_callback = finished_callback
+        self.output = output
+        self.voices = [Voice() for _ in range(voices)]
+        self.events = deque()
+        self.stream = None
+        self._counter = 0
+        self._ids = itertools.count()
+        self._ramp = np.empty(0, dtype=np.float32)
+        self._fade = np.empty(0, dtype=np.float32)
+        self._scratch = np.empty((0, channels), dtype=np.float32)
+
+    def start(self):
+        if self.output and self.stream is None:
+            self.stream = sd.OutputStream(samplerate=self.sample_rate, channels=self.channels, dtype="float32", callback=self._callback)
+            self.stream.start()
+
+    def close(self):
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            stream.abort()
+            stream.close()
+
+    def note_on(self, note, buffer, loop=None, ignore_note_off=False, release_frames=None, pending=False, voice_id=None):
+        """Queues ``buffer`` (frames x channels at the mixer rate) to play for ``note``, returns the voice id.
+
+        ``loop`` is an optional ``(start, end)`` frame range repeated until note-off.
+        Voices with ``ignore_note_off`` play to the end of their buffer regardless.
+        A ``pending`` voice only holds the beginning of the note: reaching its end waits for
+        ``continue_voice`` instead of ending the voice. ``voice_id`` lets a caller relaying
+        notes from elsewhere keep its own ids.
+        """
+        if release_frames is None:
+            release_frames = int(NOTE_OFF_FADE * self.sample_rate)
+        if voice_id is None:
+            voice_id = next(self._ids)
+        self.start()
+        self.events.append(("on", voice_id, note, buffer, loop, ignore_note_off, release_frames, pending))
+        return voice_id
+
+    def continue_voice(self, voice_id, buffer, loop=None):
+        """Swaps the buffer of a pending voice for the whole note, ``buffer`` must start with the frames already queued.
+
+        Playback carries on from the current position, so both share one timeline. With a None
+        ``buffer`` the voice simply ends with what it has.
+        """
+        self.events.append(("continue", voice_id, buffer, loop))
+
+    def note_off(self, note):
+        self.events.append(("off", note))
+
+    def _allocate_voice(self):
+        oldest = self.voices[0]
+        for voice in self.voices:
+            if not voice.active:
+                return voice
+            if voice.started < oldest.started:
+                oldest = voice
+        # Steal the oldest voice
+        voice = oldest
+        self._end_voice(voice)
+        return voice
+
+    def _end_voice(self, voice):
+        voice.active = False
+        voice.buffer = None
+        if self.finished_callback is not None:
+            self.finished_callback(voice.note)
+
+    def _handle_events(self):
+        while self.events:
+            event = self.events.popleft()
+            if event[0] == "on":
+                _, voice_id, note, buffer, loop, ignore_note_off, release_frames, pending = event
+                self._counter += 1
+                self._allocate_voice().start(voice_id, note, buffer, loop, ignore_note_off, release_frames, pending, self._counter)
+            elif event[0] == "continue":
+                _, voice_id, buffer, loop = event
+                for voice in self.voices:
+                    if voice.active and voice.id == voice_id:
+                        if buffer is not None and len(buffer) > voice.position:
+                            voice.buffer = buffer if buffer.ndim == 2 else buffer[:, None]
+                            voice.loop = loop
+                        voice.pending = False
+            elif event[0] == "off":
+                for voice in self.voices:
+                    if voice.active and voice.note == event[1] and not voice.ignore_note_off:
+                        voice.release()
+
+    def prepare(self, frames):
+        """Grows the scratch buffers for blocks of up to ``frames`` frames."""
+        if len(self._scratch) < frames:
+            self._scratch = np.empty((frames, self.channels), dtype=np.float32)
+            self._ramp = np.arange(frames, dtype=np.float32)
+            self._fade = np.empty(frames, dtype=np.float32)
+
+    def _callback(self, outdata, frames, time, status):
+        self.mix(outdata, frames)
+
+    def mix(self, outdata, frames):
+        """Renders the next ``frames`` frames of every voice into ``outdata``."""
+        outdata.fill(0)
+        self._handle_events()
+        self.prepare(frames)
+
+        for voice in self.voices:
+            if voice.active:
+                self._mix_voice(voice, outdata, frames)
+
+    def _mix_voice(self, voice, outdata, frames):
+        written = 0
+        while written < frames and voice.active:
+            end = voice.loop[1] if voice.loop is not None and not voice.releasing else len(voice.buffer)
+            if voice.position >= end:
+                if voice.loop is not None and not voice.releasing:
+                    voice.position = voice.loop[0]
+                    continue
+                if voice.pending and not voice.releasing:
+                    # Hold the timeline until the rest of the note arrives
+                    break
+                self._end_voice(voice)
+                break
+
+            count = min(frames - written, end - voice.position)
+            chunk = voice.buffer[voice.position : voice.position + count]
+            target = outdata[written : written + count]
+            if voice.releasing:
+                remaining = voice.release_frames - voice.release_position
+                count = min(count, remaining)
+                fade = self._fade[:count]
+                np.subtract(remaining, self._ramp[:count], out=fade)
+                fade *= 1.0 / voice.release_frames
+                scratch = self._scratch[:count]
+                np.multiply(chunk[:count], fade[:, None], out=scratch)
+                target[:count] += scratch
+                voice.release_position += count
+                if voice.release_position >= voice.release_frames:
+                    self._end_voice(voice)
+            else:
+                target += chunk
+            voice.position += count
+            written += count
@@ -0,0 +1,317 @@
+"""
+Runs the preview mixer in a child process, so its audio callback never waits for the GIL of the GUI.
+
+Commands and events travel through fixed-size records in shared-memory rings, and note
+buffers are copied once into shared memory blocks the child maps by name.
+"""
+
+import itertools
+import multiprocessing
+import threading
+import weakref
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from sfz_generator.audio.mixer import MIXER_CHANNELS, MIXER_SAMPLE_RATE, NOTE_OFF_FADE, VOICE_COUNT, Mixer
+
+RING_CAPACITY = 256
+# Seconds a side blocked on a ring waits before checking that the other process is still alive
+LIVENESS_INTERVAL = 1.0
+
+NOTE_ON, CONTINUE, NOTE_OFF, FREE, CLOSE, FINISHED = range(6)
+RECORD = np.dtype(
+    [
+        ("kind", np.uint8),
+        ("note", np.int16),
+        ("voice", np.int64),
+        ("frames", np.int64),
+        ("channels", np.uint8),
+        ("loop_start", np.int64),
+        ("loop_end", np.int64),
+        ("ignore_note_off", np.bool_),
+        ("release_frames", np.int64),
+        ("pending", np.bool_),
+        ("name", "S32"),
+    ]
+)
+BLANK_RECORD = np.zeros((), dtype=RECORD)
+# Write and read counters ahead of the records
+HEADER_BYTES = 16
+
+
+class SharedRing:
+    """Single-producer single-consumer ring of ``RECORD`` entries in shared memory.
+
+    Two semaphores count the filled and the free slots, so each side sleeps until the other
+    one has made room or added a record, and each counter is only written by its owner.
+    A ring passed to a child process as a ``Process`` argument is attached there.
+    """
+
+    def __init__(self, capacity=RING_CAPACITY, context=None):
+        context = context or multiprocessing.get_context("spawn")
+        self.items = context.Semaphore(0)
+        self.space = context.Semaphore(capacity)
+        self._attach(shared_memory.SharedMemory(create=True, size=HEADER_BYTES + capacity * RECORD.itemsize), capacity)
+        self.counters[:] = 0
+
+    def _attach(self, shm, capacity):
+        self.shm = shm
+        self.capacity = capacity
+        self.counters = np.ndarray(2, dtype=np.int64, buffer=shm.buf)
+        self.records = np.ndarray(capacity, dtype=RECORD, buffer=shm.buf, offset=HEADER_BYTES)
+
+    def __getstate__(self):
+        # Semaphores can only be pickled while spawning a process
+        return self.shm.name, self.capacity, self.items, self.space
+
+    def __setstate__(self, state):
+        name, capacity, self.items, self.space = state
+        self._attach(shared_memory.SharedMemory(name=name), capacity)
+
+    def put(self, kind, timeout=None, **fields):
+        """Appends a record, waiting for a free slot; returns False if none was freed within ``timeout``."""
+        if not self.space.acquire(timeout=timeout):
+            return False
+        write = int(self.counters[0])
+        self.records[write % self.capacity] = BLANK_RECORD
+        record = self.records[write % self.capacity]
+        record["kind"] = kind
+        for field, value in fields.items():
+            record[field] = value
+        self.counters[0] = write + 1
+        self.items.release()
+        return True
+
+    def get(self, timeout=None):
+        """Returns the oldest record, waiting for one; None if nothing arrived within ``timeout``."""
+        if not self.items.acquire(timeout=timeout):
+            return None
+        read = int(self.counters[1])
+        record = self.records[read % self.capacity].copy()
+        self.counters[1] = read + 1
+        self.space.release()
+        return record
+
+    def close(self, unlink=False):
+        del self.counters, self.records
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class RemoteMixer:
+    """Same interface as ``Mixer``, backed by a mixer running in a child process.
+
+    Each buffer is copied to shared memory on its first note-on and reused for as long as
+    the buffer object lives, so cached renders are shared rather than sent again.
+    ``finished_callback(note)`` is called from an event thread of this process.
+    """
+
+    def __init__(self, finished_callback=None, sample_rate=MIXER_SAMPLE_RATE, channels=MIXER_CHANNELS, voices=VOICE_COUNT):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.finished_callback = finished_callback
+        context = multiprocessing.get_context("spawn")
+        self.commands = SharedRing(context=context)
+        self.events = SharedRing(context=context)
+        # id(buffer): (weak reference, shared memory block, finalizer)
+        self.shared = {}
+        self.closed = False
+        self._ids = itertools.count()
+        # Render workers and the note worker all send commands, the ring has one producer.
+        # Reentrant since a buffer finalizer may run while a command is being sent, its command
+        # is then deferred until the send in progress is complete
+        self._lock = threading.RLock()
+        self._sending = False
+        self._deferred = []
+        self.process = context.Process(target=_mixer_main, args=(self.commands, self.events, sample_rate, channels, voices), daemon=True)
+        self.process.start()
+        self.event_thread = threading.Thread(target=self._event_worker, daemon=True)
+        self.event_thread.start()
+
+    def start(self):
+        pass  # The child opens its stream as soon as it runs
+
+    def _send(self, kind, **fields):
+        with self._lock:
+            if self.closed:
+                return
+            if self._sending:
+                self._deferred.append((kind, fields))
+                return
+            self._sending = True
+            try:
+                pending = [(kind, fields)]
+                while pending:
+                    kind, fields = pending.pop(0)
+                    while not self.commands.put(kind, timeout=LIVENESS_INTERVAL, **fields):
+                        if not self.process.is_alive():
+                            return
+                    pending.extend(self._deferred)
+                    self._deferred.clear()
+            finally:
+                self._sending = False
+
+    def _share(self, buffer):
+        """Returns the shared memory name holding ``buffer``, copying it there the first time."""
+        key = id(buffer)
+        with self._lock:
+            entry = self.shared.get(key)
+            if entry is not None and entry[0]() is buffer:
+                return entry[1].name
+            data = np.ascontiguousarray(buffer if buffer.ndim == 2 else buffer[:, None], dtype=np.float32)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+            np.ndarray(data.shape, dtype=np.float32, buffer=shm.buf)[:] = data
+            self.shared[key] = (weakref.ref(buffer), shm, weakref.finalize(buffer, self._free, key, shm))
+            return shm.name
+
+    def _free(self, key, shm):
+        with self._lock:
+            entry = self.shared.get(key)
+            if entry is not None and entry[1] is shm:
+                del self.shared[key]
+            if self.closed:
+                shm.close()
+                shm.unlink()
+                return
+            # Commands are handled in order, so the child unlinks the block after every note using it
+            self._send(FREE, name=shm.name)
+            shm.close()
+
+    def _buffer_fields(self, buffer, loop):
+        frames, channels = (buffer.shape[0], buffer.shape[1] if buffer.ndim == 2 else 1)
+        loop_start, loop_end = loop if loop is not None else (-1, -1)
+        return dict(name=self._share(buffer), frames=frames, channels=channels, loop_start=loop_start, loop_end=loop_end)
+
+    def note_on(self, note, buffer, loop=None, ignore_note_off=False, release_frames=None, pending=False):
+        if release_frames is None:
+            release_frames = int(NOTE_OFF_FADE * self.sample_rate)
+        voice_id = next(self._ids)
+        self._send(
+            NOTE_ON,
+            note=note,
+            voice=voice_id,
+            ignore_note_off=ignore_note_off,
+            release_frames=release_frames,
+            pending=pending,
+            **self._buffer_fields(buffer, loop),
+        )
+        return voice_id
+
+    def continue_voice(self, voice_id, buffer, loop=None):
+        if buffer is None:
+            self._send(CONTINUE, voice=voice_id)
+        else:
+            self._send(CONTINUE, voice=voice_id, **self._buffer_fields(buffer, loop))
+
+    def note_off(self, note):
+        self._send(NOTE_OFF, note=note)
+
+    def _event_worker(self):
+        while True:
+            record = self.events.get(timeout=LIVENESS_INTERVAL)
+            if record is None:
+                if self.closed or not self.process.is_alive():
+                    return
+            elif record["kind"] == CLOSE:
+                return
+            elif record["kind"] == FINISHED and self.finished_callback is not None:
+                self.finished_callback(int(record["note"]))
+
+    def close(self):
+        if self.closed:
+            return
+        self._send(CLOSE)
+        self.closed = True
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.event_thread.join(timeout=2.0)
+        # Finalizers release blocks still shared, the child is gone so they are unlinked here
+        for _, _, finalizer in list(self.shared.values()):
+            finalizer()
+        self.commands.close(unlink=True)
+        self.events.close(unlink=True)
+
+
+def _mixer_main(commands, events, sample_rate, channels, voices):
+    # The audio thread only queues ended notes, a forwarder thread waits for room in the event
+    # ring so that none is lost while the GUI process is slow to read them
+    finished = deque()
+    finished_ready = threading.Semaphore(0)
+
+    def on_finished(note):
+        finished.append(note)
+        finished_ready.release()
+
+    def forward_events():
+        while True:
+            finished_ready.acquire()
+            note = finished.popleft()
+            if note is None:
+                events.put(CLOSE)
+                return
+            events.put(FINISHED, note=note)
+
+    forwarder = threading.Thread(target=forward_events, daemon=True)
+    forwarder.start()
+    mixer = Mixer(finished_callback=on_finished, sample_rate=sample_rate, channels=channels, voices=voices)
+    mixer.start()
+    buffers = {}
+    parent = multiprocessing.parent_process()
+
+    def buffer(record):
+        name = record["name"].decode()
+        if name not in buffers:
+            shm = shared_memory.SharedMemory(name=name)
+            buffers[name] = (shm, np.ndarray((record["frames"], record["channels"]), dtype=np.float32, buffer=shm.buf))
+        return buffers[name][1]
+
+    def loop(record):
+        return (int(record["loop_start"]), int(record["loop_end"])) if record["loop_start"] >= 0 else None
+
+    while True:
+        record = commands.get(timeout=LIVENESS_INTERVAL)
+        if record is None:
+            if parent is not None and not parent.is_alive():
+                break
+            continue
+
+        kind = record["kind"]
+        if kind == NOTE_ON:
+            mixer.note_on(
+                int(record["note"]),
+                buffer(record),
+                loop=loop(record),
+                ignore_note_off=bool(record["ignore_note_off"]),
+                release_frames=int(record["release_frames"]),
+                pending=bool(record["pending"]),
+                voice_id=int(record["voice"]),
+            )
+        elif kind == CONTINUE:
+            data = buffer(record) if record["name"] else None
+            mixer.continue_voice(int(record["voice"]), data, loop=loop(record))
+        elif kind == NOTE_OFF:
+            mixer.note_off(int(record["note"]))
+        elif kind == FREE:
+            # The mapping stays valid after the unlink, it is closed once the last voice playing
+            # the buffer (or a view of it) drops it: numpy views do not prevent closing it
+            entry = buffers.pop(record["name"].decode(), None)
+            if entry is not None:
+                entry[0].unlink()
+                weakref.finalize(entry[1], entry[0].close)
+                entry = None
+            else:
+                shm = shared_memory.SharedMemory(name=record["name"].decode())
+                shm.close()
+                shm.unlink()
+        elif kind == CLOSE:
+            break
+
+    mixer.close()
+    on_finished(None)
+    forwarder.join(timeout=1.0)
+    commands.close()
+    events.close()
@@ -0,0 +1,72 @@
+import numpy as np
+
+YIN_THRESHOLD = 0.1
+# Frames whose best CMNDF value is above this are considered unvoiced
+VOICED_THRESHOLD = 0.35
+
+
+def _analysis_frames(source, sample_rate, frame_length, num_windows):
+    """Picks ``num_windows`` frames just after the loudest part of the first seconds of the sample."""
+    head = source[: min(len(source), int(sample_rate * 3))]
+    if len(head) < frame_length:
+        return None
+
+    hop = max(frame_length // 4, 1)
+    count = (len(head) - frame_length) // hop + 1
+    energy = np.add.reduceat(head[: count * hop] ** 2, np.arange(0, count * hop, hop))
+    # Skip the attack transient, the body of the note is steadier
+    start = min(int(np.argmax(energy)) * hop + int(0.05 * sample_rate), len(head) - frame_length)
+    starts = start + np.arange(num_windows) * (frame_length // 2)
+    starts = starts[starts + frame_length <= len(head)]
+    if len(starts) == 0:
+        starts = np.array([len(head) - frame_length])
+    return head[starts[:, None] + np.arange(frame_length)]
+
+
+def detect_root_pitch(source, sample_rate, fmin=40.0, fmax=2000.0, window=2048, num_windows=4):
+    """Estimates the fundamental of a sample with a vectorized YIN over a few analysis windows.
+
+    Returns ``(midi_note, cents)`` where ``midi_note`` is the nearest MIDI note and ``cents``
+    the offset of the detected pitch from it, or None if no stable pitch was found.
+    """
+    max_tau = int(sample_rate / fmin)
+    min_tau = max(2, int(sample_rate / fmax))
+    frames = _analysis_frames(source, sample_rate, window + max_tau, num_windows)
+    if frames is None:
+        return None
+    frames = frames - frames.mean(axis=1, keepdims=True)
+
+    # Difference function d(tau) = E(0) + E(tau) - 2 r(tau), with r computed through the FFT
+    n_fft = 1 << int(np.ceil(np.log2(frames.shape[1] + window)))
+    spectrum = np.fft.rfft(frames, n_fft)
+    reference = np.fft.rfft(frames[:, :window], n_fft)
+    correlation = np.fft.irfft(np.conj(reference) * spectrum, n_fft)[:, : max_tau + 1]
+    squares = np.cumsum(np.pad(frames**2, ((0, 0), (1, 0))), axis=1)
+    energy = squares[:, window : window + max_tau + 1] - squares[:, : max_tau + 1]
+    difference = np.maximum(energy[:, :1] + energy - 2 * correlation, 0)
+
+    # Cumulative mean normalized difference
+    taus = np.arange(max_tau + 1)
+    running = np.cumsum(difference[:, 1:], axis=1)
+    cmndf = np.ones_like(difference)
+    cmndf[:, 1:] = difference[:, 1:] * taus[1:] / np.maximum(running, 1e-12)
+
+    estimates = []
+    for row in cmndf:
+        below = np.flatnonzero(row[min_tau:max_tau] < YIN_THRESHOLD)
+        tau = below[0] + min_tau if len(below) else int(np.argmin(row[min_tau:max_tau])) + min_tau
+        while tau + 1 < max_tau and row[tau + 1] < row[tau]:
+            tau += 1
+        if row[tau] > VOICED_THRESHOLD:
+            continue
+        # Parabolic interpolation around the minimum
+        left, center, right = row[tau - 1], row[tau], row[tau + 1]
+        denominator = left - 2 * center + right
+        shift = 0.5 * (left - right) / denominator if denominator > 0 else 0.0
+        estimates.append(sample_rate / (tau + shift))
+
+    if not estimates:
+        return None
+    midi = 69 + 12 * np.log2(float(np.median(estimates)) / 440.0)
+    note = int(np.clip(round(midi), 0, 127))
+    return note, float((midi - note) * 100)
@@ -1,42 +1,186 @@
+import numpy as np
 import sounddevice as sd
 from gi.repository import GLib
 
+from sfz_generator.audio.dsp import crossfade_tail
 
-def play(audio_data, sample_rate, loop, loop_start, loop_end, stop_event, error_callback, finished_callback):
-    """Plays audio data using sounddevice."""
 
-    if audio_data is None:
-        GLib.idle_add(finished_callback)
-        return
+class Player:
+    """Plays an AudioSource from a sounddevice callback.
 
-    channels = 1 if audio_data.ndim == 1 else audio_data.shape[1]
-    frames_per_chunk = max(sample_rate // 20, 1024)
+    The callback reads straight from the source into the output buffer at a position
+    counter, wrapping sample-accurately at the loop end. Loop points can be moved while
+    playing and stopping aborts the stream, so it takes effect within one buffer. It only
+    takes frames the source already decoded: the source decodes ahead of the position in
+    the background, the loop start and the first block are prepared from the GUI thread.
 
-    def as_frames(buffer):
-        return buffer.reshape(-1, 1) if channels == 1 else buffer
+    With a loop crossfade, only the last ``crossfade_frames`` of the loop are rendered into a
+    crossfaded tail, rebuilt when the loop points or the crossfade change; the rest of the
+    loop is read from the source. An optional Envelope is
+    applied as a per-block gain curve, ``release`` starts its release stage.
 
-    try:
-        with sd.OutputStream(samplerate=sample_rate, channels=channels, dtype=audio_data.dtype) as stream:
-            if loop and loop_start is not None and loop_end is not None and loop_end > loop_start:
-                loop_segment = audio_data[loop_start:loop_end]
-                if loop_segment.size == 0:
-                    GLib.idle_add(finished_callback)
-                    return
-                loop_frames = as_frames(loop_segment)
-                while not stop_event.is_set():
-                    stream.write(loop_frames)
+    ``playhead`` holds the first frame of the block last handed to the device, or -1 when
+    stopped. It is a one-element array written only by the callback, so views can poll it
+    at display rate without locks or per-block notifications.
+    """
+
+    def __init__(self):
+        self.stream = None
+        self.source = None
+        self.position = 0
+        self.playhead = np.full(1, -1, dtype=np.int64)
+        self.looping = False
+        self.loop = None
+        self.crossfade_frames = 0
+        self.envelope = None
+        self.elapsed = 0
+        self.release_requested = False
+        self.released_at = None
+        self.release_level = 0.0
+        self.finished_callback = None
+        self._gain = np.empty(0, dtype=np.float32)
+        self._token = None
+
+    def play(self, source, sample_rate, loop, loop_start, loop_end, error_callback, finished_callback, envelope=None, crossfade_frames=0):
+        self.stop()
+        if source is None:
+            GLib.idle_add(finished_callback)
+            return
+
+        self.source = source
+        self.finished_callback = finished_callback
+        self.envelope = envelope
+        self.crossfade_frames = int(crossfade_frames)
+        self.elapsed = 0
+        self.release_requested = False
+        self.released_at = None
+        self.looping = bool(loop)
+        self.loop = None
+        self.position = 0
+        if loop:
+            self.set_loop_points(loop_start, loop_end)
+            if self.loop is None:
+                GLib.idle_add(finished_callback)
+                return
+            self.position = self.loop[0]
+        # The first frames are decoded here rather than missed by the callback
+        source.prefetch(self.position, self.position + 1, wait=True)
+
+        token = object()
+        try:
+            self.stream = sd.OutputStream(
+                samplerate=sample_rate,
+                channels=1,
+                dtype="float32",
+                callback=self._callback,
+                finished_callback=lambda: GLib.idle_add(self._finished, token),
+            )
+            self._token = token
+            self.stream.start()
+        except Exception as e:
+            self.stream = None
+            GLib.idle_add(error_callback, str(e))
+            GLib.idle_add(finished_callback)
+
+    def set_loop_points(self, loop_start, loop_end):
+        """Moves the loop while playing, only has an effect if playback was started looped."""
+        if not self.looping or self.source is None or loop_start is None or loop_end is None:
+            return
+        loop_start = int(loop_start)
+        loop_end = min(int(loop_end), len(self.source))
+        if loop_end > loop_start:
+            self.source.prefetch(loop_start, loop_start + 1)
+            tail = crossfade_tail(self.source, loop_start, loop_end, self.crossfade_frames) if self.crossfade_frames > 0 else None
+            # Swapped as a single tuple so the callback never sees a half-updated loop
+            self.loop = (loop_start, loop_end, tail if tail is not None and len(tail) else None)
+
+    def set_crossfade(self, crossfade_frames):
+        crossfade_frames = int(crossfade_frames)
+        if crossfade_frames != self.crossfade_frames:
+            self.crossfade_frames = crossfade_frames
+            if self.loop is not None:
+                self.set_loop_points(self.loop[0], self.loop[1])
+
+    def set_envelope(self, envelope):
+        self.envelope = envelope
+
+    def release(self):
+        """Lets the envelope release stage play out, stops immediately if there is none."""
+        envelope = self.envelope
+        if self.stream is None or envelope is None or envelope.release_frames == 0:
+            self.stop()
+            return
+        self.release_requested = True
+
+    def stop(self):
+        stream, self.stream = self.stream, None
+        self._token = None
+        if stream is not None:
+            stream.abort()
+            stream.close()
+        self.playhead[0] = -1
+
+    def _callback(self, outdata, frames, time, status):
+        out = outdata[:, 0]
+        loop = self.loop
+        position = self.position
+        written = 0
+        ended = False
+        while written < frames:
+            if loop is not None and not loop[0] <= position < loop[1]:
+                position = loop[0]
+            if written == 0:
+                self.playhead[0] = position
+            limit = loop[1] if loop is not None else len(self.source)
+            tail_start = limit - len(loop[2]) if loop is not None and loop[2] is not None else limit
+            if loop is not None and position >= tail_start:
+                target = out[written : written + min(frames - written, limit - position)]
+                offset = position - tail_start
+                target[:] = loop[2][offset : offset + len(target)]
+                count = len(target)
             else:
-                frames = as_frames(audio_data)
-                total_frames = frames.shape[0]
-                current_frame = 0
-                while current_frame < total_frames and not stop_event.is_set():
-                    chunk_end = min(current_frame + frames_per_chunk, total_frames)
-                    stream.write(frames[current_frame:chunk_end])
-                    current_frame = chunk_end
-            if stop_event.is_set():
-                stream.abort()
-
-    except Exception as e:
-        GLib.idle_add(error_callback, str(e))
-    finally:
-        GLib.idle_add(finished_callback)
+                target = out[written : written + min(frames - written, tail_start - position)]
+                count = self.source.read_ready(position, target)
+            written += count
+            position += count
+            if count == 0 or count < len(target):
+                # Past the end, or the decoder fell behind: silence until the next buffer
+                out[written:] = 0
+                ended = position >= len(self.source)
+                break
+        self.position = position
+        if loop is not None:
+            self.source.prefetch(loop[0], loop[0] + 1)
+
+        if not self._apply_envelope(out) or ended:
+            raise sd.CallbackStop
+
+    def _apply_envelope(self, out):
+        """Multiplies ``out`` by the envelope, returns False once the release is over."""
+        envelope = self.envelope
+        frames = len(out)
+        if envelope is None or (envelope.is_flat and not self.release_requested):
+            self.elapsed += frames
+            return True
+
+        if len(self._gain) < frames:
+            self._gain = np.empty(frames, dtype=np.float32)
+        gain = self._gain[:frames]
+
+        if self.release_requested and self.released_at is None:
+            self.released_at = self.elapsed
+            self.release_level = envelope.level(self.elapsed)
+        if self.released_at is None:
+            envelope.gain(self.elapsed, gain)
+            playing = True
+        else:
+            playing = envelope.release_gain(self.release_level, self.elapsed - self.released_at, gain)
+        out *= gain
+        self.elapsed += frames
+        return playing
+
+    def _finished(self, token):
+        # Streams replaced or stopped from the GUI are not reported
+        if token is self._token:
+            self.stop()
+            self.finished_callback()
@@ -7,9 +7,42 @@ from midiutil import MIDIFile
 import subprocess
 import os
 import tempfile
-import sounddevice as sd
+import functools
+import hashlib
+import math
+import re
+import threading
+from collections import namedtuple
+
+import numpy as np
 import soundfile as sf
 
+from sfz_generator.audio import renderer
+from sfz_generator.audio.render_cache import sfz_text_hash
+from sfz_generator.sfz.parser import parse_sfz_content
+from sfz_generator.sfz.region_index import RegionIndex
+from sfz_generator.utils import user_cache_dir
+
+PREVIEW_TEMPO = 120
+# Velocity of the notes sfizz_render and the in-process renderer play
+PREVIEW_VELOCITY = 100
+# Length of the notes played from the piano preview
+PREVIEW_NOTE_BEATS = 4
+# Level under which the end of a rendered note is trimmed
+SILENCE_THRESHOLD = 1e-4
+# Length of the quick first render played while the whole note renders
+PREVIEW_ATTACK_SECONDS = 0.3
+# Instrument files kept for the live (sfizz_jack) preview
+MAX_PREVIEW_FILES = 64
+# Largest phase jump, in output frames, allowed where the mixer wraps a rendered sustain loop
+LOOP_PHASE_TOLERANCE = 0.05
+# Longest sustain loop rendered to get its cycles within that tolerance
+MAX_LOOP_SECONDS = 8.0
+
+# How a note is rendered and played back: ``loop`` is a (start, end) frame range of the
+# rendered buffer looped until note-off, end None for the whole buffer.
+PreviewPlan = namedtuple("PreviewPlan", "duration_beats loop ignore_note_off release_frames")
+
 
 def note_name_to_midi(note_name):
     """Convert note name (e.g., 'C4', 'D#5') to MIDI number."""
@@ -35,7 +68,7 @@ def create_sequence_midi(notes_sequence, output_file="sequence.mid", tempo=120,
     Create a MIDI file from a sequence of notes and durations.
 
     Args:
-        notes_sequence: List of tuples (note, duration_in_beats)
+        notes_sequence: List of tuples (note, duration_in_beats), a None note is a rest
         output_file: Output MIDI filename
         tempo: Tempo in BPM (default 120)
         velocity: Note velocity 0-127 (default 100)
@@ -52,6 +85,9 @@ def create_sequence_midi(notes_sequence, output_file="sequence.mid", tempo=120,
     # Calculate timing and add notes
     current_time = 0
     for note, duration in notes_sequence:
+        if note is None:  # Rest
+            current_time += duration
+            continue
         if isinstance(note, str):
             midi_note = note_name_to_midi(note)
         else:
@@ -66,10 +102,111 @@ def create_sequence_midi(notes_sequence, output_file="sequence.mid", tempo=120,
     return output_file
 
 
-def play_sfz_note(sfz_content, instrument_base_dir, note, duration_beats, lock, stop_event):
+@functools.lru_cache(maxsize=4)
+def get_region_index(sfz_content, instrument_base_dir=None):
+    """Returns the parsed ``SfzInstrument`` and its ``RegionIndex``, kept for the last few instrument texts."""
+    instrument = parse_sfz_content(sfz_content, instrument_base_dir)
+    return instrument, RegionIndex(instrument.regions)
+
+
+def get_preview_region(sfz_content, note, instrument_base_dir=None):
+    """
+    Returns the opcodes of the first region playing ``note`` at the preview velocity, inherited ones
+    included and the sample prefixed with ``default_path``, or None if no region covers it.
+    """
+    instrument, index = get_region_index(sfz_content, instrument_base_dir)
+    region = index.first_region(note, PREVIEW_VELOCITY)
+    return instrument.regions.region(region) if region is not None else None
+
+
+def _sample_info(opcodes, instrument_base_dir):
+    sample = opcodes.get("sample", "").strip()
+    if not sample:
+        return None
+    path = os.path.join(instrument_base_dir or "", opcodes.get("default_path", ""), sample.replace("\\", "/"))
+    try:
+        info = sf.info(path)
+    except Exception:
+        return None
+    return info.frames, info.samplerate
+
+
+def loop_cycles(cycle_frames, max_frames):
+    """
+    Number of loop cycles of ``cycle_frames`` output frames (fractional once pitched) to loop together,
+    so that they end within ``LOOP_PHASE_TOLERANCE`` of a whole frame and looping them keeps the phase.
+    Falls back to the closest count fitting in ``max_frames``.
+    """
+    best, best_error = 1, 1.0
+    for cycles in range(1, max(1, int(max_frames // cycle_frames)) + 1):
+        length = cycles * cycle_frames
+        error = abs(length - round(length))
+        if error <= LOOP_PHASE_TOLERANCE:
+            return cycles
+        if error < best_error:
+            best, best_error = cycles, error
+    return best
+
+
+def plan_preview_note(sfz_content, instrument_base_dir, note, sample_rate):
+    """
+    Decides how much of ``note`` to render from the instrument's opcodes:
+    one_shot renders the sample length, no_loop the note length (capped to the sample length)
+    followed by sfizz_render's release tail, and loop_sustain stops after the loop cycles following
+    the envelope settling, which the mixer then loops until note-off. As many cycles are taken as
+    needed to end on a whole output frame, so the wrap does not jump in phase.
+    """
+    opcodes = get_preview_region(sfz_content, note, instrument_base_dir) or {}
+    loop_mode = opcodes.get("loop_mode", "no_loop").strip()
+    # one_shot and loop_continuous ignore note-off, sfizz_render already made the sound loop for the latter
+    ignore_note_off = loop_mode in ["one_shot", "loop_continuous"]
+
+    def number(opcode, default=0.0):
+        try:
+            return float(opcodes.get(opcode, default))
+        except ValueError:
+            return default
+
+    release_frames = int(number("ampeg_release") * sample_rate) or None
+    plan = PreviewPlan(PREVIEW_NOTE_BEATS, None, ignore_note_off, release_frames)
+    whole_loop = plan._replace(loop=(0, None)) if loop_mode == "loop_sustain" else plan
+
+    info = _sample_info(opcodes, instrument_base_dir)
+    if info is None or loop_mode == "loop_continuous":
+        return whole_loop
+    frames, sample_sr = info
+    # Seconds of output per sample frame once pitched to this note
+    frame_seconds = 1.0 / sample_sr / 2 ** ((note - number("pitch_keycenter", 60)) / 12)
+
+    def beats(seconds):
+        return seconds * PREVIEW_TEMPO / 60
+
+    if loop_mode == "one_shot":
+        return plan._replace(duration_beats=beats(frames * frame_seconds))
+    if loop_mode != "loop_sustain":
+        return plan._replace(duration_beats=min(PREVIEW_NOTE_BEATS, beats(frames * frame_seconds)))
+
+    if "loop_start" not in opcodes or "loop_end" not in opcodes:
+        return whole_loop
+    loop_start = number("loop_start") * frame_seconds
+    cycle = (number("loop_end") + 1 - number("loop_start")) * frame_seconds
+    if cycle <= 0:
+        return whole_loop
+    settle = number("ampeg_delay") + number("ampeg_attack") + number("ampeg_hold") + number("ampeg_decay")
+    start = loop_start + max(0, math.ceil((settle - loop_start) / cycle)) * cycle
+    length = loop_cycles(cycle * sample_rate, MAX_LOOP_SECONDS * sample_rate) * cycle
+    first = int(round(start * sample_rate))
+    loop = (first, first + int(round(length * sample_rate)))
+    return plan._replace(duration_beats=beats(start + length), loop=loop)
+
+
+def render_sfz_notes(sfz_content, instrument_base_dir, notes, sample_rate, gap_beats=0, tempo=PREVIEW_TEMPO, use_eot=False, job=None):
     """
-    Generate MIDI for a single note and play it with sfizz_render,
-    respecting different loop modes with interruptible, chunked playback.
+    Render several ``(note, duration_beats)`` in a single sfizz_render run, one after the other.
+    ``gap_beats`` after each note leave room for its release before the next one starts.
+    With ``use_eot`` the render stops at the end of the MIDI sequence instead of after the release tails.
+    When rendering for a RenderJob, cancelling it kills sfizz_render and raises RenderCancelled.
+    Returns a dict mapping each note to its float32 frames (frames x channels), or None on failure.
     """
     with tempfile.TemporaryDirectory() as tmpdir:
         sfz_file = os.path.join(tmpdir, "preview.sfz")
@@ -79,60 +216,241 @@ def play_sfz_note(sfz_content, instrument_base_dir, note, duration_beats, lock,
         midi_file = os.path.join(tmpdir, "temp_sequence.mid")
         output_wav = os.path.join(tmpdir, "preview.wav")
 
-        create_sequence_midi([(note, duration_beats)], midi_file)
+        sequence = []
+        for note, duration_beats in notes:
+            sequence.append((note, duration_beats))
+            if gap_beats:
+                sequence.append((None, gap_beats))
+        create_sequence_midi(sequence, midi_file, tempo=tempo)
 
         try:
-            cmd = ["sfizz_render", "--sfz", sfz_file, "--midi", midi_file, "--wav", output_wav]
-            subprocess.run(cmd, check=True, capture_output=True, cwd=instrument_base_dir)
+            cmd = ["sfizz_render", "--sfz", sfz_file, "--midi", midi_file, "--wav", output_wav, "--samplerate", str(sample_rate)]
+            if use_eot:
+                cmd.append("--use-eot")
+            if job is not None:
+                job.run_process(cmd, cwd=instrument_base_dir)
+            else:
+                subprocess.run(cmd, check=True, capture_output=True, cwd=instrument_base_dir)
         except (FileNotFoundError, subprocess.CalledProcessError) as e:
             print(f"Error rendering note: {e}")
-            return
+            return None
 
         try:
-            with lock:
-                data, samplerate = sf.read(output_wav, dtype="float32")
-
-                with sd.OutputStream(samplerate=samplerate, channels=data.shape[1] if data.ndim > 1 else 1, dtype="float32") as stream:
-                    # --- Parse loop_mode ---
-                    loop_mode = "no_loop"  # default
-                    if "loop_mode=one_shot" in sfz_content:
-                        loop_mode = "one_shot"
-                    elif "loop_mode=loop_sustain" in sfz_content:
-                        loop_mode = "loop_sustain"
-                    elif "loop_mode=loop_continuous" in sfz_content:
-                        loop_mode = "loop_continuous"
-
-                    # --- Playback logic ---
-                    frames_per_chunk = 1024
-
-                    def as_frames(buffer):
-                        return buffer.reshape(-1, 1) if (buffer.ndim == 1) else buffer
-
-                    frames = as_frames(data)
-                    total_frames = len(frames)
-
-                    def play_chunked(stream, frames_to_play, stop_event):
-                        current_frame = 0
-                        while current_frame < total_frames and not stop_event.is_set():
-                            chunk_end = min(current_frame + frames_per_chunk, total_frames)
-                            stream.write(frames_to_play[current_frame:chunk_end])
-                            current_frame = chunk_end
-
-                    if loop_mode in ["one_shot", "loop_continuous"]:
-                        # These modes ignore note-off. Play the full rendered buffer.
-                        # sfizz_render handles making the sound loop for loop_continuous.
-                        stream.write(frames)
-
-                    elif loop_mode == "loop_sustain":
-                        play_chunked(stream, frames, stop_event)
-                        while not stop_event.is_set():
-                            play_chunked(stream, frames, stop_event)
-
-                    else:  # no_loop (default)
-                        play_chunked(stream, frames, stop_event)
-
-                    if stop_event.is_set():
-                        stream.abort(ignore_xruns=True)
-
+            data, _ = sf.read(output_wav, dtype="float32", always_2d=True)
         except Exception as e:
-            print(f"Error playing audio: {e}")
+            print(f"Error reading rendered note: {e}")
+            return None
+
+    def frame(beats):
+        return int(round(beats * 60 / tempo * sample_rate))
+
+    buffers = {}
+    time = 0
+    for i, (note, duration_beats) in enumerate(notes):
+        start = frame(time)
+        time += duration_beats + gap_beats
+        # The last note keeps whatever tail sfizz_render produced after it
+        frames = data[start : frame(time)] if i < len(notes) - 1 else data[start:]
+        # Trailing silence of the gap is not worth caching
+        held = frame(duration_beats)
+        audible = np.flatnonzero(np.abs(frames[held:]).max(axis=1) > SILENCE_THRESHOLD)
+        end = held + (audible[-1] + 1 if len(audible) else 0)
+        # Copied, so evicting one note from the cache frees its memory
+        buffers[note] = frames[:end].copy()
+    return buffers
+
+
+# One in-process renderer per render thread, they keep scratch buffers and open samples
+_renderers = threading.local()
+
+
+def render_in_process(sfz_content, instrument_base_dir, plans, sample_rate):
+    """Renders the ``{note: PreviewPlan}`` dict without sfizz_render, returns None if the instrument is not supported."""
+    if not renderer.supports(sfz_content):
+        return None
+    in_process = getattr(_renderers, "renderer", None)
+    if in_process is None or in_process.sample_rate != sample_rate:
+        in_process = _renderers.renderer = renderer.Renderer(sample_rate)
+
+    buffers = {}
+    for note, plan in plans.items():
+        opcodes = get_preview_region(sfz_content, note, instrument_base_dir)
+        if opcodes is None:
+            buffers[note] = np.zeros((0, 1), dtype=np.float32)
+            continue
+        data = in_process.render(opcodes, instrument_base_dir, note, plan.duration_beats * 60 / PREVIEW_TEMPO)
+        if data is None:
+            return None
+        buffers[note] = data
+    return buffers
+
+
+def render_preview_notes(sfz_content, instrument_base_dir, plans, sample_rate, gap_beats=0, in_process=True, job=None):
+    """
+    Renders the notes of the ``{note: PreviewPlan}`` dict, sustain loops are cut after their loop cycle.
+    Instruments the in-process renderer supports skip sfizz_render unless ``in_process`` is False.
+    """
+    buffers = render_in_process(sfz_content, instrument_base_dir, plans, sample_rate) if in_process else None
+    if buffers is None:
+        buffers = render_sfz_notes(
+            sfz_content, instrument_base_dir, [(note, plan.duration_beats) for note, plan in plans.items()], sample_rate, gap_beats, job=job
+        )
+    if buffers is not None:
+        for note, plan in plans.items():
+            if plan.loop is not None and plan.loop[1] is not None:
+                buffers[note] = buffers[note][: plan.loop[1]]
+    return buffers
+
+
+def get_cached_preview(cache, sfz_content, instrument_base_dir, note, sample_rate):
+    """Returns the ``(plan, frames)`` of ``note``, frames being None if it was not rendered yet."""
+    plan = plan_preview_note(sfz_content, instrument_base_dir, note, sample_rate)
+    data = cache.get(sfz_text_hash(sfz_content, instrument_base_dir), note, plan.duration_beats) if cache is not None else None
+    return plan, data
+
+
+def prerender_sfz_notes(cache, sfz_content, instrument_base_dir, notes, sample_rate, job=None):
+    """
+    Fill ``cache`` with ``notes`` rendered in one sfizz_render run, so the first press of each key
+    does not have to start its own. Notes already cached are skipped.
+    """
+    sfz_hash = sfz_text_hash(sfz_content, instrument_base_dir)
+    if cache.current_hash not in (None, sfz_hash):
+        return
+    plans = {}
+    for note in notes:
+        plan, data = get_cached_preview(cache, sfz_content, instrument_base_dir, note, sample_rate)
+        if data is None:
+            plans[note] = plan
+    if not plans:
+        return
+
+    # Leave enough space between notes for the release tail
+    release = max(plan.release_frames or 0 for plan in plans.values()) / sample_rate
+    gap_beats = math.ceil(release * PREVIEW_TEMPO / 60) + 1
+    buffers = render_preview_notes(sfz_content, instrument_base_dir, plans, sample_rate, gap_beats, job=job)
+    if buffers is not None:
+        for note, data in buffers.items():
+            cache.put(sfz_hash, note, plans[note].duration_beats, data)
+
+
+def play_sfz_note(mixer, sfz_content, instrument_base_dir, note, stop_event, cache=None, job=None):
+    """
+    Render a single note and play it on ``mixer``, respecting the different loop modes.
+    A note released (``stop_event`` set) while rendering is only played by modes that ignore note-off.
+    Renders are looked up in and added to ``cache``, a RenderCache, when given.
+    Uncached notes first render and start a short attack, then continue it with the whole note.
+    Returns True if a voice was started.
+    """
+    plan, data = get_cached_preview(cache, sfz_content, instrument_base_dir, note, mixer.sample_rate)
+    if data is not None:
+        return _start_preview_voice(mixer, note, plan, data, stop_event) is not None
+
+    attack_beats = PREVIEW_ATTACK_SECONDS * PREVIEW_TEMPO / 60
+    if plan.duration_beats <= 2 * attack_beats or renderer.supports(sfz_content):
+        buffers = render_preview_notes(sfz_content, instrument_base_dir, {note: plan}, mixer.sample_rate, job=job)
+        if buffers is None:
+            return False
+        _store_preview(cache, sfz_content, instrument_base_dir, note, plan, buffers[note])
+        return _start_preview_voice(mixer, note, plan, buffers[note], stop_event) is not None
+
+    # Two stages: the attack sounds as soon as it is rendered, the whole note continues it on the same timeline
+    attack = render_sfz_notes(sfz_content, instrument_base_dir, [(note, attack_beats)], mixer.sample_rate, use_eot=True, job=job)
+    if attack is None:
+        return False
+    voice_id = _start_preview_voice(mixer, note, plan._replace(loop=None), attack[note], stop_event, pending=True)
+    if voice_id is None:
+        return False
+
+    buffers = None
+    try:
+        buffers = render_preview_notes(sfz_content, instrument_base_dir, {note: plan}, mixer.sample_rate, job=job)
+    finally:
+        # Without a continuation (failure, note-off) the voice ends with its attack
+        if buffers is None:
+            mixer.continue_voice(voice_id, None)
+    if buffers is not None:
+        data = buffers[note]
+        _store_preview(cache, sfz_content, instrument_base_dir, note, plan, data)
+        mixer.continue_voice(voice_id, data, loop=voice_loop(plan, data))
+    return True
+
+
+def _store_preview(cache, sfz_content, instrument_base_dir, note, plan, data):
+    if cache is not None:
+        cache.put(sfz_text_hash(sfz_content, instrument_base_dir), note, plan.duration_beats, data)
+
+
+def voice_loop(plan, data):
+    """The loop a voice plays ``data`` rendered for ``plan`` with, the whole buffer when the planned cycle is not in it."""
+    loop = plan.loop
+    if loop is not None and (loop[1] is None or loop[1] > len(data)):
+        loop = (0, len(data))
+    return loop
+
+
+def _start_preview_voice(mixer, note, plan, data, stop_event, pending=False):
+    """Starts the voice unless the note was released first, returns its id or None."""
+    if stop_event.is_set() and not plan.ignore_note_off:
+        return None
+    voice_id = mixer.note_on(
+        note, data, loop=voice_loop(plan, data), ignore_note_off=plan.ignore_note_off, release_frames=plan.release_frames, pending=pending
+    )
+    # The note-off may have been queued before this note-on, so it is sent again
+    if stop_event.is_set():
+        mixer.note_off(note)
+    return voice_id
+
+
+def with_absolute_paths(sfz_content, instrument_base_dir):
+    """Makes sample paths of ``sfz_content`` independent of its location, resolving them from ``instrument_base_dir``."""
+    if not instrument_base_dir:
+        return sfz_content
+    if re.search(r"(?<!\w)default_path=", sfz_content):
+        return re.sub(
+            r"(?<!\w)default_path=(.*?)(?=\s+\w+=|\s*<|\s*$)",
+            lambda m: "default_path=" + os.path.join(os.path.abspath(os.path.join(instrument_base_dir, m.group(1))), ""),
+            sfz_content,
+            flags=re.MULTILINE,
+        )
+    default_path = "default_path=" + os.path.join(os.path.abspath(instrument_base_dir), "")
+    if "<control>" in sfz_content:
+        return sfz_content.replace("<control>", "<control>\n" + default_path, 1)
+    return f"<control>\n{default_path}\n{sfz_content}"
+
+
+def preview_cache_dir():
+    """Folder of the instrument files written for the live preview."""
+    return user_cache_dir("preview")
+
+
+def write_preview_sfz(sfz_content, instrument_base_dir=None):
+    """
+    Writes the instrument to a content-addressed file of the preview cache and returns its path.
+    Unchanged content maps to the existing file, so it is written once and can be compared by path.
+    """
+    sfz_content = with_absolute_paths(sfz_content, instrument_base_dir)
+    directory = preview_cache_dir()
+    path = os.path.join(directory, hashlib.sha1(sfz_content.encode()).hexdigest() + ".sfz")
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(sfz_content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    # Keep only the most recently used instruments
+    entries = sorted((e for e in os.scandir(directory) if e.name.endswith(".sfz")), key=lambda e: e.stat().st_mtime, reverse=True)
+    for entry in entries[MAX_PREVIEW_FILES:]:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+    return path
@@ -1,24 +1,21 @@
-import numpy as np
 import soundfile as sf
 import os
 import librosa
+from sfz_generator.audio.source import open_audio_source
 from sfz_generator.utils import midi_to_name
 
 
 def load_audio(file_path):
-    """Loads an audio file, converts it to mono, and returns data and sample rate."""
-    try:
-        audio_data, sample_rate = sf.read(file_path)
-        # Convert to mono if stereo
-        if len(audio_data.shape) > 1:
-            audio_data = np.mean(audio_data, axis=1)
-
-        # Normalize to 16-bit integer range for playback
-        audio_data_int16 = (audio_data * 32767).astype(np.int16)
+    """Opens an audio file as a mono float32 AudioSource, returns it and its sample rate.
 
-        return audio_data, audio_data_int16, sample_rate, None
+    Nothing is decoded up front: PCM files are memory-mapped and compressed ones are
+    decoded block by block as they are read, a background thread decoding ahead of the player.
+    """
+    try:
+        source = open_audio_source(file_path)
+        return source, source.sample_rate, None
     except Exception as e:
-        return None, None, None, str(e)
+        return None, None, str(e)
 
 
 def process_midi_note(args):
@@ -0,0 +1,62 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+MAX_RENDER_CACHE_BYTES = 256 << 20
+
+
+def sfz_text_hash(sfz_content, instrument_base_dir=None):
+    """Identifies an instrument by its text and the folder its relative sample paths resolve from."""
+    digest = hashlib.blake2b(sfz_content.encode(), digest_size=16)
+    digest.update(b"\0" + (instrument_base_dir or "").encode())
+    return digest.hexdigest()
+
+
+class RenderCache:
+    """Memory-bounded LRU of rendered note buffers keyed by ``(sfz hash, note, duration)``.
+
+    Shared between the render workers, so every access holds a lock. Buffers are stored
+    as-is and must not be modified by callers.
+    """
+
+    def __init__(self, max_bytes=MAX_RENDER_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.current_hash = None
+        self.lock = threading.Lock()
+
+    def get(self, sfz_hash, note, duration):
+        key = (sfz_hash, note, duration)
+        with self.lock:
+            buffer = self.entries.get(key)
+            if buffer is not None:
+                self.entries.move_to_end(key)
+            return buffer
+
+    def put(self, sfz_hash, note, duration, buffer):
+        key = (sfz_hash, note, duration)
+        with self.lock:
+            # Renders of an instrument that was replaced meanwhile are not worth keeping
+            if self.current_hash is not None and sfz_hash != self.current_hash:
+                return
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous.nbytes
+            if buffer.nbytes > self.max_bytes:
+                return
+            self.entries[key] = buffer
+            self.size += buffer.nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def set_instrument(self, sfz_hash):
+        """Drops every buffer rendered from another instrument, returns True if it changed."""
+        with self.lock:
+            if sfz_hash == self.current_hash:
+                return False
+            self.current_hash = sfz_hash
+            self.entries.clear()
+            self.size = 0
+            return True
@@ -0,0 +1,115 @@
+import heapq
+import itertools
+import os
+import subprocess
+import threading
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class RenderJob:
+    """A queued render that can be cancelled at any time, killing its subprocess if one is running."""
+
+    def __init__(self, key, func, args, kwargs):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = threading.Event()
+        self.process = None
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled.set()
+            if self.process is not None:
+                self.process.kill()
+
+    def run_process(self, cmd, cwd=None):
+        """Runs ``cmd`` like ``subprocess.run(check=True)``, raises RenderCancelled if the job is cancelled."""
+        with self.lock:
+            if self.cancelled.is_set():
+                raise RenderCancelled()
+            self.process = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            stdout, stderr = self.process.communicate()
+        finally:
+            with self.lock:
+                process, self.process = self.process, None
+        if self.cancelled.is_set():
+            raise RenderCancelled()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+
+
+class RenderPool:
+    """Runs preview renders on a few worker threads, most recently submitted first.
+
+    Submitting a job with the key of a pending or running one cancels the older job, so
+    a burst of changes or clicks only leaves the latest render of each key to do. Jobs
+    receive themselves as the ``job`` keyword argument to run their subprocess through it.
+    """
+
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            # A warmup and a clicked note can render side by side, the rest waits its turn
+            max_workers = min(2, os.cpu_count() or 1)
+        self.queue = []
+        self.jobs = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(max_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, key, func, *args, **kwargs):
+        job = RenderJob(key, func, args, kwargs)
+        with self.condition:
+            previous = self.jobs.get(key)
+            if previous is not None:
+                previous.cancel()
+            self.jobs[key] = job
+            heapq.heappush(self.queue, (-next(self.counter), job))
+            self.condition.notify()
+        return job
+
+    def cancel(self, key):
+        with self.condition:
+            job = self.jobs.pop(key, None)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+            self.queue.clear()
+            self.condition.notify_all()
+        for job in jobs:
+            job.cancel()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                _, job = heapq.heappop(self.queue)
+            if job.cancelled.is_set():
+                continue
+            try:
+                job.func(*job.args, job=job, **job.kwargs)
+            except RenderCancelled:
+                pass
+            except Exception as e:
+                print(f"Error rendering preview: {e}")
+            finally:
+                with self.condition:
+                    if self.jobs.get(job.key) is job:
+                        del self.jobs[job.key]
@@ -0,0 +1,301 @@
+"""
+In-process renderer for the SFZ opcodes the generator writes, avoiding a sfizz_render run per preview.
+
+Run ``python -m sfz_generator.audio.renderer --parity <file.sfz> [note ...]`` to compare it
+against sfizz_render on an instrument, it exits with an error when a note differs too much.
+"""
+
+import math
+import os
+import re
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from sfz_generator.audio.dsp import Envelope, crossfade_tail
+from sfz_generator.audio.source import open_audio_source
+
+SUPPORTED_HEADERS = {"control", "global", "master", "group", "region"}
+SUPPORTED_OPCODES = {
+    "sample",
+    "default_path",
+    "key",
+    "lokey",
+    "hikey",
+    "pitch_keycenter",
+    "loop_mode",
+    "loop_start",
+    "loop_end",
+    "loop_crossfade",
+    "ampeg_delay",
+    "ampeg_attack",
+    "ampeg_hold",
+    "ampeg_decay",
+    "ampeg_sustain",
+    "ampeg_release",
+    "trigger",
+}
+# Samples kept open between renders, and crossfaded loop tails kept
+MAX_CACHED_SAMPLES = 8
+# Longest sample span read for one note (about 3 minutes at 48 kHz), longer notes are left to sfizz_render
+MAX_RENDER_SPAN = 1 << 23
+# Largest span buffer kept between renders, bigger ones are freed after their render
+MAX_SCRATCH_SPAN = 1 << 20
+# Lowest signal to noise ratio against sfizz_render accepted by the parity check
+PARITY_MIN_SNR = 30.0
+
+
+def supports(sfz_content):
+    """True if ``sfz_content`` only uses headers and opcodes this renderer implements."""
+    text = re.sub(r"//.*", "", sfz_content)
+    if re.search(r"^\s*#", text, re.MULTILINE):
+        return False
+    headers = set(re.findall(r"<(\w+)>", text))
+    opcodes = set(re.findall(r"(\w+)=", text))
+    return headers <= SUPPORTED_HEADERS and opcodes <= SUPPORTED_OPCODES
+
+
+class Renderer:
+    """Renders single notes of a region with linear-interpolated resampling, SFZ loop modes and the amp envelope.
+
+    The whole note is computed with array operations over scratch buffers that are kept
+    between renders and only grow, so a render allocates nothing but its output. Samples
+    are read through their AudioSource, only up to the last frame the note reaches; spans
+    longer than ``MAX_SCRATCH_SPAN`` get a buffer of their own instead of growing the
+    scratch one. One renderer must only be used by one thread at a time.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.samples = OrderedDict()
+        # Crossfaded loop tails by (path, loop_start, loop_end, crossfade): (source, tail)
+        self.crossfaded = OrderedDict()
+        self._span = np.empty(0, dtype=np.float32)
+        self._ramp = np.empty(0, dtype=np.float64)
+        self._positions = np.empty(0, dtype=np.float64)
+        self._index = np.empty(0, dtype=np.intp)
+        self._next = np.empty(0, dtype=np.intp)
+        self._frac = np.empty(0, dtype=np.float32)
+        self._next_value = np.empty(0, dtype=np.float32)
+        self._gain = np.empty(0, dtype=np.float32)
+
+    def _scratch(self, frames):
+        if len(self._positions) < frames:
+            self._ramp = np.arange(frames, dtype=np.float64)
+            self._positions = np.empty(frames, dtype=np.float64)
+            self._index = np.empty(frames, dtype=np.intp)
+            self._next = np.empty(frames, dtype=np.intp)
+            self._frac = np.empty(frames, dtype=np.float32)
+            self._next_value = np.empty(frames, dtype=np.float32)
+            self._gain = np.empty(frames, dtype=np.float32)
+
+    def load_sample(self, path):
+        """Returns the AudioSource of ``path``, kept open while the file does not change."""
+        key = (path, os.stat(path).st_mtime_ns)
+        source = self.samples.get(key)
+        if source is None:
+            source = self.samples[key] = open_audio_source(path)
+            while len(self.samples) > MAX_CACHED_SAMPLES:
+                self.samples.popitem(last=False)
+        self.samples.move_to_end(key)
+        return source
+
+    def crossfade_tail(self, path, source, loop_start, loop_end, crossfade):
+        """Returns the crossfaded loop tail of ``source``, reused while the sample and loop stay the same."""
+        key = (path, loop_start, loop_end, crossfade)
+        entry = self.crossfaded.get(key)
+        if entry is None or entry[0] is not source:
+            entry = self.crossfaded[key] = (source, crossfade_tail(source, loop_start, loop_end, crossfade))
+            while len(self.crossfaded) > MAX_CACHED_SAMPLES:
+                self.crossfaded.popitem(last=False)
+        self.crossfaded.move_to_end(key)
+        return entry[1]
+
+    def _read_span(self, source, frames):
+        """Reads the first ``frames`` of ``source`` into the span buffer, zero-padded past its end."""
+        if len(self._span) < frames:
+            span = np.empty(frames, dtype=np.float32)
+            if frames <= MAX_SCRATCH_SPAN:
+                self._span = span
+        else:
+            span = self._span
+        span = span[:frames]
+        count = source.read_into(0, span)
+        span[count:] = 0
+        return span
+
+    def render(self, opcodes, instrument_base_dir, note, duration, velocity=100):
+        """
+        Renders ``note`` held for ``duration`` seconds through the region ``opcodes`` (merged over its headers).
+        Returns a new (frames x 1) float32 array, or None if the sample cannot be read or the note
+        reaches further than ``MAX_RENDER_SPAN`` frames into it.
+        """
+        sample = opcodes.get("sample", "").strip().replace("\\", "/")
+        path = os.path.join(instrument_base_dir or "", opcodes.get("default_path", ""), sample)
+        try:
+            source = self.load_sample(path)
+        except Exception as e:
+            print(f"Error loading sample for rendering: {e}")
+            return None
+        sample_rate = source.sample_rate
+        length = len(source)
+
+        def number(opcode, default=0.0):
+            try:
+                return float(opcodes.get(opcode, default))
+            except ValueError:
+                return default
+
+        loop_mode = opcodes.get("loop_mode", "no_loop").strip()
+        release_trigger = opcodes.get("trigger", "attack").strip() == "release"
+        envelope = Envelope(
+            self.sample_rate,
+            delay=number("ampeg_delay"),
+            attack=number("ampeg_attack"),
+            hold=number("ampeg_hold"),
+            decay=number("ampeg_decay"),
+            sustain=number("ampeg_sustain", 100) / 100.0,
+            release=number("ampeg_release"),
+        )
+        # Source frames advanced per output frame
+        step = 2 ** ((note - number("pitch_keycenter", 60)) / 12) * sample_rate / self.sample_rate
+        held = int(round(duration * self.sample_rate))
+        linear_frames = math.ceil(length / step)
+
+        loop_start = int(number("loop_start"))
+        loop_end = min(int(number("loop_end", length - 1)) + 1, length)
+        looping = loop_mode in ["loop_sustain", "loop_continuous"] and 0 <= loop_start < loop_end
+
+        # Frames sounding before the note is released, and the frame where the voice stops
+        if release_trigger:
+            offset, frames, looped, sustained = held, held + linear_frames, 0, linear_frames
+        elif loop_mode == "one_shot":
+            offset, frames, looped, sustained = 0, linear_frames, 0, linear_frames
+        elif loop_mode == "loop_continuous" and looping:
+            offset, frames, looped, sustained = 0, held + envelope.release_frames, held + envelope.release_frames, held
+        elif looping:
+            offset, looped, sustained = 0, held, held
+            # After note-off playback leaves the loop and runs to the sample end at most
+            if held * step >= loop_end:
+                released_position = loop_start + (held * step - loop_start) % (loop_end - loop_start)
+            else:
+                released_position = held * step
+            frames = held + min(envelope.release_frames, math.ceil((length - released_position) / step))
+        else:
+            sustained = min(held, linear_frames)
+            offset, frames, looped = 0, min(linear_frames, held + envelope.release_frames), 0
+        if frames <= 0:
+            return np.zeros((0, 1), dtype=np.float32)
+
+        out = np.zeros((frames, 1), dtype=np.float32)
+        count = frames - offset
+        self._scratch(count)
+        positions = self._positions[:count]
+        index = self._index[:count]
+        next_index = self._next[:count]
+        frac = self._frac[:count]
+        next_value = self._next_value[:count]
+        gain = self._gain[:count]
+
+        # Read positions, wrapped inside the loop while it is active
+        np.multiply(self._ramp[:count], step, out=positions)
+        if looped:
+            # Frames from the first one reaching the loop end are folded back into the loop
+            wrapped = positions[math.ceil(loop_end / step) : looped]
+            wrapped -= loop_start
+            np.mod(wrapped, loop_end - loop_start, out=wrapped)
+            wrapped += loop_start
+            if looped < count:
+                positions[looped:] += positions[looped - 1] + step - positions[looped]
+        index[:] = positions
+        np.subtract(positions, index, out=frac, casting="same_kind")
+        np.add(index, 1, out=next_index)
+        if looped:
+            # Interpolate across the seam towards the loop start
+            next_index[:looped][next_index[:looped] == loop_end] = loop_start
+        np.minimum(index, length, out=index)
+        np.minimum(next_index, length, out=next_index)
+
+        # Only the frames the note reaches are read, frame ``length`` reads as silence
+        span = int(max(index.max(), next_index.max())) + 1
+        if span > MAX_RENDER_SPAN:
+            return None
+        data = self._read_span(source, span)
+        if looping and span >= loop_end:
+            crossfade = int(number("loop_crossfade") * sample_rate)
+            if crossfade > 0:
+                tail = self.crossfade_tail(path, source, loop_start, loop_end, crossfade)
+                data[loop_end - len(tail) : loop_end] = tail
+
+        # Linear interpolation: a + (b - a) * frac
+        target = out[offset:, 0]
+        np.take(data, index, out=target)
+        np.take(data, next_index, out=next_value)
+        next_value -= target
+        next_value *= frac
+        target += next_value
+
+        # Amp envelope, with the velocity curve of sfizz (squared) for the fixed preview velocity
+        if sustained >= count:
+            envelope.gain(0, gain)
+        else:
+            envelope.gain(0, gain[:sustained])
+            envelope.release_gain(envelope.level(sustained), 0, gain[sustained:])
+        gain *= (velocity / 127.0) ** 2
+        target *= gain
+        return out
+
+
+def compare_with_sfizz(sfz_content, base_dir, note, sample_rate=48000):
+    """
+    Renders ``note`` in-process and with sfizz_render, returns ``(snr_db, gain)`` of ours against
+    theirs over their common length, or None if either render failed.
+    """
+    from sfz_generator.audio.preview import PREVIEW_TEMPO, get_preview_region, plan_preview_note, render_preview_notes
+
+    plan = plan_preview_note(sfz_content, base_dir, note, sample_rate)
+    opcodes = get_preview_region(sfz_content, note, base_dir)
+    ours = Renderer(sample_rate).render(opcodes, base_dir, note, plan.duration_beats * 60 / PREVIEW_TEMPO) if opcodes is not None else None
+    reference = render_preview_notes(sfz_content, base_dir, {note: plan._replace(loop=None)}, sample_rate, in_process=False)
+    if ours is None or reference is None:
+        return None
+    theirs = reference[note].mean(axis=1)
+    ours = ours[:, 0]
+    frames = min(len(ours), len(theirs))
+    a, b = ours[:frames], theirs[:frames]
+    energy = float(np.dot(b, b))
+    error = float(np.dot(a - b, a - b))
+    snr = 10 * np.log10(energy / error) if error > 0 and energy > 0 else float("inf")
+    gain = float(np.sqrt(np.dot(a, a) / energy)) if energy > 0 else 0.0
+    return snr, gain
+
+
+def _parity(sfz_file, notes, min_snr=PARITY_MIN_SNR):
+    with open(sfz_file) as f:
+        sfz_content = f.read()
+    base_dir = os.path.dirname(os.path.abspath(sfz_file))
+    if not supports(sfz_content):
+        print("The instrument uses opcodes the in-process renderer does not implement")
+        return 1
+
+    status = 0
+    for note in notes:
+        result = compare_with_sfizz(sfz_content, base_dir, note)
+        if result is None:
+            print(f"{note}: render failed")
+            status = 1
+            continue
+        snr, gain = result
+        passed = snr >= min_snr
+        print(f"{note}: gain {gain:.3f}, SNR {snr:.1f} dB{'' if passed else f' (below {min_snr} dB)'}")
+        if not passed:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "--parity":
+        print("Usage: python -m sfz_generator.audio.renderer --parity <file.sfz> [note ...]")
+        sys.exit(1)
+    sys.exit(_parity(sys.argv[2], [int(note) for note in sys.argv[3:]] or [60]))
@@ -0,0 +1,334 @@
+import queue
+import struct
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import numpy as np
+import soundfile as sf
+
+
+class AudioSource(ABC):
+    """Random access, mono float32 view over an audio file.
+
+    Sources behave like a read-only 1-D array: ``len(source)`` is the frame count and
+    slicing decodes only the requested range. ``read_into`` fills a caller-owned
+    buffer. The audio callback uses ``read_ready`` instead, which never waits for a
+    decoder, after asking for the frames it will need with ``prefetch``.
+    """
+
+    def __init__(self, path, sample_rate, frames, channels):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.frames = frames
+        self.channels = channels
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.frames)
+            data = self.read(start, stop)
+            return data if step == 1 else data[::step]
+        index = int(key)
+        if index < 0:
+            index += self.frames
+        if not 0 <= index < self.frames:
+            raise IndexError("audio source index out of range")
+        return float(self.read(index, index + 1)[0])
+
+    def read(self, start, stop):
+        """Returns frames ``[start, stop)`` as a new float32 array."""
+        start = max(0, start)
+        stop = min(self.frames, stop)
+        out = np.empty(max(0, stop - start), dtype=np.float32)
+        self.read_into(start, out)
+        return out
+
+    @abstractmethod
+    def read_into(self, start, out):
+        """Fills ``out`` with frames from ``start``, returns the number of frames written."""
+
+    def read_ready(self, start, out):
+        """Like ``read_into``, but stops at the first frame that is not decoded yet instead of decoding it."""
+        return self.read_into(start, out)
+
+    def prefetch(self, start, stop, wait=False):
+        """Gets frames ``[start, stop)`` ready for ``read_ready``, in the background unless ``wait``."""
+
+    def iter_blocks(self, block_frames=1 << 16, start=0, stop=None):
+        """Yields ``(offset, block)`` pairs covering ``[start, stop)`` sequentially."""
+        stop = self.frames if stop is None else min(stop, self.frames)
+        buffer = np.empty(block_frames, dtype=np.float32)
+        pos = start
+        while pos < stop:
+            count = self.read_into(pos, buffer[: min(block_frames, stop - pos)])
+            if count <= 0:
+                break
+            yield pos, buffer[:count]
+            pos += count
+
+
+class MemmapSource(AudioSource):
+    """PCM data mapped straight from disk, pages are only touched when read."""
+
+    def __init__(self, path, sample_rate, frames, channels, dtype, offset, scale, bias=0.0):
+        super().__init__(path, sample_rate, frames, channels)
+        self.scale = np.float32(scale)
+        self.bias = np.float32(bias * scale)
+        self._data = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(frames, channels))
+
+    def read_into(self, start, out):
+        count = max(0, min(len(out), self.frames - start))
+        if count == 0:
+            return 0
+        raw = self._data[start : start + count]
+        target = out[:count]
+        if self.channels == 1:
+            np.multiply(raw[:, 0], self.scale, out=target, casting="unsafe")
+        else:
+            np.mean(raw, axis=1, dtype=np.float32, out=target)
+            target *= self.scale
+        if self.bias:
+            target += self.bias
+        return count
+
+
+class _BlockDecoder:
+    """One background thread decoding the blocks that DecodedSources were asked to prefetch."""
+
+    def __init__(self):
+        self._requests = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def request(self, source_ref, index):
+        # SimpleQueue.put never blocks, so the audio callback can call it
+        self._requests.put((source_ref, index))
+
+    def _run(self):
+        while True:
+            source_ref, index = self._requests.get()
+            source = source_ref()
+            if source is None:
+                continue
+            try:
+                source.decode_block(index)
+            except Exception as e:
+                print(f"Error decoding {source.path}: {e}")
+            finally:
+                source.pending.discard(index)
+            del source
+
+
+_decoder = _BlockDecoder()
+
+
+class DecodedSource(AudioSource):
+    """Compressed or non-mappable file decoded on demand in blocks, with a small LRU block cache.
+
+    Opening only reads the header, so memory follows the blocks that were read last. The
+    blocks ahead of ``read_ready`` are decoded on a shared background thread, the audio
+    callback only copies blocks that are already there.
+    """
+
+    BLOCK_FRAMES = 1 << 16
+    MAX_BLOCKS = 32
+    # Blocks decoded ahead of the last read_ready, about 3 s at 44.1 kHz
+    READ_AHEAD_BLOCKS = 2
+
+    def __init__(self, path):
+        self._file = sf.SoundFile(path)
+        super().__init__(path, self._file.samplerate, self._file.frames, self._file.channels)
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+        self._ref = weakref.ref(self)
+        # Block indices queued for the decoder thread
+        self.pending = set()
+        _decoder.start()
+
+    def decode_block(self, index):
+        """Returns block ``index``, decoding it into the cache if needed."""
+        with self._lock:
+            block = self._blocks.get(index)
+            if block is not None:
+                self._blocks.move_to_end(index)
+                return block
+            self._file.seek(index * self.BLOCK_FRAMES)
+            block = self._file.read(self.BLOCK_FRAMES, dtype="float32", always_2d=True)
+            block = block[:, 0].copy() if self.channels == 1 else np.mean(block, axis=1, dtype=np.float32)
+            if len(block) < self.BLOCK_FRAMES:
+                # Some headers announce more frames than the file holds
+                self.frames = min(self.frames, index * self.BLOCK_FRAMES + len(block))
+            self._blocks[index] = block
+            if len(self._blocks) > self.MAX_BLOCKS:
+                self._blocks.popitem(last=False)
+            return block
+
+    def _copy_blocks(self, start, out, get_block):
+        count = max(0, min(len(out), self.frames - start))
+        written = 0
+        while written < count:
+            index, block_offset = divmod(start + written, self.BLOCK_FRAMES)
+            block = get_block(index)
+            if block is None:
+                break
+            n = min(count - written, len(block) - block_offset)
+            if n <= 0:
+                break
+            out[written : written + n] = block[block_offset : block_offset + n]
+            written += n
+        return written
+
+    def read_into(self, start, out):
+        return self._copy_blocks(start, out, self.decode_block)
+
+    def read_ready(self, start, out):
+        # A dict lookup is atomic, the callback does not take the lock the decoder holds while decoding
+        written = self._copy_blocks(start, out, self._blocks.get)
+        first = (start + written) // self.BLOCK_FRAMES
+        for index in range(first, first + self.READ_AHEAD_BLOCKS + 1):
+            self._request(index)
+        return written
+
+    def _request(self, index):
+        if index * self.BLOCK_FRAMES < self.frames and index not in self._blocks and index not in self.pending:
+            self.pending.add(index)
+            _decoder.request(self._ref, index)
+
+    def prefetch(self, start, stop, wait=False):
+        start = max(0, start)
+        stop = min(stop, self.frames)
+        for index in range(start // self.BLOCK_FRAMES, (stop - 1) // self.BLOCK_FRAMES + 1 if stop > start else 0):
+            if wait:
+                self.decode_block(index)
+            else:
+                self._request(index)
+
+    def iter_blocks(self, block_frames=1 << 16, start=0, stop=None):
+        # Sequential passes decode through their own handle, they would only flush the block cache
+        stop = self.frames if stop is None else min(stop, self.frames)
+        if start >= stop:
+            return
+        buffer = np.empty(block_frames, dtype=np.float32)
+        with sf.SoundFile(self.path) as f:
+            f.seek(start)
+            pos = start
+            for block in f.blocks(block_frames, dtype="float32", always_2d=True, frames=stop - start):
+                target = buffer[: len(block)]
+                if self.channels == 1:
+                    target[:] = block[:, 0]
+                else:
+                    np.mean(block, axis=1, dtype=np.float32, out=target)
+                yield pos, target
+                pos += len(block)
+
+
+def _read_extended_float(data):
+    """Decodes the 80-bit IEEE extended float used for AIFF sample rates."""
+    exponent = ((data[0] & 0x7F) << 8) | data[1]
+    mantissa = int.from_bytes(data[2:10], "big")
+    if exponent == 0 and mantissa == 0:
+        return 0.0
+    value = mantissa * 2.0 ** (exponent - 16383 - 63)
+    return -value if data[0] & 0x80 else value
+
+
+def _iter_chunks(f, endian, end):
+    while f.tell() + 8 <= end:
+        chunk_id = f.read(4)
+        (size,) = struct.unpack(endian + "I", f.read(4))
+        start = f.tell()
+        yield chunk_id, start, size
+        f.seek(start + size + (size & 1))
+
+
+def _probe_wav(f, file_size):
+    fmt = None
+    data = None
+    for chunk_id, start, size in _iter_chunks(f, "<", file_size):
+        if chunk_id == b"fmt ":
+            fmt = f.read(min(size, 40))
+        elif chunk_id == b"data":
+            data = (start, min(size, file_size - start))
+            break
+    if fmt is None or data is None or len(fmt) < 16:
+        return None
+
+    format_tag, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if format_tag == 0xFFFE and len(fmt) >= 26:
+        (format_tag,) = struct.unpack("<H", fmt[24:26])
+
+    dtypes = {(1, 8): ("u1", 128.0), (1, 16): ("<i2", 0.0), (1, 32): ("<i4", 0.0), (3, 32): ("<f4", 0.0), (3, 64): ("<f8", 0.0)}
+    if (format_tag, bits) not in dtypes or block_align != channels * bits // 8:
+        return None
+    dtype, bias = dtypes[(format_tag, bits)]
+    scale = 1.0 if format_tag == 3 else 1.0 / (1 << (bits - 1))
+    offset, size = data
+    return sample_rate, size // block_align, channels, dtype, offset, scale, -bias
+
+
+def _probe_aiff(f, file_size, is_aifc):
+    comm = None
+    data = None
+    for chunk_id, start, size in _iter_chunks(f, ">", file_size):
+        if chunk_id == b"COMM":
+            comm = f.read(min(size, 22))
+        elif chunk_id == b"SSND":
+            offset, _ = struct.unpack(">II", f.read(8))
+            data = start + 8 + offset
+    if comm is None or data is None or len(comm) < 18:
+        return None
+
+    channels, frames, bits = struct.unpack(">hIh", comm[:8])
+    sample_rate = int(round(_read_extended_float(comm[8:18])))
+    compression = comm[18:22] if is_aifc else b"NONE"
+
+    if compression in (b"fl32", b"FL32") and bits == 32:
+        dtype, scale = ">f4", 1.0
+    elif compression == b"fl64" and bits == 64:
+        dtype, scale = ">f8", 1.0
+    elif compression in (b"NONE", b"sowt") and bits in (8, 16, 32):
+        endian = "<" if compression == b"sowt" else ">"
+        dtype, scale = f"{endian}i{bits // 8}", 1.0 / (1 << (bits - 1))
+    else:
+        return None
+    frames = min(frames, (file_size - data) // (channels * np.dtype(dtype).itemsize))
+    return sample_rate, frames, channels, dtype, data, scale, 0.0
+
+
+def _probe_pcm_layout(path):
+    """Returns the raw PCM layout of a mappable WAV/AIFF file, or None if it has to be decoded."""
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        file_size = f.tell()
+        f.seek(0)
+        header = f.read(12)
+        if len(header) < 12:
+            return None
+        if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+            return _probe_wav(f, file_size)
+        if header[:4] == b"FORM" and header[8:12] in (b"AIFF", b"AIFC"):
+            return _probe_aiff(f, file_size, header[8:12] == b"AIFC")
+    return None
+
+
+def open_audio_source(path):
+    """Opens ``path`` without decoding it: PCM WAV/AIFF are memory-mapped, anything else is block-decoded."""
+    try:
+        layout = _probe_pcm_layout(path)
+    except (OSError, struct.error):
+        layout = None
+    if layout is not None:
+        sample_rate, frames, channels, dtype, offset, scale, bias = layout
+        if frames > 0 and channels > 0:
+            return MemmapSource(path, sample_rate, frames, channels, dtype, offset, scale, bias)
+    return DecodedSource(path)
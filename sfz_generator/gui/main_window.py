@@ -9,11 +9,15 @@ import threading
 import queue
 import os
 
+from sfz_generator.audio.dsp import Envelope
 from sfz_generator.audio.jack_client import JackClient
-from sfz_generator.audio.player import play as play_func
+from sfz_generator.audio.mixer_process import RemoteMixer
+from sfz_generator.audio.player import Player
+from sfz_generator.audio.render_cache import RenderCache
+from sfz_generator.audio.render_pool import RenderPool
 from sfz_generator.audio.processing import load_audio as load_audio_func
-from sfz_generator.sfz.generator import generate_pitch_shifted_instrument as generate_pitch_shifted_instrument_func, get_simple_sfz_content
-from sfz_generator.sfz.parser import parse_sfz_file as parse_sfz_file_func
+from sfz_generator.sfz.generator import generate_pitch_shifted_instrument as generate_pitch_shifted_instrument_func, get_simple_sfz_content, split_definitions
+from sfz_generator.sfz.parser import parse_sfz_instrument as parse_sfz_instrument_func
 from sfz_generator.widgets.envelope_widget import EnvelopeWidget
 from sfz_generator.widgets.waveform_widget import WaveformWidget
 from sfz_generator.widgets.piano_widget import PianoWidget
@@ -35,9 +39,9 @@ class SFZGenerator(
     WaveformWidget = WaveformWidget
     PianoWidget = PianoWidget
     EnvelopeWidget = EnvelopeWidget
-    play_func = play_func
+    Player = Player
     load_audio_func = load_audio_func
-    parse_sfz_file_func = parse_sfz_file_func
+    parse_sfz_instrument_func = parse_sfz_instrument_func
     play_sfz_note_func = play_sfz_note_func
     generate_pitch_shifted_instrument_func = generate_pitch_shifted_instrument_func
 
@@ -51,24 +55,40 @@ class SFZGenerator(
         self.audio_data = None
         self.sample_rate = None
         self.audio_file_path = None
+        self.analysis_stop_event = None
+        self.apply_detected_pitch = True
         self.loop_start = None
         self.loop_end = None
+        self.loop_candidates = []
         self.zoom_level = 1.0
         self.pan_offset = 0
         self.is_playing = False
-        self.playback_thread = None
-        self.stop_playback_event = threading.Event()
+        self.player = self.Player()
         self.current_sfz_path = None
+        # Held notes: (render job, None when played from the cache, and PreviewPlan)
         self.playing_notes = {}
         self.selected_midi_port = None
+        self.midi_ports_refresh_id = None
         self.generated_instrument_path = None
+        # In-memory model of the generated instrument, set and reset along with generated_instrument_path
+        # and edited in place by update_sfz_output
+        self.sfz_document = None
+        # SFZ update scheduling, see SfzOutputMixin.request_sfz_update
+        self.sfz_update_tick_id = None
+        self.sfz_update_committed = False
+        self.sfz_settle_id = None
+        self.sfz_output_hash = None
+        self.sfz_committed_hash = None
+
+        # Output stream for note previews, mixed in a child process so GUI work cannot starve it.
+        # Renders run on a small pool, shared with the built-in JACK engine
+        self.mixer = RemoteMixer(finished_callback=lambda note: GLib.idle_add(self.on_preview_voice_ended, note))
+        self.render_pool = RenderPool()
 
         # JACK client
-        self.jack_client = JackClient()
+        self.jack_client = JackClient(self.render_pool)
         self.connect("destroy", self.on_destroy)
-
-        # Playback lock for sounddevice
-        self.playback_lock = threading.Lock()
+        self.render_cache = RenderCache()
 
         # Note playback queue
         self.note_queue = queue.Queue()
@@ -155,6 +175,9 @@ class SFZGenerator(
         # Update SFZ output initially
         self.update_sfz_output()
         self.populate_midi_devices()
+        # The device list follows JACK ports as they come and go
+        self.jack_client.add_ports_listener(self.on_midi_ports_changed)
+        self.jack_client.add_state_listener(lambda state, message: GLib.idle_add(self.on_preview_state_changed, state, message))
 
     def on_key_press(self, controller, keyval, keycode, state):
         """Toggles play when SPACE is pressed."""
@@ -204,6 +227,24 @@ class SFZGenerator(
             return parts
         return []
 
+    def get_envelope(self):
+        if not self.sample_rate:
+            return None
+        return Envelope(
+            self.sample_rate,
+            delay=self.delay_spin_row.get_value(),
+            attack=self.attack_spin_row.get_value(),
+            hold=self.hold_spin_row.get_value(),
+            decay=self.decay_spin_row.get_value(),
+            sustain=self.sustain_spin_row.get_value() / 100.0,
+            release=self.release_spin_row.get_value(),
+        )
+
+    def get_loop_crossfade_frames(self):
+        if not self.sample_rate:
+            return 0
+        return int(self.loop_crossfade_spin_row.get_value() * self.sample_rate)
+
     def update_envelope_preview(self):
         if not hasattr(self, "envelope_widget"):
             return
@@ -218,47 +259,24 @@ class SFZGenerator(
         }
         self.envelope_widget.set_adsr_values(**adsr_params)
 
-    def update_sfz_output(self, *args):
+    def update_sfz_output(self, *args, commit=True):
+        """Rebuilds the SFZ text now; ``commit`` also saves it and reloads the previews, else that waits for the settle interval."""
         self.update_envelope_preview()
-
-        if self.generated_instrument_path:
-            current_content = self.sfz_buffer.get_text(self.sfz_buffer.get_start_iter(), self.sfz_buffer.get_end_iter(), True)
-            is_multisample = "<control>" in current_content
-
-            content_lines = []
-            if is_multisample:
-                content_lines = current_content.split("\n")
-            else:
-                try:
-                    with open(self.generated_instrument_path, "r") as f:
-                        content_lines = f.read().split("\n")
-                except (FileNotFoundError, TypeError):
-                    self.generated_instrument_path = None
-                    self.update_sfz_output()
-                    return
-
-            try:
-                global_start_index = content_lines.index("<global>") + 1
-                group_start_index = content_lines.index("<group>")
-
-                new_lines = content_lines[:global_start_index] + self.get_extra_sfz_definitions() + content_lines[group_start_index:]
-                new_content = "\n".join(new_lines)
-
-                self.sfz_buffer.set_text(new_content)
-
-                # Also update the sfz file on disk
-                if os.path.exists(self.generated_instrument_path):
-                    with open(self.generated_instrument_path, "w") as f:
-                        f.write(new_content)
-            except (ValueError, IndexError):
-                self.generated_instrument_path = None
-                self.update_sfz_output()
-                return
+        if self.is_playing:
+            self.player.set_envelope(self.get_envelope())
+            self.player.set_crossfade(self.get_loop_crossfade_frames())
+
+        if self.generated_instrument_path and self.sfz_document is not None:
+            # Only <global> is serialized again, the cached text of the regions is reused
+            self.sfz_document.section("global").set_opcodes(split_definitions(self.get_extra_sfz_definitions()))
+            content = self.sfz_document.text()
         else:
             content = get_simple_sfz_content(self.audio_file_path, self.pitch_keycenter.get_value(), self.get_extra_sfz_definitions())
-            self.sfz_buffer.set_text(content)
 
-        self.restart_preview()
+        self.set_sfz_output(content, commit)
 
     def on_destroy(self, *args):
+        self.player.stop()
+        self.mixer.close()
+        self.render_pool.close()
         self.jack_client.close()
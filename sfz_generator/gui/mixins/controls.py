@@ -3,8 +3,10 @@ import gi
 gi.require_version("Gtk", "4.0")
 gi.require_version("Adw", "1")
 
-from gi.repository import Gtk, Adw
-import numpy as np
+from gi.repository import Gtk, Adw, GLib
+import threading
+
+from sfz_generator.audio.looping import find_loop_points
 
 
 class ControlsMixin:
@@ -39,10 +41,10 @@ class ControlsMixin:
         self.pitch_keycenter = Gtk.SpinButton.new_with_range(0, 127, 1)
         self.pitch_keycenter.set_value(60)  # Middle C
         self.pitch_keycenter.set_tooltip_text("The MIDI note at which the sample plays back at its original pitch")
-        self.pitch_keycenter.connect("value-changed", self.update_sfz_output)
-        pitch_row = Adw.ActionRow(title="Pitch Keycenter")
-        pitch_row.add_suffix(self.pitch_keycenter)
-        general_expander.add_row(pitch_row)
+        self.pitch_keycenter.connect("value-changed", self.request_sfz_update)
+        self.pitch_row = Adw.ActionRow(title="Pitch Keycenter")
+        self.pitch_row.add_suffix(self.pitch_keycenter)
+        general_expander.add_row(self.pitch_row)
 
         self.low_key_spin = Gtk.SpinButton.new_with_range(0, 127, 1)
         self.low_key_spin.set_value(24)  # C1
@@ -96,14 +98,16 @@ class ControlsMixin:
         self.midi_device_combo.set_tooltip_text("Select a MIDI device for preview")
         self.midi_device_combo.connect("changed", self.on_midi_device_changed)
 
-        midi_device_row = Adw.ActionRow(title="")
-        midi_device_row.add_suffix(self.midi_device_combo)
-        midi_expander.add_row(midi_device_row)
+        self.midi_device_row = Adw.ActionRow(title="")
+        self.midi_device_row.add_suffix(self.midi_device_combo)
+        midi_expander.add_row(self.midi_device_row)
 
-        refresh_midi_button = Gtk.Button(icon_name="view-refresh-symbolic")
-        refresh_midi_button.set_tooltip_text("Refresh MIDI device list")
-        refresh_midi_button.connect("clicked", lambda w: self.populate_midi_devices())
-        midi_expander.add_action(refresh_midi_button)
+        self.native_engine_check = Gtk.CheckButton(label="Built-in")
+        self.native_engine_check.set_tooltip_text("Play MIDI through the built-in JACK engine instead of sfizz_jack")
+        self.native_engine_check.connect("toggled", self.on_native_engine_toggled)
+        native_engine_row = Adw.ActionRow(title="Engine")
+        native_engine_row.add_suffix(self.native_engine_check)
+        midi_expander.add_row(native_engine_row)
 
         # --- Loop Settings Expander ---
         loop_expander = Adw.ExpanderRow(title="Loop / sustain", expanded=True)
@@ -143,10 +147,24 @@ class ControlsMixin:
         loop_end_row.add_suffix(self.loop_end_spin)
         loop_expander.add_row(loop_end_row)
 
+        self.min_loop_length_spin_row = Adw.SpinRow.new_with_range(0.01, 10, 0.01)
+        self.min_loop_length_spin_row.set_title("Min Loop Length (s)")
+        self.min_loop_length_spin_row.set_value(0.25)
+        self.min_loop_length_spin_row.set_sensitive(False)
+        loop_expander.add_row(self.min_loop_length_spin_row)
+
+        self.find_loop_button = Gtk.Button(label="Find Loop")
+        self.find_loop_button.set_tooltip_text("Search the visible part of the waveform for seamless loop points, click again for the next match")
+        self.find_loop_button.set_sensitive(False)
+        self.find_loop_button.connect("clicked", self.on_find_loop_clicked)
+        self.find_loop_row = Adw.ActionRow(title="Auto Loop")
+        self.find_loop_row.add_suffix(self.find_loop_button)
+        loop_expander.add_row(self.find_loop_row)
+
         self.loop_crossfade_spin_row = Adw.SpinRow.new_with_range(0, 1, 0.01)
         self.loop_crossfade_spin_row.set_title("Loop Crossfade (s)")
         self.loop_crossfade_spin_row.set_value(0)
-        self.loop_crossfade_spin_row.get_adjustment().connect("value-changed", self.update_sfz_output)
+        self.loop_crossfade_spin_row.get_adjustment().connect("value-changed", self.request_sfz_update)
         loop_expander.add_row(self.loop_crossfade_spin_row)
 
         # --- Envelope Expander ---
@@ -157,37 +175,37 @@ class ControlsMixin:
         self.delay_spin_row = Adw.SpinRow.new_with_range(0, 1, 0.01)
         self.delay_spin_row.set_title("Delay (s)")
         self.delay_spin_row.set_value(0)
-        self.delay_spin_row.get_adjustment().connect("value-changed", self.update_sfz_output)
+        self.delay_spin_row.get_adjustment().connect("value-changed", self.request_sfz_update)
         adsr_expander.add_row(self.delay_spin_row)
 
         self.attack_spin_row = Adw.SpinRow.new_with_range(0, 1, 0.01)
         self.attack_spin_row.set_title("Attack (s)")
         self.attack_spin_row.set_value(0)
-        self.attack_spin_row.get_adjustment().connect("value-changed", self.update_sfz_output)
+        self.attack_spin_row.get_adjustment().connect("value-changed", self.request_sfz_update)
         adsr_expander.add_row(self.attack_spin_row)
 
         self.decay_spin_row = Adw.SpinRow.new_with_range(0, 1, 0.01)
         self.decay_spin_row.set_title("Decay (s)")
         self.decay_spin_row.set_value(0)
-        self.decay_spin_row.get_adjustment().connect("value-changed", self.update_sfz_output)
+        self.decay_spin_row.get_adjustment().connect("value-changed", self.request_sfz_update)
         adsr_expander.add_row(self.decay_spin_row)
 
         self.sustain_spin_row = Adw.SpinRow.new_with_range(0, 100, 1)
         self.sustain_spin_row.set_title("Sustain (%)")
         self.sustain_spin_row.set_value(100)
-        self.sustain_spin_row.get_adjustment().connect("value-changed", self.update_sfz_output)
+        self.sustain_spin_row.get_adjustment().connect("value-changed", self.request_sfz_update)
         adsr_expander.add_row(self.sustain_spin_row)
 
         self.hold_spin_row = Adw.SpinRow.new_with_range(0, 1, 0.01)
         self.hold_spin_row.set_title("Hold (s)")
         self.hold_spin_row.set_value(0)
-        self.hold_spin_row.get_adjustment().connect("value-changed", self.update_sfz_output)
+        self.hold_spin_row.get_adjustment().connect("value-changed", self.request_sfz_update)
         adsr_expander.add_row(self.hold_spin_row)
 
         self.release_spin_row = Adw.SpinRow.new_with_range(0, 1, 0.01)
         self.release_spin_row.set_title("Release (s)")
         self.release_spin_row.set_value(0)
-        self.release_spin_row.get_adjustment().connect("value-changed", self.update_sfz_output)
+        self.release_spin_row.get_adjustment().connect("value-changed", self.request_sfz_update)
         adsr_expander.add_row(self.release_spin_row)
 
         self.envelope_widget = self.EnvelopeWidget()
@@ -219,6 +237,10 @@ class ControlsMixin:
         self.progress_row.set_visible(False)
 
     def on_loop_mode_changed(self, dropdown, param):
+        self.update_loop_controls_sensitivity()
+        self.update_sfz_output()
+
+    def update_loop_controls_sensitivity(self):
         selected = self.loop_mode.get_selected()
         loop_mode = self.loop_strings.get_string(selected)
 
@@ -227,31 +249,81 @@ class ControlsMixin:
         self.loop_start_spin.set_sensitive(is_looping)
         self.loop_end_spin.set_sensitive(is_looping)
         self.loop_crossfade_spin_row.set_sensitive(is_looping)
-
-        self.update_sfz_output()
+        self.min_loop_length_spin_row.set_sensitive(is_looping)
+        self.find_loop_button.set_sensitive(is_looping)
 
     def on_loop_marker_changed(self, spin):
         loop_start = int(self.loop_start_spin.get_value())
         loop_end = int(self.loop_end_spin.get_value())
 
-        if (
-            self.zero_crossing_check.get_active()
-            and self.waveform_widget.zero_crossings is not None
-            and self.waveform_widget.zero_crossings.size > 0
-        ):
+        if self.zero_crossing_check.get_active() and self.audio_data is not None:
             if spin == self.loop_start_spin:
-                nearest_idx = np.argmin(np.abs(self.waveform_widget.zero_crossings - loop_start))
-                loop_start = self.waveform_widget.zero_crossings[nearest_idx]
+                loop_start = self.waveform_widget.nearest_zero_crossing(loop_start)
                 self.loop_start_spin.set_value(loop_start)
             elif spin == self.loop_end_spin:
-                nearest_idx = np.argmin(np.abs(self.waveform_widget.zero_crossings - loop_end))
-                loop_end = self.waveform_widget.zero_crossings[nearest_idx]
+                loop_end = self.waveform_widget.nearest_zero_crossing(loop_end)
                 self.loop_end_spin.set_value(loop_end)
 
         self.loop_start = loop_start
         self.loop_end = loop_end
         self.waveform_widget.set_loop_points(self.loop_start, self.loop_end)
-        self.update_sfz_output()
+        self.player.set_loop_points(self.loop_start, self.loop_end)
+        self.request_sfz_update()
+
+    def on_find_loop_clicked(self, button):
+        if self.audio_data is None:
+            return
+
+        # Cycle through the previous results while the loop points are still one of them
+        if self.loop_candidates:
+            current = [i for i, (start, end, _) in enumerate(self.loop_candidates) if (start, end) == (self.loop_start, self.loop_end)]
+            if current:
+                self.apply_loop_candidate((current[0] + 1) % len(self.loop_candidates))
+                return
+
+        total_samples = len(self.audio_data)
+        search_start = int(self.pan_offset * total_samples)
+        search_end = min(search_start + int(total_samples / self.zoom_level), total_samples)
+        min_length = int(self.min_loop_length_spin_row.get_value() * self.sample_rate)
+
+        self.find_loop_button.set_sensitive(False)
+        self.find_loop_row.set_subtitle("Searching...")
+        args = (self.audio_data, self.sample_rate, self.waveform_widget.zero_crossings, search_start, search_end, min_length)
+        thread = threading.Thread(target=self.find_loop_worker, args=args)
+        thread.daemon = True
+        thread.start()
+
+    def find_loop_worker(self, source, *args):
+        try:
+            candidates = find_loop_points(source, *args)
+        except Exception as e:
+            print(f"Error searching loop points: {e}")
+            candidates = []
+        GLib.idle_add(self.on_loop_candidates_found, source, candidates)
+
+    def on_loop_candidates_found(self, source, candidates):
+        self.find_loop_button.set_sensitive(True)
+        if source is not self.audio_data:
+            return
+        self.loop_candidates = candidates
+        if not candidates:
+            self.find_loop_row.set_subtitle("No loop found, try a longer window or a shorter minimum length")
+            return
+        self.apply_loop_candidate(0)
+
+    def apply_loop_candidate(self, index):
+        loop_start, loop_end, score = self.loop_candidates[index]
+        self.find_loop_row.set_subtitle(f"Match {index + 1}/{len(self.loop_candidates)} (score {score:.2f})")
+
+        self.loop_start_spin.handler_block_by_func(self.on_loop_marker_changed)
+        self.loop_end_spin.handler_block_by_func(self.on_loop_marker_changed)
+        try:
+            self.loop_start_spin.set_value(loop_start)
+            self.loop_end_spin.set_value(loop_end)
+        finally:
+            self.loop_start_spin.handler_unblock_by_func(self.on_loop_marker_changed)
+            self.loop_end_spin.handler_unblock_by_func(self.on_loop_marker_changed)
+        self.on_loop_marker_changed(None)
 
     def on_zero_crossing_toggled(self, button):
         is_active = button.get_active()
@@ -264,5 +336,5 @@ class ControlsMixin:
         is_active = button.get_active()
         self.process_row.set_visible(is_active)
         self.progress_row.set_visible(False)
-        self.generated_instrument_path = None
+        self.generated_instrument_path = self.sfz_document = None
         self.update_sfz_output()
@@ -3,9 +3,17 @@ import gi
 gi.require_version("Gtk", "4.0")
 gi.require_version("Adw", "1")
 
-from gi.repository import Gtk, Adw
+from gi.repository import Gtk, Adw, GLib
 from pathlib import Path
 import os
+import threading
+
+from sfz_generator.audio.analysis import analyze_source
+from sfz_generator.audio.analysis_cache import load_analysis, store_analysis
+from sfz_generator.audio.pitch import detect_root_pitch
+from sfz_generator.sfz.document import SfzDocument
+from sfz_generator.sfz.generator import is_generated_instrument
+from sfz_generator.utils import midi_to_name
 
 
 class FileIOMixin:
@@ -141,7 +149,7 @@ class FileIOMixin:
             dialog.present()
 
     def parse_sfz_file(self, sfz_path):
-        sfz_data, sample_path, error = self.parse_sfz_file_func(sfz_path)
+        instrument, error = self.parse_sfz_instrument_func(sfz_path)
 
         if error:
             dialog = Adw.MessageDialog.new(self, "Error", "Failed to load SFZ file")
@@ -154,10 +162,29 @@ class FileIOMixin:
         self.current_sfz_path = sfz_path
         self.sfz_label.set_text(os.path.basename(sfz_path))
 
+        # Controls and waveform follow the region closest to middle C
+        sfz_data, sample_path = instrument.nearest_region()
+        try:
+            document = SfzDocument.load(sfz_path)
+        except OSError:
+            document = None
+        if document is not None and is_generated_instrument(document):
+            # A generated instrument is edited in place like after a generation
+            self.sfz_document = document
+            self.sfz_buffer.set_text(self.sfz_document.text())
+            self.sfz_output_hash = None
+            self.generated_instrument_path = sfz_path
+        else:
+            # Any other file is only read, its region closest to middle C becomes the edited sample
+            self.generated_instrument_path = self.sfz_document = None
+
+        # The controls take the file's values before anything is built from them, nothing is kept from the previous file
+        self.update_controls_from_sfz(sfz_data)
+
         if sample_path:
             if os.path.exists(sample_path):
                 self.audio_file_path = sample_path
-                self.load_audio_file()
+                self.load_audio_file(apply_detected_pitch="pitch_keycenter" not in sfz_data, update_output=False)
             else:
                 dialog = Adw.MessageDialog.new(self, "Warning", "Audio file not found")
                 dialog.set_body(
@@ -167,51 +194,50 @@ class FileIOMixin:
                 dialog.set_modal(True)
                 dialog.present()
 
-        self.update_controls_from_sfz(sfz_data)
+        self.show_loaded_sfz_output()
 
     def update_controls_from_sfz(self, sfz_data):
+        """Sets every control from the opcodes of a region, the ones it does not have go back to their default."""
         # Block signals to prevent unwanted updates
         self.loop_mode.handler_block_by_func(self.on_loop_mode_changed)
         self.loop_start_spin.handler_block_by_func(self.on_loop_marker_changed)
         self.loop_end_spin.handler_block_by_func(self.on_loop_marker_changed)
-        self.pitch_keycenter.handler_block_by_func(self.update_sfz_output)
-        self.loop_crossfade_spin_row.get_adjustment().handler_block_by_func(self.update_sfz_output)
-        self.delay_spin_row.get_adjustment().handler_block_by_func(self.update_sfz_output)
-        self.attack_spin_row.get_adjustment().handler_block_by_func(self.update_sfz_output)
-        self.hold_spin_row.get_adjustment().handler_block_by_func(self.update_sfz_output)
-        self.decay_spin_row.get_adjustment().handler_block_by_func(self.update_sfz_output)
-        self.sustain_spin_row.get_adjustment().handler_block_by_func(self.update_sfz_output)
-        self.release_spin_row.get_adjustment().handler_block_by_func(self.update_sfz_output)
+        self.pitch_keycenter.handler_block_by_func(self.request_sfz_update)
+        self.loop_crossfade_spin_row.get_adjustment().handler_block_by_func(self.request_sfz_update)
+        self.delay_spin_row.get_adjustment().handler_block_by_func(self.request_sfz_update)
+        self.attack_spin_row.get_adjustment().handler_block_by_func(self.request_sfz_update)
+        self.hold_spin_row.get_adjustment().handler_block_by_func(self.request_sfz_update)
+        self.decay_spin_row.get_adjustment().handler_block_by_func(self.request_sfz_update)
+        self.sustain_spin_row.get_adjustment().handler_block_by_func(self.request_sfz_update)
+        self.release_spin_row.get_adjustment().handler_block_by_func(self.request_sfz_update)
         self.trigger_mode.handler_block_by_func(self.on_trigger_mode_changed)
 
         try:
             # Loop mode
-            if "loop_mode" in sfz_data:
-                loop_mode = sfz_data["loop_mode"]
-                if loop_mode == "no_loop":
-                    self.loop_mode.set_selected(0)
-                elif loop_mode == "one_shot":
-                    self.loop_mode.set_selected(1)
-                elif loop_mode == "loop_sustain":
-                    self.loop_mode.set_selected(2)
-                elif loop_mode == "loop_continuous":
-                    self.loop_mode.set_selected(3)
+            loop_mode = sfz_data.get("loop_mode", "no_loop")
+            if loop_mode == "one_shot":
+                self.loop_mode.set_selected(1)
+            elif loop_mode == "loop_sustain":
+                self.loop_mode.set_selected(2)
+            elif loop_mode == "loop_continuous":
+                self.loop_mode.set_selected(3)
+            else:
+                self.loop_mode.set_selected(0)
 
             # Trigger mode
-            if "trigger" in sfz_data:
-                trigger_value = sfz_data["trigger"]
-                if trigger_value == "attack":
-                    self.trigger_mode.set_selected(0)
-                elif trigger_value == "release":
-                    self.trigger_mode.set_selected(1)
-                elif trigger_value == "first":
-                    self.trigger_mode.set_selected(2)
-                elif trigger_value == "legato":
-                    self.trigger_mode.set_selected(3)
-                elif trigger_value == "release_key":
-                    self.trigger_mode.set_selected(4)
-
-            # Loop points
+            trigger_value = sfz_data.get("trigger", "attack")
+            if trigger_value == "release":
+                self.trigger_mode.set_selected(1)
+            elif trigger_value == "first":
+                self.trigger_mode.set_selected(2)
+            elif trigger_value == "legato":
+                self.trigger_mode.set_selected(3)
+            elif trigger_value == "release_key":
+                self.trigger_mode.set_selected(4)
+            else:
+                self.trigger_mode.set_selected(0)
+
+            # Loop points, load_audio_file picks defaults for the missing ones
             if "loop_start" in sfz_data:
                 self.loop_start = int(sfz_data["loop_start"])
                 self.loop_start_spin.set_value(self.loop_start)
@@ -223,55 +249,39 @@ class FileIOMixin:
             if self.loop_start is not None and self.loop_end is not None:
                 self.waveform_widget.set_loop_points(self.loop_start, self.loop_end)
 
-            if "loop_crossfade" in sfz_data:
-                self.loop_crossfade_spin_row.set_value(float(sfz_data["loop_crossfade"]))
+            self.loop_crossfade_spin_row.set_value(float(sfz_data.get("loop_crossfade", 0)))
 
             # ADSR
-            if "ampeg_delay" in sfz_data:
-                self.delay_spin_row.set_value(float(sfz_data["ampeg_delay"]))
-
-            if "ampeg_attack" in sfz_data:
-                self.attack_spin_row.set_value(float(sfz_data["ampeg_attack"]))
-
-            if "ampeg_hold" in sfz_data:
-                self.hold_spin_row.set_value(float(sfz_data["ampeg_hold"]))
-
-            if "ampeg_decay" in sfz_data:
-                self.decay_spin_row.set_value(float(sfz_data["ampeg_decay"]))
-
-            if "ampeg_sustain" in sfz_data:
-                self.sustain_spin_row.set_value(float(sfz_data["ampeg_sustain"]))
+            self.delay_spin_row.set_value(float(sfz_data.get("ampeg_delay", 0)))
+            self.attack_spin_row.set_value(float(sfz_data.get("ampeg_attack", 0)))
+            self.hold_spin_row.set_value(float(sfz_data.get("ampeg_hold", 0)))
+            self.decay_spin_row.set_value(float(sfz_data.get("ampeg_decay", 0)))
+            self.sustain_spin_row.set_value(float(sfz_data.get("ampeg_sustain", 100)))
+            self.release_spin_row.set_value(float(sfz_data.get("ampeg_release", 0)))
 
-            if "ampeg_release" in sfz_data:
-                self.release_spin_row.set_value(float(sfz_data["ampeg_release"]))
-
-            # Pitch keycenter
-            if "pitch_keycenter" in sfz_data:
-                self.pitch_keycenter.set_value(int(sfz_data["pitch_keycenter"]))
+            # Pitch keycenter, a detected pitch replaces the default when the file has none
+            self.pitch_keycenter.set_value(int(sfz_data.get("pitch_keycenter", 60)))
 
             # Update loop mode sensitivity
-            self.on_loop_mode_changed(self.loop_mode, None)
+            self.update_loop_controls_sensitivity()
 
         finally:
             # Unblock signals
             self.loop_mode.handler_unblock_by_func(self.on_loop_mode_changed)
             self.loop_start_spin.handler_unblock_by_func(self.on_loop_marker_changed)
             self.loop_end_spin.handler_unblock_by_func(self.on_loop_marker_changed)
-            self.pitch_keycenter.handler_unblock_by_func(self.update_sfz_output)
-            self.loop_crossfade_spin_row.get_adjustment().handler_unblock_by_func(self.update_sfz_output)
-            self.delay_spin_row.get_adjustment().handler_unblock_by_func(self.update_sfz_output)
-            self.attack_spin_row.get_adjustment().handler_unblock_by_func(self.update_sfz_output)
-            self.hold_spin_row.get_adjustment().handler_unblock_by_func(self.update_sfz_output)
-            self.decay_spin_row.get_adjustment().handler_unblock_by_func(self.update_sfz_output)
-            self.sustain_spin_row.get_adjustment().handler_unblock_by_func(self.update_sfz_output)
-            self.release_spin_row.get_adjustment().handler_unblock_by_func(self.update_sfz_output)
+            self.pitch_keycenter.handler_unblock_by_func(self.request_sfz_update)
+            self.loop_crossfade_spin_row.get_adjustment().handler_unblock_by_func(self.request_sfz_update)
+            self.delay_spin_row.get_adjustment().handler_unblock_by_func(self.request_sfz_update)
+            self.attack_spin_row.get_adjustment().handler_unblock_by_func(self.request_sfz_update)
+            self.hold_spin_row.get_adjustment().handler_unblock_by_func(self.request_sfz_update)
+            self.decay_spin_row.get_adjustment().handler_unblock_by_func(self.request_sfz_update)
+            self.sustain_spin_row.get_adjustment().handler_unblock_by_func(self.request_sfz_update)
+            self.release_spin_row.get_adjustment().handler_unblock_by_func(self.request_sfz_update)
             self.trigger_mode.handler_unblock_by_func(self.on_trigger_mode_changed)
 
-        # Update SFZ output
-        self.update_sfz_output()
-
-    def load_audio_file(self):
-        audio_data, audio_data_int16, sample_rate, error = self.load_audio_func(self.audio_file_path)
+    def load_audio_file(self, apply_detected_pitch=True, update_output=True):
+        audio_data, sample_rate, error = self.load_audio_func(self.audio_file_path)
 
         if error:
             dialog = Adw.MessageDialog.new(self, "Error", "Failed to load audio file")
@@ -282,20 +292,35 @@ class FileIOMixin:
             return
 
         self.audio_data = audio_data
-        self.audio_data_int16 = audio_data_int16
         self.sample_rate = sample_rate
+        self.apply_detected_pitch = apply_detected_pitch
+        self.loop_candidates = []
+        self.pitch_row.set_subtitle("")
 
         self.file_label.set_text(os.path.basename(self.audio_file_path))
 
         # Update waveform widget
         self.waveform_widget.set_audio_data(self.audio_data, self.sample_rate)
+        self.start_audio_analysis(self.audio_data)
         if self.zero_crossing_check.get_active():
             self.waveform_widget.set_snap_to_zero_crossing(True)
 
-        # Update loop marker ranges
+        # Update loop marker ranges, the spins may have clamped loop points set before the length was known
         max_samples = len(self.audio_data) - 1
-        self.loop_start_spin.set_range(0, max_samples)
-        self.loop_end_spin.set_range(0, max_samples)
+        self.loop_start_spin.handler_block_by_func(self.on_loop_marker_changed)
+        self.loop_end_spin.handler_block_by_func(self.on_loop_marker_changed)
+        try:
+            self.loop_start_spin.set_range(0, max_samples)
+            self.loop_end_spin.set_range(0, max_samples)
+            if self.loop_start is not None:
+                self.loop_start = min(self.loop_start, max_samples)
+                self.loop_start_spin.set_value(self.loop_start)
+            if self.loop_end is not None:
+                self.loop_end = min(self.loop_end, max_samples)
+                self.loop_end_spin.set_value(self.loop_end)
+        finally:
+            self.loop_start_spin.handler_unblock_by_func(self.on_loop_marker_changed)
+            self.loop_end_spin.handler_unblock_by_func(self.on_loop_marker_changed)
 
         # Set default loop points if not set
         if self.loop_start is None:
@@ -312,4 +337,51 @@ class FileIOMixin:
         self.play_button.set_sensitive(True)
         self.loop_playback_check.set_sensitive(True)
 
-        self.update_sfz_output()
+        if update_output:
+            self.update_sfz_output()
+
+    def start_audio_analysis(self, source):
+        if self.analysis_stop_event is not None:
+            self.analysis_stop_event.set()
+        self.analysis_stop_event = None
+
+        # Known files are restored from the analysis cache without touching the audio
+        analysis = load_analysis(source.path)
+        if analysis is not None:
+            self.waveform_widget.set_analysis(analysis)
+            if analysis.root_pitch is not None:
+                self.on_root_pitch_detected(source, analysis.root_pitch)
+            return
+
+        # Pitch, peaks and zero crossings are computed off the GUI thread, the view reads raw data until then
+        self.analysis_stop_event = threading.Event()
+        thread = threading.Thread(target=self.analysis_worker, args=(source, self.analysis_stop_event))
+        thread.daemon = True
+        thread.start()
+
+    def analysis_worker(self, source, stop_event):
+        try:
+            # Pitch detection only reads a few windows, publish it before the full pass
+            root_pitch = detect_root_pitch(source, source.sample_rate)
+            if root_pitch is not None:
+                GLib.idle_add(self.on_root_pitch_detected, source, root_pitch)
+            analysis = analyze_source(source, stop_event)
+        except Exception as e:
+            print(f"Error analyzing audio: {e}")
+            return
+        if analysis is not None:
+            analysis.root_pitch = root_pitch
+            store_analysis(source.path, analysis)
+            GLib.idle_add(self.on_audio_analysis_ready, source, analysis)
+
+    def on_audio_analysis_ready(self, source, analysis):
+        if source is self.audio_data:
+            self.waveform_widget.set_analysis(analysis)
+
+    def on_root_pitch_detected(self, source, root_pitch):
+        if source is not self.audio_data:
+            return
+        note, cents = int(root_pitch[0]), root_pitch[1]
+        self.pitch_row.set_subtitle(f"Detected: {midi_to_name(note)} ({note}) {cents:+.0f} cents")
+        if self.apply_detected_pitch:
+            self.pitch_keycenter.set_value(note)
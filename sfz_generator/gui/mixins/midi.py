@@ -1,16 +1,30 @@
-import os
-import tempfile
 from gi.repository import GLib
 
+from sfz_generator.audio.jack_client import ERROR, READY, STARTING
+from sfz_generator.audio.preview import write_preview_sfz
+
 
 class MidiMixin:
+    def on_midi_ports_changed(self):
+        # Called from JACK threads, once per port: refresh the list once from the main loop
+        if self.midi_ports_refresh_id is None:
+            self.midi_ports_refresh_id = GLib.idle_add(self.populate_midi_devices)
+
     def populate_midi_devices(self):
+        self.midi_ports_refresh_id = None
+        names = [port.name for port in self.jack_client.get_midi_ports()]
+        self.midi_device_combo.handler_block_by_func(self.on_midi_device_changed)
         self.midi_device_combo.remove_all()
         self.midi_device_combo.append_text("None")
-        self.midi_device_combo.set_active(0)
-        ports = self.jack_client.get_midi_ports()
-        for port in ports:
-            self.midi_device_combo.append_text(port.name)
+        for name in names:
+            self.midi_device_combo.append_text(name)
+        selected = names.index(self.selected_midi_port) + 1 if self.selected_midi_port in names else 0
+        self.midi_device_combo.set_active(selected)
+        self.midi_device_combo.handler_unblock_by_func(self.on_midi_device_changed)
+        if self.selected_midi_port and not selected:
+            # The selected device went away
+            self.on_midi_device_changed(self.midi_device_combo)
+        return GLib.SOURCE_REMOVE
 
     def on_midi_device_changed(self, combo):
         text = combo.get_active_text()
@@ -23,26 +37,37 @@ class MidiMixin:
             self.selected_midi_port = text
             self.restart_preview()
 
-    def restart_preview(self):
-        if not self.selected_midi_port:
-            return
+    def on_native_engine_toggled(self, check):
+        self.jack_client.set_native_engine(check.get_active())
+        if check.get_active():
+            self.jack_client.stop_preview()
+        self.restart_preview()
 
-        if self.generated_instrument_path:
-            instrument_dir = os.path.dirname(self.generated_instrument_path)
-            self.jack_client.start_preview(self.generated_instrument_path, cwd=instrument_dir)
-            self.jack_client.connect(self.selected_midi_port)
+    def restart_preview(self):
+        sfz_content, base_dir = self.get_preview_instrument()
+        if self.native_engine_check.get_active():
+            # The built-in engine plays keys rendered ahead, refresh them in the background
+            if "sample=" in sfz_content:
+                self.jack_client.engine.request_load(sfz_content, base_dir)
+        elif self.selected_midi_port:
+            try:
+                sfz_path = write_preview_sfz(sfz_content, base_dir)
+            except OSError as e:
+                print(f"Error writing preview instrument: {e}")
+                return
+            # A running sfizz_jack reloads the instrument in place and keeps its MIDI connection
+            self.jack_client.start_preview(sfz_path, cwd=base_dir)
         else:
-            sfz_content = self.sfz_buffer.get_text(
-                self.sfz_buffer.get_start_iter(),
-                self.sfz_buffer.get_end_iter(),
-                True,
-            )
-
-            with tempfile.NamedTemporaryFile(mode="w", suffix=".sfz", delete=False) as temp_sfz:
-                temp_sfz.write(sfz_content)
-                temp_sfz_path = temp_sfz.name
-
-            self.jack_client.start_preview(temp_sfz_path)
+            return
+        if self.selected_midi_port:
             self.jack_client.connect(self.selected_midi_port)
 
-            GLib.timeout_add(2000, os.unlink, temp_sfz_path)
+    def on_preview_state_changed(self, state, message):
+        if state == STARTING:
+            self.midi_device_row.set_subtitle("Starting preview...")
+        elif state == READY:
+            self.midi_device_row.set_subtitle("Preview ready")
+        elif state == ERROR:
+            self.midi_device_row.set_subtitle(f"Preview error: {message}")
+        else:
+            self.midi_device_row.set_subtitle("")
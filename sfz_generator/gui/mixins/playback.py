@@ -1,36 +1,35 @@
 import threading
 import os
-import tempfile
 from gi.repository import GLib, Adw
 
+from sfz_generator.audio.preview import get_cached_preview, get_region_index, prerender_sfz_notes
+from sfz_generator.audio.render_cache import sfz_text_hash
+from sfz_generator.audio.render_pool import RenderCancelled
+
 
 class PlaybackMixin:
     def on_play_clicked(self, button):
         if not self.is_playing:
             self.is_playing = True
-            self.stop_playback_event.clear()
             self.play_button.set_sensitive(False)
             self.stop_button.set_sensitive(True)
 
-            self.waveform_widget.set_playback_state(True, self.loop_playback_check.get_active())
-
-            args = (
-                self.audio_data_int16,
+            self.player.play(
+                self.audio_data,
                 self.sample_rate,
                 self.loop_playback_check.get_active(),
                 self.loop_start,
                 self.loop_end,
-                self.stop_playback_event,
                 self.show_playback_error,
                 self.playback_finished,
+                envelope=self.get_envelope(),
+                crossfade_frames=self.get_loop_crossfade_frames(),
             )
-            self.playback_thread = threading.Thread(target=self.play_func, args=args)
-            self.playback_thread.daemon = True
-            self.playback_thread.start()
+            self.waveform_widget.set_playback_state(True, self.loop_playback_check.get_active(), self.player.playhead)
 
     def on_stop_clicked(self, button):
         if self.is_playing:
-            self.stop_playback_event.set()
+            self.player.release()
         self.is_playing = False
         self.play_button.set_sensitive(True)
         self.stop_button.set_sensitive(False)
@@ -40,11 +39,11 @@ class PlaybackMixin:
 
     def playback_finished(self):
         self.is_playing = False
-        GLib.idle_add(self.play_button.set_sensitive, True)
-        GLib.idle_add(self.stop_button.set_sensitive, False)
+        self.play_button.set_sensitive(True)
+        self.stop_button.set_sensitive(False)
 
         # Update waveform widget
-        GLib.idle_add(self.waveform_widget.set_playback_state, False)
+        self.waveform_widget.set_playback_state(False)
 
     def show_playback_error(self, error_msg):
         dialog = Adw.MessageDialog.new(self, "Playback Error", "Failed to play audio")
@@ -58,48 +57,68 @@ class PlaybackMixin:
             action, note = self.note_queue.get()
             if action == "on":
                 if note in self.playing_notes:
+                    self.note_queue.task_done()
                     continue  # Note already playing
 
-                stop_event = threading.Event()
-                self.playing_notes[note] = stop_event
-
-                def run_playback(note, stop_event):
-                    GLib.idle_add(self.piano_widget.set_note_active, note)
-
-                    sfz_content_or_path = self.sfz_buffer.get_text(
-                        self.sfz_buffer.get_start_iter(),
-                        self.sfz_buffer.get_end_iter(),
-                        True,
-                    )
-
-                    base_dir = None
-                    temp_sfz_path = None
-
-                    try:
-                        if self.generated_instrument_path:
-                            # For generated instruments, relative paths need a file location.
-                            with tempfile.NamedTemporaryFile(mode="w", suffix=".sfz", delete=False) as temp_sfz:
-                                temp_sfz.write(sfz_content_or_path)
-                                temp_sfz_path = temp_sfz.name
-                            sfz_content_or_path = temp_sfz_path
-                            base_dir = os.path.dirname(self.generated_instrument_path)
-
-                        self.play_sfz_note_func(sfz_content_or_path, base_dir, note, 4, self.playback_lock, stop_event)
-
-                    finally:
-                        if temp_sfz_path and os.path.exists(temp_sfz_path):
-                            os.unlink(temp_sfz_path)
+                GLib.idle_add(self.piano_widget.set_note_active, note)
+                sfz_content, base_dir = self.get_preview_instrument()
+                plan, data = get_cached_preview(self.render_cache, sfz_content, base_dir, note, self.mixer.sample_rate)
+                if data is not None:
+                    # Already rendered, no need to wait for a free render worker
+                    self.playing_notes[note] = (None, plan)
+                    self.play_sfz_note_func(self.mixer, sfz_content, base_dir, note, threading.Event(), cache=self.render_cache)
+                else:
+                    job = self.render_pool.submit(("note", note), self.render_note_preview, sfz_content, base_dir, note)
+                    self.playing_notes[note] = (job, plan)
 
+            elif action == "off":
+                job, plan = self.playing_notes.get(note, (None, None))
+                if job is not None and not plan.ignore_note_off:
+                    # Released before its render finished: drop it, the canceller reports the end
+                    if not job.cancelled.is_set() and self.render_pool.cancel(("note", note)) is job:
+                        del self.playing_notes[note]
                         GLib.idle_add(self.piano_widget.set_note_inactive, note)
-                        if note in self.playing_notes:
-                            del self.playing_notes[note]
+                self.mixer.note_off(note)
 
-                thread = threading.Thread(target=run_playback, args=(note, stop_event))
-                thread.daemon = True
-                thread.start()
+            self.note_queue.task_done()
 
-            elif action == "off":
-                if note in self.playing_notes:
-                    self.playing_notes[note].set()
+    def get_preview_instrument(self):
+        sfz_content = self.sfz_buffer.get_text(
+            self.sfz_buffer.get_start_iter(),
+            self.sfz_buffer.get_end_iter(),
+            True,
+        )
+        # Relative sample paths of generated instruments resolve from their folder
+        base_dir = os.path.dirname(self.generated_instrument_path) if self.generated_instrument_path else None
+        return sfz_content, base_dir
+
+    def invalidate_preview_cache(self):
+        sfz_content, base_dir = self.get_preview_instrument()
+        try:
+            _, index = get_region_index(sfz_content, base_dir)
+            self.piano_widget.set_key_map(index.key_map())
+        except (OSError, ValueError) as e:
+            # A missing or recursive #include
+            print(f"Error mapping the instrument keys: {e}")
+            self.piano_widget.set_key_map(None)
+        if self.render_cache.set_instrument(sfz_text_hash(sfz_content, base_dir)) and "sample=" in sfz_content:
+            # Warm up every visible key in the background
+            notes = list(self.piano_widget.visible_notes())
+            self.render_pool.submit(
+                "warmup", prerender_sfz_notes, self.render_cache, sfz_content, base_dir, notes, self.mixer.sample_rate
+            )
 
-            self.note_queue.task_done()
+    def render_note_preview(self, sfz_content, base_dir, note, job):
+        try:
+            started = self.play_sfz_note_func(self.mixer, sfz_content, base_dir, note, job.cancelled, cache=self.render_cache, job=job)
+        except RenderCancelled:
+            started = False
+        except Exception as e:
+            print(f"Error playing note: {e}")
+            started = False
+        if not started and not job.cancelled.is_set():
+            GLib.idle_add(self.on_preview_voice_ended, note)
+
+    def on_preview_voice_ended(self, note):
+        self.piano_widget.set_note_inactive(note)
+        self.playing_notes.pop(note, None)
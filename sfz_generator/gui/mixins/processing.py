@@ -51,6 +51,12 @@ class ProcessingMixin:
         self.progress_bar.set_fraction(fraction)
         self.progress_bar.set_text(f"{current} / {total}")
 
+    def on_instrument_generated(self, sfz_path, document):
+        # The document the generator saved is edited from now on, without reading the file back
+        self.generated_instrument_path = sfz_path
+        self.sfz_document = document
+        self.update_sfz_output()
+
     def generate_pitch_shifted_sfz(self, output_dir):
         GLib.idle_add(self.spinner.start)
         GLib.idle_add(self.process_button.set_sensitive, False)
@@ -60,7 +66,7 @@ class ProcessingMixin:
         def progress_callback(current, total):
             GLib.idle_add(self._update_progress, current, total)
 
-        sfz_path, num_successful, num_total = self.generate_pitch_shifted_instrument_func(
+        sfz_path, document, num_successful, num_total = self.generate_pitch_shifted_instrument_func(
             output_dir,
             self.audio_file_path,
             int(self.pitch_keycenter.get_value()),
@@ -73,8 +79,7 @@ class ProcessingMixin:
 
         GLib.idle_add(self.show_generation_complete_dialog, sfz_path, num_successful, num_total)
         if sfz_path:
-            self.generated_instrument_path = sfz_path
-            GLib.idle_add(self.update_sfz_output)
+            GLib.idle_add(self.on_instrument_generated, sfz_path, document)
 
         GLib.idle_add(self.spinner.stop)
         GLib.idle_add(self.process_button.set_sensitive, True)
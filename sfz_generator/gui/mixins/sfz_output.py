@@ -3,7 +3,12 @@ import gi
 gi.require_version("Gtk", "4.0")
 gi.require_version("Adw", "1")
 
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
+import hashlib
+import os
+
+# Quiet time after the last interactive edit before the instrument is saved and the previews reload
+SETTLE_INTERVAL_MS = 250
 
 
 class SfzOutputMixin:
@@ -45,3 +50,57 @@ class SfzOutputMixin:
 
     def on_piano_release(self, widget, note):
         self.note_queue.put(("off", note))
+
+    def request_sfz_update(self, *args, committed=False):
+        """Coalesces edits into one SFZ rebuild on the next frame, for signals that fire continuously."""
+        self.sfz_update_committed = self.sfz_update_committed or committed
+        if self.sfz_update_tick_id is None:
+            self.sfz_update_tick_id = self.add_tick_callback(self.on_sfz_update_tick)
+
+    def on_sfz_update_tick(self, widget, frame_clock):
+        self.sfz_update_tick_id = None
+        committed, self.sfz_update_committed = self.sfz_update_committed, False
+        self.update_sfz_output(commit=committed)
+        return GLib.SOURCE_REMOVE
+
+    def set_sfz_output(self, content, commit=True):
+        content_hash = hashlib.blake2b(content.encode(), digest_size=16).digest()
+        if content_hash != self.sfz_output_hash:
+            self.sfz_output_hash = content_hash
+            self.sfz_buffer.set_text(content)
+
+        if self.sfz_settle_id is not None:
+            GLib.source_remove(self.sfz_settle_id)
+            self.sfz_settle_id = None
+        if commit:
+            self.commit_sfz_output()
+        elif content_hash != self.sfz_committed_hash:
+            self.sfz_settle_id = GLib.timeout_add(SETTLE_INTERVAL_MS, self.on_sfz_settled)
+
+    def show_loaded_sfz_output(self):
+        """Rebuilds the SFZ text of a file that was just loaded and reloads the previews, without saving it."""
+        self.update_sfz_output(commit=False)
+        if self.sfz_settle_id is not None:
+            GLib.source_remove(self.sfz_settle_id)
+            self.sfz_settle_id = None
+        # The loaded text counts as committed, the next save comes from an edit
+        self.sfz_committed_hash = self.sfz_output_hash
+        self.invalidate_preview_cache()
+        self.restart_preview()
+
+    def on_sfz_settled(self):
+        self.sfz_settle_id = None
+        self.commit_sfz_output()
+        return GLib.SOURCE_REMOVE
+
+    def commit_sfz_output(self):
+        """Saves a generated instrument and reloads the previews, unless the text did not change since the last commit."""
+        if self.sfz_output_hash == self.sfz_committed_hash:
+            return
+        self.sfz_committed_hash = self.sfz_output_hash
+
+        if self.sfz_document is not None and self.generated_instrument_path and os.path.exists(self.generated_instrument_path):
+            self.sfz_document.save(self.generated_instrument_path)
+
+        self.invalidate_preview_cache()
+        self.restart_preview()
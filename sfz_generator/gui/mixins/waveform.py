@@ -38,11 +38,15 @@ class WaveformMixin:
 
         # Create custom waveform widget
         self.waveform_widget = self.WaveformWidget()
-        waveform_box.append(self.waveform_widget)
+        waveform_overlay = Gtk.Overlay()
+        waveform_overlay.set_child(self.waveform_widget)
+        waveform_overlay.add_overlay(self.waveform_widget.playhead_layer)
+        waveform_box.append(waveform_overlay)
 
         # Connect signals
         self.waveform_widget.connect("loop-start-changed", self.on_loop_start_changed)
         self.waveform_widget.connect("loop-end-changed", self.on_loop_end_changed)
+        self.waveform_widget.connect("loop-drag-finished", self.on_loop_drag_finished)
         self.waveform_widget.connect("zoom-changed", self.on_zoom_changed)
         self.waveform_widget.connect("pan-changed", self.on_pan_changed)
 
@@ -73,10 +77,15 @@ class WaveformMixin:
 
     def on_loop_start_changed(self, widget, loop_start):
         self.loop_start = loop_start
+        self.player.set_loop_points(self.loop_start, self.loop_end)
         self.loop_start_spin.set_value(loop_start)
-        self.update_sfz_output()
+        self.request_sfz_update()
 
     def on_loop_end_changed(self, widget, loop_end):
         self.loop_end = loop_end
+        self.player.set_loop_points(self.loop_start, self.loop_end)
         self.loop_end_spin.set_value(loop_end)
-        self.update_sfz_output()
+        self.request_sfz_update()
+
+    def on_loop_drag_finished(self, widget):
+        self.request_sfz_update(committed=True)
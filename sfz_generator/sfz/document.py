@@ -0,0 +1,138 @@
+import os
+import tempfile
+
+from sfz_generator.sfz.parser import TOKEN_RE, opcode_pairs, parse_sfz_content
+
+
+class SfzSection:
+    """
+    One header and its opcodes. The serialized text is cached and only rebuilt after the
+    opcodes change; a section read from a file keeps its original text, comments included,
+    until then. ``inline`` sections write their opcodes on the header line.
+    """
+
+    def __init__(self, header, opcodes=(), inline=False, text=None):
+        self.header = header
+        self.inline = inline
+        self.document = None
+        self._opcodes = None if text is not None else list(opcodes)
+        self._text = text
+
+    @property
+    def opcodes(self):
+        """The ``(name, value)`` pairs of the section, in file order."""
+        if self._opcodes is None:
+            body = TOKEN_RE.sub(" ", self._text)
+            self._opcodes = opcode_pairs(body)
+        return self._opcodes
+
+    def set_opcodes(self, opcodes):
+        """Replaces the opcodes, returns False (and keeps the cached text) if they did not change."""
+        opcodes = list(opcodes)
+        if opcodes == self.opcodes:
+            return False
+        self._opcodes = opcodes
+        self._text = None
+        if self.document is not None:
+            self.document.section_changed()
+        return True
+
+    def text(self):
+        if self._text is None:
+            fields = [f"{name}={value}" for name, value in self._opcodes]
+            if self.header is None:
+                lines = fields
+            elif self.inline:
+                lines = [" ".join([f"<{self.header}>"] + fields)]
+            else:
+                lines = [f"<{self.header}>"] + fields
+            self._text = "".join(line + "\n" for line in lines)
+        return self._text
+
+
+class SfzDocument:
+    """
+    An SFZ file as a list of sections, shared by the generator and the GUI. Editing a section
+    only re-serializes that section, and ``save`` writes the file atomically, only when the
+    text changed since the last save.
+    """
+
+    def __init__(self, sections=()):
+        self.sections = []
+        self.dirty = True
+        self._text = None
+        self._saved_path = None
+        for section in sections:
+            self.append(section)
+
+    @classmethod
+    def from_text(cls, content):
+        """Splits SFZ text on its headers, each section keeping its text as is."""
+        starts = [0]
+        headers = [None]
+        for match in TOKEN_RE.finditer(content):
+            if match.group(1):
+                starts.append(match.start())
+                headers.append(match.group(1).lower())
+        starts.append(len(content))
+        document = cls()
+        for header, start, end in zip(headers, starts, starts[1:]):
+            if header is not None or start < end:
+                document.append(SfzSection(header, text=content[start:end]))
+        return document
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            document = cls.from_text(f.read())
+        document._saved_path = path
+        document.dirty = False
+        return document
+
+    def append(self, section):
+        section.document = self
+        self.sections.append(section)
+        self.section_changed()
+        return section
+
+    def add_section(self, header, opcodes=(), inline=False):
+        return self.append(SfzSection(header, opcodes, inline))
+
+    def section(self, header):
+        """The first section with ``header``, or None."""
+        for section in self.sections:
+            if section.header == header:
+                return section
+        return None
+
+    def section_changed(self):
+        self._text = None
+        self.dirty = True
+
+    def text(self):
+        if self._text is None:
+            self._text = "".join(section.text() for section in self.sections)
+        return self._text
+
+    def instrument(self, base_dir=None):
+        """Parses the document into an ``SfzInstrument``."""
+        return parse_sfz_content(self.text(), base_dir)
+
+    def save(self, path):
+        """Writes the document to ``path`` through a temporary file, returns False if it was already saved there."""
+        if not self.dirty and path == self._saved_path:
+            return False
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".sfz.tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.text())
+            # mkstemp creates the file private, keep the permissions of the file being replaced
+            os.chmod(temp_path, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._saved_path = path
+        self.dirty = False
+        return True
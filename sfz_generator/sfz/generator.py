@@ -1,12 +1,33 @@
 import os
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from sfz_generator.audio.processing import process_midi_note
+from sfz_generator.sfz.document import SfzDocument, SfzSection
+
+# Opcodes of the generated layout per header, <global> holding the definitions of the GUI controls
+GENERATED_OPCODES = {
+    "control": {"default_path"},
+    "global": {
+        "loop_mode",
+        "loop_start",
+        "loop_end",
+        "loop_crossfade",
+        "ampeg_delay",
+        "ampeg_attack",
+        "ampeg_hold",
+        "ampeg_decay",
+        "ampeg_sustain",
+        "ampeg_release",
+        "trigger",
+    },
+    "group": set(),
+    "region": {"sample", "key", "pitch_keycenter"},
+}
 
 
 def generate_pitch_shifted_instrument(
     output_dir, audio_file_path, pitch_keycenter, low_key, high_key, sample_rate, extra_definitions: list[str], progress_callback=None
 ):
-    """Generates a pitch-shifted SFZ instrument."""
+    """Generates a pitch-shifted SFZ instrument, returns ``(sfz_path, document, notes_generated, notes_total)``."""
     try:
         samples_dir_name = "samples"
         samples_dir_path = os.path.join(output_dir, samples_dir_name)
@@ -30,24 +51,51 @@ def generate_pitch_shifted_instrument(
         successful_notes = [(midi, note_name) for midi, note_name, success in sorted(results) if success]
 
         if not successful_notes:
-            return None, 0, num_total
-
-        sfz_lines = ["<control>", f"default_path={samples_dir_path}/", "<global>"] + extra_definitions + ["<group>"]
-
-        for midi, note_name in successful_notes:
-            out_wav = f"{note_name}.wav"
-            sfz_lines.append(f"<region> sample={out_wav} key={midi} pitch_keycenter={midi}")
-
-        sfz_content = "\n".join(sfz_lines) + "\n"
+            return None, None, 0, num_total
 
+        document = build_instrument_document(samples_dir_path, successful_notes, extra_definitions)
         sfz_path = os.path.join(output_dir, "instrument.sfz")
-        with open(sfz_path, "w") as f:
-            f.write(sfz_content)
+        document.save(sfz_path)
 
-        return sfz_path, len(successful_notes), num_total
+        return sfz_path, document, len(successful_notes), num_total
     except Exception as e:
         print(f"Error during pitch-shifted generation: {e}")
-        return None, 0, 0
+        return None, None, 0, 0
+
+
+def split_definitions(definitions: list[str]):
+    """``(name, value)`` pairs of ``name=value`` strings."""
+    return [tuple(definition.split("=", 1)) for definition in definitions]
+
+
+def build_instrument_document(samples_dir_path, notes, extra_definitions: list[str]):
+    """The document of a generated instrument: one region per ``(midi, note_name)``, extra definitions in ``<global>``."""
+    document = SfzDocument()
+    document.add_section("control", [("default_path", f"{samples_dir_path}/")])
+    document.add_section("global", split_definitions(extra_definitions))
+    document.add_section("group")
+    for midi, note_name in notes:
+        document.add_section("region", [("sample", f"{note_name}.wav"), ("key", str(midi)), ("pitch_keycenter", str(midi))], inline=True)
+    return document
+
+
+def is_generated_instrument(document):
+    """
+    True if ``document`` is laid out exactly as ``build_instrument_document`` writes it, the only
+    instruments whose ``<global>`` the GUI may rewrite: any other opcode, header or comment is kept
+    out of reach.
+    """
+    headers = [section.header for section in document.sections]
+    if headers[:3] != ["control", "global", "group"] or len(headers) < 4 or set(headers[3:]) != {"region"}:
+        return False
+    for section in document.sections:
+        names = [name for name, _ in section.opcodes]
+        if not set(names) <= GENERATED_OPCODES[section.header] or len(set(names)) != len(names):
+            return False
+        # Written by the generator if serializing its opcodes again gives back the same text
+        if section.text() != SfzSection(section.header, section.opcodes, inline=section.header == "region").text():
+            return False
+    return "default_path" in dict(document.section("control").opcodes)
 
 
 def get_simple_sfz_content(audio_file_path, pitch_keycenter, extra_defs: list[str]):
@@ -1,66 +1,209 @@
 import re
 import os
 
+import numpy as np
 
-def parse_sfz_file(sfz_path):
+# Headers whose opcodes are inherited by the regions that follow, outermost first
+HEADER_LEVELS = ["global", "master", "group", "region"]
+MIDDLE_C = 60
+MAX_INCLUDE_DEPTH = 16
+
+# One pass over the text splits it on headers, comments, #define and #include. What is left
+# between them are runs of opcodes, split on each ``name=``: a value runs to the next opcode,
+# so sample names may contain spaces. A #define value runs to the next space or comment.
+TOKEN_RE = re.compile(r'<(\w+)>|//[^\n]*|/\*.*?\*/|\#define\s+(\$\w+)\s+((?:[^\s/]|/(?![/*]))+)|\#include\s+"([^"\n]*)"', re.DOTALL)
+TOKEN_GROUPS = 4
+OPCODE_RE = re.compile(r"(?:^|\s+)([\w$]+)=")
+DEFINE_REF_RE = re.compile(r"\$\w+")
+NOTE_NAME_RE = re.compile(r"([a-g])([#b]?)(-?\d+)$", re.IGNORECASE)
+NOTE_STEPS = {"c": 0, "d": 2, "e": 4, "f": 5, "g": 7, "a": 9, "b": 11}
+
+# Integer columns of the region table, with the SFZ default of each
+KEY_COLUMNS = {"lokey": 0, "hikey": 127, "lovel": 1, "hivel": 127, "pitch_keycenter": MIDDLE_C}
+
+
+def note_number(value, default=None):
+    """MIDI note of an SFZ key value, either a number or a name such as ``c4`` (60) or ``f#3``."""
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    match = NOTE_NAME_RE.match(value)
+    if match is None:
+        return default
+    step, accidental, octave = match.groups()
+    pitch = NOTE_STEPS[step.lower()] + {"#": 1, "b": -1}.get(accidental, 0)
+    return (int(octave) + 1) * 12 + pitch
+
+
+def opcode_pairs(body):
+    """The ``(name, value)`` pairs of a run of opcodes, names lowercased."""
+    fields = OPCODE_RE.split(body)
+    return [(opcode.lower(), value.strip()) for opcode, value in zip(fields[1::2], fields[2::2])]
+
+
+class RegionTable:
     """
-    Parses an SFZ file and returns a dictionary of opcodes
-    and the resolved path to the sample file.
+    Column-oriented regions: ``columns`` maps every opcode to one value per region (None where
+    the region does not set it), each region carrying the opcodes it inherits from its headers.
+    Key and velocity ranges are also resolved into integer arrays, ``key`` included.
     """
-    try:
-        with open(sfz_path, "r") as f:
-            content = f.read()
 
-        sfz_data = parse_sfz_content(content)
+    def __init__(self, columns, count):
+        self.columns = columns
+        self.count = count
+        key = self._numbers("key")
+        for opcode, default in KEY_COLUMNS.items():
+            values = np.full(count, default, dtype=np.int16)
+            if opcode in ["lokey", "hikey", "pitch_keycenter"]:
+                np.copyto(values, key, where=key >= 0)
+            explicit = self._numbers(opcode)
+            np.copyto(values, explicit, where=explicit >= 0)
+            setattr(self, opcode, values)
+
+    def _numbers(self, opcode):
+        # Values repeat a lot across regions, each distinct one is only converted once
+        values = self.columns.get(opcode)
+        if values is None:
+            return np.full(self.count, -1, dtype=np.int16)
+        converted = {value: note_number(value, -1) for value in set(values) if value is not None}
+        converted[None] = -1
+        return np.fromiter(map(converted.__getitem__, values), dtype=np.int16, count=self.count)
+
+    def __len__(self):
+        return self.count
+
+    def column(self, opcode):
+        return self.columns.get(opcode, [None] * self.count)
+
+    def region(self, index):
+        """The opcodes of region ``index``, inherited ones included."""
+        return {opcode: column[index] for opcode, column in self.columns.items() if column[index] is not None}
+
+    def nearest(self, note):
+        """Index of the region whose key range is closest to ``note``, or None without regions."""
+        if not self.count:
+            return None
+        distance = np.maximum(self.lokey - note, 0) + np.maximum(note - self.hikey, 0)
+        return int(np.argmin(distance))
+
+
+class SfzInstrument:
+    """A parsed instrument: ``<control>`` opcodes, ``#define`` values and the region table."""
 
-        sample_path = None
-        if "sample" in sfz_data:
-            sample = sfz_data["sample"]
-            if os.path.isabs(sample):
-                sample_path = sample
-            else:
-                sfz_dir = os.path.dirname(sfz_path)
-                sample_path = os.path.join(sfz_dir, sample)
+    def __init__(self, control, defines, regions, base_dir=None):
+        self.control = control
+        self.defines = defines
+        self.regions = regions
+        self.base_dir = base_dir
 
-        return sfz_data, sample_path, None
+    def sample_path(self, index):
+        """The sample of region ``index`` (``default_path`` already applied), resolved from the instrument folder."""
+        sample = self.regions.columns.get("sample", [None] * len(self.regions))[index]
+        if not sample:
+            return None
+        if os.path.isabs(sample) or not self.base_dir:
+            return sample
+        return os.path.join(self.base_dir, sample)
 
+    def nearest_region(self, note=MIDDLE_C):
+        """Returns ``(opcodes, sample_path)`` of the region closest to ``note``, ``({}, None)`` without regions."""
+        index = self.regions.nearest(note)
+        if index is None:
+            return {}, None
+        return self.regions.region(index), self.sample_path(index)
+
+
+def parse_sfz_content(content, base_dir=None):
+    """
+    Parses SFZ text into an ``SfzInstrument``. Regions inherit the opcodes of the ``<global>``,
+    ``<master>`` and ``<group>`` headers above them, ``default_path`` is prepended to their
+    samples, and ``#include`` paths resolve from ``base_dir``.
+    """
+    control = {}
+    defines = {}
+    # Opcodes of the currently open header at each level, a header resets the levels below it
+    levels = {level: {} for level in HEADER_LEVELS}
+    # Opcodes of the headers above the regions, merged again only when one of them changes
+    inherited = {}
+    current = opcodes = None
+    regions = []
+    names = {}
+
+    def close_region():
+        region = {**inherited, **levels["region"]}
+        if "sample" in region:
+            sample = region["sample"].replace("\\", "/")
+            if not os.path.isabs(sample):
+                sample = control.get("default_path", "").replace("\\", "/") + sample
+            region["sample"] = sample
+        names.update(region)
+        regions.append(region)
+
+    def substitute(text):
+        return DEFINE_REF_RE.sub(lambda ref: defines.get(ref.group(0), ref.group(0)), text)
+
+    def feed(text, depth):
+        nonlocal current, opcodes, inherited
+        parts = TOKEN_RE.split(text)
+        for index in range(0, len(parts), TOKEN_GROUPS + 1):
+            body = parts[index]
+            if opcodes is not None and "=" in body:
+                if "$" in body:
+                    body = substitute(body)
+                opcodes.update(opcode_pairs(body))
+            if index + 1 == len(parts):
+                break
+            header, define, define_value, include = parts[index + 1 : index + TOKEN_GROUPS + 1]
+            if header:
+                if current == "region":
+                    close_region()
+                elif current in levels:
+                    inherited = {**levels["global"], **levels["master"], **levels["group"]}
+                current = header.lower()
+                if current in levels:
+                    for level in HEADER_LEVELS[HEADER_LEVELS.index(current) :]:
+                        levels[level] = {}
+                    opcodes = levels[current]
+                else:
+                    # <control> is kept apart, opcodes of other headers (<curve>, <effect>...) are ignored
+                    opcodes = control if current == "control" else None
+            elif define:
+                defines[define] = define_value
+            elif include:
+                if depth >= MAX_INCLUDE_DEPTH:
+                    raise ValueError(f"#include nested deeper than {MAX_INCLUDE_DEPTH} levels")
+                # Like sfizz, #define values are substituted in the path
+                include = substitute(include).replace("\\", "/")
+                with open(os.path.join(base_dir or "", include), "r") as f:
+                    feed(f.read(), depth + 1)
+
+    feed(content, 0)
+    if current == "region":
+        close_region()
+
+    columns = {name: [region.get(name) for region in regions] for name in names}
+    return SfzInstrument(control, defines, RegionTable(columns, len(regions)), base_dir)
+
+
+def parse_sfz_instrument(sfz_path):
+    """Parses an SFZ file, returns ``(instrument, error)``."""
+    try:
+        with open(sfz_path, "r") as f:
+            content = f.read()
+        return parse_sfz_content(content, os.path.dirname(os.path.abspath(sfz_path))), None
     except Exception as e:
-        return None, None, str(e)
-
-
-def parse_sfz_content(content):
-    # Initialize data dictionary
-    sfz_data = {}
-
-    # Remove comments and split into lines
-    lines = []
-    for line in content.split("\n"):
-        # Remove comments
-        line = re.sub(r"//.*$", "", line)
-        line = re.sub(r"#.*$", "", line)
-        line = line.strip()
-        if line:
-            lines.append(line)
-
-    # Parse opcodes
-    current_section = None
-    for line in lines:
-        line = line.strip()
-
-        # Check for section headers
-        if line.startswith("<") and line.endswith(">"):
-            current_section = line[1:-1].lower()
-            continue
-
-        if current_section not in ["group", "region"]:
-            continue
-
-        # Replace multiple spaces with one, to help splitting
-        line = re.sub(r"\s+", " ", line).strip()
-        parts = line.split(" ")
-        for part in parts:
-            if "=" in part:
-                opcode, value = part.split("=", 1)
-                sfz_data[opcode.lower().strip()] = value.strip()
-
-    return sfz_data
+        return None, str(e)
+
+
+def parse_sfz_file(sfz_path):
+    """
+    Parses an SFZ file and returns a dictionary of opcodes
+    and the resolved path to the sample file, taken from the region closest to middle C.
+    """
+    instrument, error = parse_sfz_instrument(sfz_path)
+    if error is not None:
+        return None, None, error
+    sfz_data, sample_path = instrument.nearest_region(MIDDLE_C)
+    return sfz_data, sample_path, None
@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class _Node:
+    """Regions whose key range contains ``center``, kept sorted by low key and by high key."""
+
+    def __init__(self, center, regions, lokey, hikey):
+        self.center = center
+        order = np.argsort(lokey[regions], kind="stable")
+        self.by_low = regions[order]
+        self.lows = lokey[self.by_low]
+        # High keys descending, stored negated so both lists are searched in ascending order
+        order = np.argsort(-hikey[regions], kind="stable")
+        self.by_high = regions[order]
+        self.negated_highs = -hikey[self.by_high]
+        self.left = None
+        self.right = None
+
+
+class RegionIndex:
+    """
+    Centered interval tree over the key ranges of a ``RegionTable``, answering which regions
+    sound for a note in O(log n + k). Velocity ranges are checked on the k regions found.
+    """
+
+    def __init__(self, regions):
+        self.lokey = regions.lokey.astype(np.int32)
+        self.hikey = regions.hikey.astype(np.int32)
+        self.lovel = regions.lovel
+        self.hivel = regions.hivel
+        self.root = self._build(np.arange(len(regions)))
+
+    def _build(self, regions):
+        if not len(regions):
+            return None
+        lokey, hikey = self.lokey, self.hikey
+        # Median of the range ends keeps the tree balanced
+        ends = np.concatenate([lokey[regions], hikey[regions]])
+        center = int(np.median(ends))
+        left = regions[hikey[regions] < center]
+        right = regions[lokey[regions] > center]
+        here = regions[(lokey[regions] <= center) & (hikey[regions] >= center)]
+        node = _Node(center, here, lokey, hikey)
+        node.left = self._build(left)
+        node.right = self._build(right)
+        return node
+
+    def regions_for(self, note, velocity=None):
+        """Indices of the regions playing ``note`` (at ``velocity`` if given), in file order."""
+        found = []
+        node = self.root
+        while node is not None:
+            if note < node.center:
+                found.append(node.by_low[: np.searchsorted(node.lows, note, side="right")])
+                node = node.left
+            elif note > node.center:
+                found.append(node.by_high[: np.searchsorted(node.negated_highs, -note, side="right")])
+                node = node.right
+            else:
+                found.append(node.by_low)
+                break
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        hits = np.sort(np.concatenate(found))
+        if velocity is not None:
+            hits = hits[(self.lovel[hits] <= velocity) & (self.hivel[hits] >= velocity)]
+        return hits
+
+    def first_region(self, note, velocity=None):
+        """Index of the first region playing ``note``, or None."""
+        hits = self.regions_for(note, velocity)
+        return int(hits[0]) if len(hits) else None
+
+    def key_map(self, notes=range(128)):
+        """Number of regions mapped to each of ``notes``, any velocity."""
+        return [len(self.regions_for(note)) for note in notes]
@@ -1,3 +1,5 @@
+import os
+
 NOTES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
 
 
@@ -5,3 +7,9 @@ def midi_to_name(midi):
     octave = (midi // 12) - 1
     note = NOTES[midi % 12]
     return f"{note}{octave}"
+
+
+def user_cache_dir(name):
+    """Returns the ``name`` subdirectory of the application cache, under ``$XDG_CACHE_HOME`` or ``~/.cache``."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "sfz_generator", name)
@@ -15,12 +15,17 @@ class PianoWidget(Gtk.DrawingArea):
         self.start_note = 36  # C2
         self.active_notes = set()
         self.pressed_notes = set()
+        # Regions per MIDI note of the current instrument, None when unknown
+        self.key_map = None
 
         gesture = Gtk.GestureClick.new()
         gesture.connect("pressed", self.on_pressed)
         gesture.connect("released", self.on_released)
         self.add_controller(gesture)
 
+    def visible_notes(self):
+        return range(self.start_note, self.start_note + self.WHITE_KEY_COUNT // self.OCTAVE_SPAN * 12)
+
     def set_note_active(self, note):
         self.active_notes.add(note)
         self.queue_draw()
@@ -29,6 +34,24 @@ class PianoWidget(Gtk.DrawingArea):
         self.active_notes.discard(note)
         self.queue_draw()
 
+    def set_key_map(self, key_map):
+        """Marks the keys the instrument maps, ``key_map`` holding the number of regions of each MIDI note."""
+        self.key_map = key_map
+        self.queue_draw()
+
+    def draw_key_map(self, cr, note, rect):
+        if self.key_map is None:
+            return
+        x, y, width, height = rect
+        if self.key_map[note]:
+            # A bar at the bottom of mapped keys, more opaque when several regions overlap
+            cr.set_source_rgba(0.2, 0.6, 0.3, min(1.0, 0.5 + 0.1 * self.key_map[note]))
+            cr.rectangle(x + 1, y + height - 6, width - 2, 5)
+        else:
+            cr.set_source_rgba(0.5, 0.5, 0.5, 0.35)
+            cr.rectangle(x, y, width, height)
+        cr.fill()
+
     def on_draw(self, area, cr, width, height):
         self.key_rects = []
         white_notes = [0, 2, 4, 5, 7, 9, 11]
@@ -47,7 +70,9 @@ class PianoWidget(Gtk.DrawingArea):
             rect = (i * white_key_width, 0, white_key_width, height)
             self.key_rects.append((note, rect, "white"))
             cr.rectangle(*rect)
-            cr.fill_preserve()
+            cr.fill()
+            self.draw_key_map(cr, note, rect)
+            cr.rectangle(*rect)
             cr.set_source_rgb(0, 0, 0)
             cr.stroke()
 
@@ -68,6 +93,7 @@ class PianoWidget(Gtk.DrawingArea):
                 self.key_rects.append((note, rect, "black"))
                 cr.rectangle(*rect)
                 cr.fill()
+                self.draw_key_map(cr, note, rect)
 
     def on_pressed(self, gesture, n_press, x, y):
         note = self.note_from_pos(x, y)
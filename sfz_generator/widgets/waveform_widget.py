@@ -6,7 +6,29 @@ gi.require_version("Gdk", "4.0")
 
 from gi.repository import Gtk, Gdk, GObject, cairo
 import numpy as np
-import librosa
+
+from sfz_generator.audio.analysis import local_zero_crossings, nearest_zero_crossing, reduce_extents
+from sfz_generator.audio.looping import seam_quality
+
+# Above this many visible frames the raw audio is not read, the peak pyramid is used instead
+MAX_RAW_DRAW_FRAMES = 1 << 22
+
+
+class PlayheadCursor(Gtk.DrawingArea):
+    """Thin vertical line moved over the waveform, redrawn on its own so the waveform is not."""
+
+    WIDTH = 2
+
+    def __init__(self, color):
+        super().__init__()
+        self.color = color
+        self.set_can_target(False)
+        self.set_draw_func(self.on_draw)
+
+    def on_draw(self, area, cr, width, height):
+        cr.set_source_rgb(*self.color)
+        cr.rectangle(0, 0, width, height)
+        cr.fill()
 
 
 class WaveformWidget(Gtk.DrawingArea):
@@ -28,7 +50,9 @@ class WaveformWidget(Gtk.DrawingArea):
         self.is_playing = False
         self.loop_playback = False
         self.snap_to_zero_crossing = False
+        self.analysis = None
         self.zero_crossings = None
+        self.seam = None
 
         # Colors
         self.bg_color = (0.1, 0.1, 0.1)
@@ -39,6 +63,18 @@ class WaveformWidget(Gtk.DrawingArea):
         self.playback_color = (0.2, 0.8, 0.2, 0.3)
         self.grid_color = (0.3, 0.3, 0.3)
         self.text_color = (0.9, 0.9, 0.9)
+        self.seam_colors = ((0.9, 0.3, 0.3), (0.9, 0.8, 0.2), (0.3, 0.9, 0.3))
+        self.playhead_color = (1.0, 1.0, 1.0)
+
+        # Playhead, drawn in a separate layer meant to be overlaid on the widget
+        self.playhead = None
+        self.playhead_tick_id = None
+        self.playhead_x = None
+        self.playhead_cursor = PlayheadCursor(self.playhead_color)
+        self.playhead_cursor.set_visible(False)
+        self.playhead_layer = Gtk.Fixed()
+        self.playhead_layer.set_can_target(False)
+        self.playhead_layer.put(self.playhead_cursor, 0, 0)
 
         # Mouse tracking
         self.last_x = None
@@ -72,17 +108,34 @@ class WaveformWidget(Gtk.DrawingArea):
     def set_audio_data(self, audio_data, sample_rate):
         self.audio_data = audio_data
         self.sample_rate = sample_rate
-        if self.audio_data is not None:
-            self.zero_crossings = np.where(librosa.zero_crossings(self.audio_data))[0]
-        else:
-            self.zero_crossings = None
+        self.analysis = None
+        self.zero_crossings = None
+        self.update_seam_quality()
+        self.queue_draw()
+
+    def set_analysis(self, analysis):
+        self.analysis = analysis
+        self.zero_crossings = analysis.zero_crossings if analysis is not None else None
         self.queue_draw()
 
+    def nearest_zero_crossing(self, sample_pos):
+        if self.zero_crossings is not None:
+            return nearest_zero_crossing(self.zero_crossings, sample_pos)
+        # Index not built yet, only look around the requested position
+        return nearest_zero_crossing(local_zero_crossings(self.audio_data, sample_pos), sample_pos)
+
     def set_loop_points(self, loop_start, loop_end):
         self.loop_start = loop_start
         self.loop_end = loop_end
+        self.update_seam_quality()
         self.queue_draw()
 
+    def update_seam_quality(self):
+        if self.audio_data is None or self.loop_start is None or self.loop_end is None:
+            self.seam = None
+        else:
+            self.seam = seam_quality(self.audio_data, int(self.loop_start), int(self.loop_end))
+
     def set_zoom(self, zoom_level):
         self.zoom_level = zoom_level
         self.queue_draw()
@@ -91,11 +144,40 @@ class WaveformWidget(Gtk.DrawingArea):
         self.pan_offset = pan_offset
         self.queue_draw()
 
-    def set_playback_state(self, is_playing, loop_playback=False):
+    def set_playback_state(self, is_playing, loop_playback=False, playhead=None):
+        """``playhead`` is the player's shared frame counter, polled once per displayed frame."""
         self.is_playing = is_playing
         self.loop_playback = loop_playback
+        self.playhead = playhead if is_playing else None
+        if self.playhead is not None and self.playhead_tick_id is None:
+            self.playhead_tick_id = self.add_tick_callback(self.on_playhead_tick)
+        elif self.playhead is None and self.playhead_tick_id is not None:
+            self.remove_tick_callback(self.playhead_tick_id)
+            self.playhead_tick_id = None
+            self.playhead_x = None
+            self.playhead_cursor.set_visible(False)
         self.queue_draw()
 
+    def on_playhead_tick(self, widget, frame_clock):
+        frame = int(self.playhead[0]) if self.playhead is not None else -1
+        width = self.get_width()
+        x = None
+        if frame >= 0 and self.audio_data is not None and width > 0:
+            total_samples = len(self.audio_data)
+            visible_samples = int(total_samples / self.zoom_level)
+            start_sample = int(self.pan_offset * total_samples)
+            if start_sample <= frame < start_sample + visible_samples:
+                x = int((frame - start_sample) / visible_samples * width)
+
+        # Only the cursor is moved, the waveform keeps its cached rendering
+        if x != self.playhead_x:
+            self.playhead_x = x
+            self.playhead_cursor.set_visible(x is not None)
+            if x is not None:
+                self.playhead_cursor.set_size_request(PlayheadCursor.WIDTH, self.get_height())
+                self.playhead_layer.move(self.playhead_cursor, x, 0)
+        return True
+
     def on_draw(self, widget, cr, width, height):
         # Clear background
         cr.set_source_rgb(*self.bg_color)
@@ -163,28 +245,18 @@ class WaveformWidget(Gtk.DrawingArea):
         if start_sample >= total_samples:
             return
 
-        # Get the visible portion of the audio data
-        visible_data = self.audio_data[start_sample:end_sample]
-
-        # If we have more samples than pixels, we need to downsample
-        if len(visible_data) > width:
-            # Calculate downsample factor
-            factor = len(visible_data) / width
-
-            # Create arrays for min and max values
-            mins = np.zeros(width, dtype=np.float32)
-            maxs = np.zeros(width, dtype=np.float32)
-
-            # Calculate min and max for each pixel column
-            for i in range(width):
-                start_idx = int(i * factor)
-                end_idx = int((i + 1) * factor)
-                if end_idx > len(visible_data):
-                    end_idx = len(visible_data)
+        extents = self.get_pixel_extents(start_sample, end_sample, width)
+        if extents is None:
+            # Peaks are still being computed for a very large file
+            cr.set_source_rgb(*self.text_color)
+            cr.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
+            cr.set_font_size(12)
+            cr.move_to(10, height / 2 - 10)
+            cr.show_text("Analyzing...")
+            return
 
-                if start_idx < end_idx:
-                    mins[i] = np.min(visible_data[start_idx:end_idx])
-                    maxs[i] = np.max(visible_data[start_idx:end_idx])
+        if isinstance(extents, tuple):
+            mins, maxs = extents
 
             # Draw the waveform
             cr.set_source_rgb(*self.wave_color)
@@ -209,6 +281,7 @@ class WaveformWidget(Gtk.DrawingArea):
             cr.stroke()
         else:
             # We have fewer samples than pixels, draw each sample
+            visible_data = extents
             cr.set_source_rgb(*self.wave_color)
             cr.set_line_width(1)
 
@@ -226,6 +299,28 @@ class WaveformWidget(Gtk.DrawingArea):
 
             cr.stroke()
 
+    def get_pixel_extents(self, start_sample, end_sample, width):
+        """Per-pixel (mins, maxs) for the visible range, the raw samples when zoomed in past one sample per pixel.
+
+        Returns None when the range is too large to read and no peak data is available yet.
+        """
+        visible_samples = end_sample - start_sample
+        if visible_samples <= width:
+            return self.audio_data[start_sample:end_sample]
+
+        level = self.analysis.peak_level(visible_samples / width) if self.analysis is not None else None
+        if level is not None:
+            block, mins, maxs = level
+            first = start_sample // block
+            last = min(len(mins), -(-end_sample // block))
+            if last - first > width:
+                return reduce_extents(mins[first:last], maxs[first:last], width)
+
+        if visible_samples > MAX_RAW_DRAW_FRAMES:
+            return None
+        visible_data = self.audio_data[start_sample:end_sample]
+        return reduce_extents(visible_data, visible_data, width)
+
     def draw_loop_markers(self, cr, width, height):
         # Calculate visible range
         total_samples = len(self.audio_data)
@@ -269,6 +364,16 @@ class WaveformWidget(Gtk.DrawingArea):
             cr.move_to(x + 5, 30)
             cr.show_text("Loop End")
 
+        # Seam quality overlay
+        if self.seam is not None:
+            score, jump, slope, spectral = self.seam
+            cr.set_source_rgb(*self.seam_colors[0 if score < 0.4 else 1 if score < 0.75 else 2])
+            cr.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.BOLD)
+            cr.set_font_size(12)
+            text = f"Seam {score:.2f}  jump {jump:.2f}  slope {slope:.2f}  spectrum {spectral:.2f}"
+            cr.move_to(width - cr.text_extents(text).width - 10, 15)
+            cr.show_text(text)
+
     def draw_loop_region(self, cr, width, height):
         # Calculate visible range
         total_samples = len(self.audio_data)
@@ -336,9 +441,8 @@ class WaveformWidget(Gtk.DrawingArea):
 
         sample_pos = start_sample + (x / self.get_width()) * visible_samples
 
-        if self.snap_to_zero_crossing and self.zero_crossings is not None and self.zero_crossings.size > 0:
-            nearest_zc_idx = np.argmin(np.abs(self.zero_crossings - sample_pos))
-            sample_pos = self.zero_crossings[nearest_zc_idx]
+        if self.snap_to_zero_crossing and self.dragging_marker in ("start", "end"):
+            sample_pos = self.nearest_zero_crossing(sample_pos)
 
         if self.dragging_marker == "start":
             self.loop_start = int(
@@ -348,6 +452,7 @@ class WaveformWidget(Gtk.DrawingArea):
                     self.loop_end - 1 if self.loop_end else total_samples - 1,
                 )
             )
+            self.update_seam_quality()
             self.queue_draw()
             # Emit signal to update spin button
             self.emit("loop-start-changed", self.loop_start)
@@ -359,6 +464,7 @@ class WaveformWidget(Gtk.DrawingArea):
                     total_samples - 1,
                 )
             )
+            self.update_seam_quality()
             self.queue_draw()
             # Emit signal to update spin button
             self.emit("loop-end-changed", self.loop_end)
@@ -404,6 +510,8 @@ class WaveformWidget(Gtk.DrawingArea):
         return True
 
     def on_button_release(self, gesture, n_press, x, y):
+        if self.dragging_marker in ("start", "end"):
+            self.emit("loop-drag-finished")
         self.dragging_marker = None
         self.pan_start_x = None
         return True
@@ -453,6 +561,13 @@ GObject.signal_new(
     GObject.TYPE_NONE,
     (GObject.TYPE_INT,),
 )
+GObject.signal_new(
+    "loop-drag-finished",
+    WaveformWidget,
+    GObject.SignalFlags.RUN_LAST,
+    GObject.TYPE_NONE,
+    (),
+)
 GObject.signal_new(
     "zoom-changed",
     WaveformWidget,
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+import pytest
+
+from sfz_generator.audio import analysis_cache
+from sfz_generator.audio.analysis import SampleAnalysis, analyze_source, zero_crossings_of
+from sfz_generator.audio.analysis_cache import load_analysis, store_analysis
+
+
+class ArraySource:
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def iter_blocks(self, block_frames=1 << 16):
+        for offset in range(0, len(self.data), block_frames):
+            yield offset, self.data[offset : offset + block_frames]
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def sample(tmp_path):
+    path = tmp_path / "sample.wav"
+    path.write_bytes(os.urandom(4096))
+    return str(path)
+
+
+def test_analysis_matches_in_memory_crossings():
+    data = np.sin(np.arange(300000) * 0.01).astype(np.float32)
+    analysis = analyze_source(ArraySource(data))
+    np.testing.assert_array_equal(analysis.zero_crossings[1:], zero_crossings_of(data))
+    _, mins, maxs = analysis.peaks[0]
+    assert mins.min() == data.min() and maxs.max() == data.max()
+
+
+def test_round_trip(sample):
+    data = np.sin(np.arange(300000) * 0.01).astype(np.float32)
+    analysis = analyze_source(ArraySource(data))
+    analysis.root_pitch = (57, 12.5)
+    store_analysis(sample, analysis)
+
+    loaded = load_analysis(sample)
+    np.testing.assert_array_equal(loaded.zero_crossings, analysis.zero_crossings)
+    np.testing.assert_allclose(loaded.peaks[0][1], analysis.peaks[0][1], atol=1e-3)
+    assert len(loaded.peaks) == len(analysis.peaks)
+    assert loaded.root_pitch == (57, 12.5)
+
+
+def test_changed_file_misses(sample):
+    store_analysis(sample, SampleAnalysis(zero_crossings=np.arange(10)))
+    assert load_analysis(sample) is not None
+    with open(sample, "ab") as f:
+        f.write(b"more")
+    assert load_analysis(sample) is None
+
+
+def test_evict_keeps_most_recent(tmp_path):
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"sample{i}.wav"
+        path.write_bytes(os.urandom(1024))
+        store_analysis(str(path), SampleAnalysis(zero_crossings=np.arange(20000) * 7))
+        entry = analysis_cache._entry_path(str(path))
+        os.utime(entry, (i, i))
+        paths.append(str(path))
+    entry_size = os.path.getsize(analysis_cache._entry_path(paths[0]))
+    analysis_cache.evict(2 * entry_size)
+    assert [load_analysis(path) is not None for path in paths] == [False, False, True, True]
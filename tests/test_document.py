@@ -0,0 +1,109 @@
+import os
+import stat
+
+import pytest
+
+from sfz_generator.sfz.document import SfzDocument, SfzSection
+
+LIBRARY = """// Piano by someone
+#define $VEL 100
+<control> default_path=samples/
+<global>
+// global settings
+volume=-3 ampeg_release=0.5
+<group> lovel=1 hivel=$VEL
+<region> sample=C4.wav key=60
+<region> sample=D4.wav key=62
+"""
+
+
+def test_round_trip_keeps_text_as_is():
+    document = SfzDocument.from_text(LIBRARY)
+    assert document.text() == LIBRARY
+    assert [section.header for section in document.sections] == [None, "control", "global", "group", "region", "region"]
+
+
+def test_opcodes_of_a_loaded_section_skip_comments():
+    document = SfzDocument.from_text(LIBRARY)
+    assert document.section("global").opcodes == [("volume", "-3"), ("ampeg_release", "0.5")]
+    assert document.section("region").opcodes == [("sample", "C4.wav"), ("key", "60")]
+
+
+def test_only_the_edited_section_is_serialized_again():
+    document = SfzDocument.from_text(LIBRARY)
+    regions = [section.text() for section in document.sections if section.header == "region"]
+    assert document.section("global").set_opcodes([("ampeg_release", "1.000")])
+    text = document.text()
+    assert "<global>\nampeg_release=1.000\n<group> lovel=1 hivel=$VEL\n" in text
+    assert text.startswith("// Piano by someone\n#define $VEL 100\n<control> default_path=samples/\n")
+    assert [section.text() for section in document.sections if section.header == "region"] == regions
+
+
+def test_built_sections():
+    document = SfzDocument()
+    document.add_section("control", [("default_path", "samples/")])
+    document.add_section("group")
+    document.add_section("region", [("sample", "C4.wav"), ("key", "60")], inline=True)
+    assert document.text() == "<control>\ndefault_path=samples/\n<group>\n<region> sample=C4.wav key=60\n"
+    assert SfzDocument.from_text(document.text()).text() == document.text()
+
+
+def test_unchanged_opcodes_keep_the_document_clean(tmp_path):
+    path = tmp_path / "instrument.sfz"
+    path.write_text(LIBRARY)
+    document = SfzDocument.load(str(path))
+    assert not document.dirty
+    assert not document.section("global").set_opcodes([("volume", "-3"), ("ampeg_release", "0.5")])
+    assert not document.dirty
+    assert not document.save(str(path))
+    assert document.section("global").set_opcodes([("volume", "-6")])
+    assert document.dirty
+
+
+def test_save_writes_only_when_changed(tmp_path):
+    path = str(tmp_path / "instrument.sfz")
+    document = SfzDocument([SfzSection("region", [("sample", "C4.wav")], inline=True)])
+    assert document.save(path)
+    assert not document.save(path)
+    mtime = os.stat(path).st_mtime_ns
+    document.sections[0].set_opcodes([("sample", "D4.wav")])
+    assert document.save(path)
+    assert open(path).read() == "<region> sample=D4.wav\n"
+    assert os.stat(path).st_mtime_ns >= mtime
+    # Saving somewhere else writes even when nothing changed
+    assert document.save(str(tmp_path / "copy.sfz"))
+
+
+def test_save_is_atomic_and_keeps_permissions(tmp_path):
+    path = tmp_path / "instrument.sfz"
+    path.write_text(LIBRARY)
+    os.chmod(path, 0o640)
+    document = SfzDocument.load(str(path))
+    document.section("global").set_opcodes([])
+    document.save(str(path))
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert os.listdir(tmp_path) == ["instrument.sfz"]
+    assert path.read_text() == document.text()
+
+
+def test_failed_save_leaves_the_file_and_no_temporary(tmp_path, monkeypatch):
+    path = tmp_path / "instrument.sfz"
+    path.write_text(LIBRARY)
+    document = SfzDocument.load(str(path))
+    document.section("global").set_opcodes([])
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        document.save(str(path))
+    assert path.read_text() == LIBRARY
+    assert os.listdir(tmp_path) == ["instrument.sfz"]
+    assert document.dirty
+
+
+def test_instrument():
+    instrument = SfzDocument.from_text(LIBRARY).instrument()
+    assert len(instrument.regions) == 2
+    assert instrument.regions.region(1) == {"volume": "-3", "ampeg_release": "0.5", "lovel": "1", "hivel": "100", "sample": "samples/D4.wav", "key": "62"}
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from sfz_generator.audio.dsp import Envelope, crossfade_tail
+
+
+def test_crossfade_tail_blends_into_pre_loop_audio():
+    source = np.arange(1000, dtype=np.float32)
+    tail = crossfade_tail(source, 400, 800, 100)
+    assert len(tail) == 100
+    t = (np.arange(100) + 0.5) / 100
+    np.testing.assert_allclose(tail, source[700:800] * np.sqrt(1 - t) + source[300:400] * np.sqrt(t), rtol=1e-6)
+    # The tail ends mostly on the audio just before loop_start, where the loop wraps to
+    assert abs(tail[-1] - source[399]) < abs(tail[-1] - source[799]) / 5
+
+
+def test_crossfade_tail_is_limited_by_the_loop_and_pre_loop_audio():
+    source = np.ones(1000, dtype=np.float32)
+    assert len(crossfade_tail(source, 50, 800, 100)) == 50
+    assert len(crossfade_tail(source, 400, 430, 100)) == 30
+    assert len(crossfade_tail(source, 0, 800, 100)) == 0
+
+
+def test_crossfade_tail_keeps_constant_power_on_correlated_signal():
+    source = np.ones(1000, dtype=np.float32)
+    tail = crossfade_tail(source, 400, 800, 100)
+    assert tail.max() <= np.sqrt(2) + 1e-6 and tail.min() >= 1.0 - 1e-6
+
+
+def test_envelope_stages():
+    envelope = Envelope(1000, delay=0.01, attack=0.02, hold=0.01, decay=0.02, sustain=0.5, release=0.1)
+    gain = np.empty(100, dtype=np.float32)
+    envelope.gain(0, gain)
+    np.testing.assert_array_equal(gain[:10], 0)
+    assert gain[10:30][0] == 0 and np.all(np.diff(gain[10:30]) > 0)
+    np.testing.assert_array_equal(gain[30:40], 1)
+    assert np.all(np.diff(gain[40:60]) < 0)
+    np.testing.assert_array_equal(gain[60:], 0.5)
+    assert envelope.level(35) == 1.0 and envelope.level(1000) == 0.5
+
+
+def test_envelope_gain_across_blocks_matches_one_block():
+    envelope = Envelope(1000, attack=0.05, decay=0.05, sustain=0.25)
+    whole = np.empty(200, dtype=np.float32)
+    envelope.gain(0, whole)
+    blocks = np.empty(200, dtype=np.float32)
+    for start in range(0, 200, 32):
+        envelope.gain(start, blocks[start : start + 32])
+    np.testing.assert_array_equal(blocks, whole)
+
+
+def test_envelope_release():
+    envelope = Envelope(1000, sustain=0.8, release=0.05)
+    gain = np.empty(32, dtype=np.float32)
+    assert envelope.release_gain(0.8, 0, gain)
+    assert gain[0] == pytest.approx(0.8) and np.all(np.diff(gain) < 0)
+    assert not envelope.release_gain(0.8, 32, gain)
+    np.testing.assert_array_equal(gain[18:], 0)
+
+
+def test_flat_envelope():
+    assert Envelope(1000).is_flat
+    assert not Envelope(1000, release=0.1).is_flat
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("librosa")
+
+from sfz_generator.sfz.document import SfzDocument  # noqa: E402
+from sfz_generator.sfz.generator import build_instrument_document, is_generated_instrument  # noqa: E402
+
+NOTES = [(59, "B3"), (60, "C4"), (61, "C#4")]
+
+
+def generated(extra=("loop_mode=one_shot", "ampeg_release=0.500")):
+    return build_instrument_document("/library/samples", NOTES, list(extra)).text()
+
+
+def test_generated_layout():
+    text = generated()
+    assert text.splitlines()[:5] == ["<control>", "default_path=/library/samples/", "<global>", "loop_mode=one_shot", "ampeg_release=0.500"]
+    assert text.endswith("<group>\n<region> sample=B3.wav key=59 pitch_keycenter=59\n<region> sample=C4.wav key=60 pitch_keycenter=60\n"
+                         "<region> sample=C#4.wav key=61 pitch_keycenter=61\n")
+    assert is_generated_instrument(SfzDocument.from_text(text))
+    assert is_generated_instrument(SfzDocument.from_text(generated(extra=())))
+
+
+@pytest.mark.parametrize(
+    "edit",
+    [
+        lambda text: text.replace("loop_mode=one_shot", "loop_mode=one_shot\nvolume=-3"),
+        lambda text: text.replace("<global>", "<global>\n// my settings"),
+        lambda text: text.replace("<group>", "<group>\nlovel=10"),
+        lambda text: text.replace("key=60", "key=60 cutoff=500"),
+        lambda text: text + "<group>\n<region> sample=X.wav key=70 pitch_keycenter=70\n",
+        lambda text: text.replace("default_path=/library/samples/\n", ""),
+        lambda text: "// Library by someone\n" + text,
+        lambda text: text.split("<region>")[0],
+    ],
+)
+def test_other_files_are_not_generated(edit):
+    assert not is_generated_instrument(SfzDocument.from_text(edit(generated())))
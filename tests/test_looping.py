@@ -0,0 +1,38 @@
+import numpy as np
+
+from sfz_generator.audio.analysis import zero_crossings_of
+from sfz_generator.audio.looping import find_loop_points, seam_quality
+
+RATE = 44100
+PERIOD = 100  # 441 Hz at 44.1 kHz, an integer number of frames
+
+
+def periodic(seconds=2.0):
+    t = np.arange(int(RATE * seconds))
+    phase = 2 * np.pi * t / PERIOD
+    return (np.sin(phase) + 0.3 * np.sin(3 * phase)).astype(np.float32)
+
+
+def test_loop_points_are_whole_periods():
+    data = periodic()
+    candidates = find_loop_points(data, RATE, zero_crossings_of(data), 10000, 80000, min_length=20000)
+    assert candidates
+    scores = [score for _, _, score in candidates]
+    assert scores == sorted(scores, reverse=True)
+    for start, end, _ in candidates:
+        assert 10000 <= start and end < 80000 and end - start >= 20000
+        assert (end - start) % PERIOD in (0, 1, PERIOD - 1)
+
+
+def test_loop_points_without_room():
+    data = periodic(0.5)
+    assert find_loop_points(data, RATE, None, 1000, 5000, min_length=10000) == []
+
+
+def test_seam_quality_prefers_whole_periods():
+    data = periodic()
+    perfect = seam_quality(data, 10000, 10000 + 200 * PERIOD)
+    broken = seam_quality(data, 10000, 10000 + 200 * PERIOD + PERIOD // 3)
+    assert perfect[0] > 0.9
+    assert broken[0] < perfect[0]
+    assert seam_quality(data, 10, 20000) is None
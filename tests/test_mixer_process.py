@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("sounddevice")
+
+from sfz_generator.audio.mixer_process import FINISHED, NOTE_OFF, NOTE_ON, SharedRing  # noqa: E402
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing(capacity=4)
+    yield ring
+    ring.close(unlink=True)
+
+
+def test_records_come_out_in_order_across_wraparound(ring):
+    for round_ in range(3):
+        for note in range(4):
+            assert ring.put(NOTE_ON, note=note + round_, name=f"block{note}")
+        for note in range(4):
+            record = ring.get(timeout=0)
+            assert record["kind"] == NOTE_ON
+            assert record["note"] == note + round_
+            assert record["name"].decode() == f"block{note}"
+
+
+def test_fields_of_a_reused_slot_are_reset(ring):
+    for _ in range(4):
+        ring.put(NOTE_ON, note=1, name="block", loop_start=10)
+        ring.get(timeout=0)
+    ring.put(NOTE_OFF, note=2)
+    record = ring.get(timeout=0)
+    assert record["kind"] == NOTE_OFF and record["name"] == b"" and record["loop_start"] == 0
+
+
+def test_full_and_empty_rings_time_out(ring):
+    assert ring.get(timeout=0.01) is None
+    for note in range(4):
+        assert ring.put(FINISHED, note=note)
+    assert not ring.put(FINISHED, note=5, timeout=0.01)
+    assert ring.get(timeout=0)["note"] == 0
+    assert ring.put(FINISHED, note=5, timeout=0.01)
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from sfz_generator.sfz.parser import MAX_INCLUDE_DEPTH, note_number, parse_sfz_content, parse_sfz_file, parse_sfz_instrument
+
+
+@pytest.mark.parametrize("value, expected", [("60", 60), ("c4", 60), ("C4", 60), ("f#3", 54), ("eb4", 63), ("c-1", 0), ("g9", 127), ("x", None)])
+def test_note_number(value, expected):
+    assert note_number(value) == expected
+
+
+def test_header_inheritance():
+    instrument = parse_sfz_content(
+        """
+        <global> volume=-3 ampeg_release=1
+        <master> ampeg_release=2
+        <group> lovel=10 hivel=100
+        <region> sample=a.wav key=60
+        <region> sample=b.wav key=62 ampeg_release=3
+        <group>
+        <region> sample=c.wav key=64
+        <master>
+        <region> sample=d.wav key=65
+        <global>
+        <region> sample=e.wav key=67
+        """
+    )
+    regions = [instrument.regions.region(i) for i in range(len(instrument.regions))]
+    assert regions[0] == {"volume": "-3", "ampeg_release": "2", "lovel": "10", "hivel": "100", "sample": "a.wav", "key": "60"}
+    assert regions[1]["ampeg_release"] == "3"
+    # A new <group> drops the previous group's opcodes, the <master> and <global> ones stay
+    assert regions[2] == {"volume": "-3", "ampeg_release": "2", "sample": "c.wav", "key": "64"}
+    assert regions[3] == {"volume": "-3", "ampeg_release": "1", "sample": "d.wav", "key": "65"}
+    assert regions[4] == {"sample": "e.wav", "key": "67"}
+    np.testing.assert_array_equal(instrument.regions.lovel, [10, 10, 1, 1, 1])
+
+
+def test_key_columns():
+    instrument = parse_sfz_content("<region> sample=a.wav key=c4\n<region> sample=b.wav lokey=e4 hikey=g4 pitch_keycenter=f4\n<region> sample=c.wav")
+    regions = instrument.regions
+    np.testing.assert_array_equal(regions.lokey, [60, 64, 0])
+    np.testing.assert_array_equal(regions.hikey, [60, 67, 127])
+    np.testing.assert_array_equal(regions.pitch_keycenter, [60, 65, 60])
+    assert regions.column("volume") == [None, None, None]
+    assert regions.nearest(66) == 1
+
+
+def test_defines_comments_and_spaces_in_sample_names():
+    instrument = parse_sfz_content(
+        """#define $DIR piano
+        /* <region> sample=commented.wav */
+        <control> default_path=samples\\
+        <region> sample=$DIR/My Sample C4.wav lokey=c4 hikey=e4 // trailing comment
+        """
+    )
+    assert len(instrument.regions) == 1
+    assert instrument.defines == {"$DIR": "piano"}
+    assert instrument.regions.region(0)["sample"] == "samples/piano/My Sample C4.wav"
+
+
+def test_control_opcodes_are_not_inherited():
+    instrument = parse_sfz_content("<control> default_path=s/ set_cc1=64\n<region> sample=a.wav\n<curve> v000=0\n<region> sample=b.wav")
+    assert instrument.control == {"default_path": "s/", "set_cc1": "64"}
+    assert instrument.regions.region(1) == {"sample": "s/b.wav"}
+
+
+def test_include(tmp_path):
+    (tmp_path / "regions.sfz").write_text("<region> sample=$NAME.wav key=60\n")
+    (tmp_path / "main.sfz").write_text('#define $NAME piano\n<group> volume=-6\n#include "regions.sfz"\n')
+    instrument, error = parse_sfz_instrument(str(tmp_path / "main.sfz"))
+    assert error is None
+    assert instrument.regions.region(0) == {"volume": "-6", "sample": "piano.wav", "key": "60"}
+    assert instrument.sample_path(0) == str(tmp_path / "piano.wav")
+
+
+def test_recursive_include_is_an_error(tmp_path):
+    (tmp_path / "loop.sfz").write_text('#include "loop.sfz"\n')
+    instrument, error = parse_sfz_instrument(str(tmp_path / "loop.sfz"))
+    assert instrument is None and str(MAX_INCLUDE_DEPTH) in error
+
+
+def test_parse_sfz_file_takes_the_region_closest_to_middle_c(tmp_path):
+    path = tmp_path / "instrument.sfz"
+    path.write_text("<control>\ndefault_path=samples/\n<global>\nloop_mode=one_shot\n<group>\n" + "".join(
+        f"<region> sample=N{m}.wav key={m} pitch_keycenter={m}\n" for m in (48, 59, 72)
+    ))
+    sfz_data, sample_path, error = parse_sfz_file(str(path))
+    assert error is None
+    assert sfz_data["key"] == "59" and sfz_data["loop_mode"] == "one_shot"
+    assert sample_path == str(tmp_path / "samples" / "N59.wav")
+
+
+def test_define_values_keep_slashes_and_stop_at_comments():
+    instrument = parse_sfz_content("#define $DIR piano/samples// the folder\n#define $VEL 100/*max*/\n<region> sample=$DIR/a.wav hivel=$VEL")
+    assert instrument.defines == {"$DIR": "piano/samples", "$VEL": "100"}
+    assert instrument.regions.region(0) == {"sample": "piano/samples/a.wav", "hivel": "100"}
+
+
+def test_defines_are_substituted_in_include_paths(tmp_path):
+    (tmp_path / "parts").mkdir()
+    (tmp_path / "parts" / "regions.sfz").write_text("<region> sample=a.wav\n")
+    (tmp_path / "main.sfz").write_text('#define $PARTS parts\n#include "$PARTS/regions.sfz"\n')
+    instrument, error = parse_sfz_instrument(str(tmp_path / "main.sfz"))
+    assert error is None
+    assert instrument.regions.region(0) == {"sample": "a.wav"}
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from sfz_generator.audio.pitch import detect_root_pitch
+
+RATE = 44100
+
+
+def tone(frequency, seconds=1.0, harmonics=(1.0, 0.5, 0.25)):
+    t = np.arange(int(RATE * seconds)) / RATE
+    signal = sum(gain * np.sin(2 * np.pi * frequency * (i + 1) * t) for i, gain in enumerate(harmonics))
+    return (signal * np.exp(-t)).astype(np.float32)
+
+
+@pytest.mark.parametrize("note", [33, 45, 57, 60, 69, 81, 93])
+def test_detects_note(note):
+    frequency = 440.0 * 2 ** ((note - 69) / 12)
+    detected, cents = detect_root_pitch(tone(frequency), RATE)
+    assert detected == note
+    assert abs(cents) < 5
+
+
+def test_detects_detuned_note():
+    frequency = 440.0 * 2 ** (0.3 / 12)
+    assert detect_root_pitch(tone(frequency), RATE)[1] == pytest.approx(30, abs=3)
+
+
+def test_noise_and_short_input_have_no_pitch():
+    rng = np.random.default_rng(1)
+    assert detect_root_pitch(rng.uniform(-1, 1, RATE).astype(np.float32), RATE) is None
+    assert detect_root_pitch(np.zeros(100, dtype=np.float32), RATE) is None
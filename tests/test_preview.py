@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+pytest.importorskip("midiutil")
+
+from sfz_generator.audio.preview import LOOP_PHASE_TOLERANCE, loop_cycles, plan_preview_note  # noqa: E402
+
+RATE = 48000
+
+
+@pytest.mark.parametrize("cycle_frames", [100.0, 1000.5, 333.3333, 12345.678, 91.91])
+def test_loop_cycles_end_on_a_whole_frame(cycle_frames):
+    length = loop_cycles(cycle_frames, RATE * 8) * cycle_frames
+    assert abs(length - round(length)) <= LOOP_PHASE_TOLERANCE
+
+
+def test_loop_cycles_stay_within_the_limit():
+    assert loop_cycles(1000.4999, 2500) == 2
+    assert loop_cycles(3000.3, 2500) == 1
+
+
+def test_sustain_loop_plan_keeps_the_phase(tmp_path):
+    sf.write(tmp_path / "C4.wav", np.zeros(RATE, dtype=np.float32), RATE)
+    sfz_content = "<region> sample=C4.wav lokey=0 hikey=127 pitch_keycenter=60 loop_mode=loop_sustain loop_start=12000 loop_end=12999 ampeg_attack=0.5\n"
+    # A fifth up, one 1000-frame cycle lasts 667.4 output frames
+    plan = plan_preview_note(sfz_content, str(tmp_path), 67, RATE)
+    start, end = plan.loop
+    cycle = 1000 / 2 ** (7 / 12)
+    cycles = (end - start) / cycle
+    assert abs(cycles - round(cycles)) * cycle <= LOOP_PHASE_TOLERANCE + 1e-6
+    # The loop starts after the attack and ends with the render
+    assert start >= 0.5 * RATE
+    assert plan.duration_beats * 60 / 120 * RATE == pytest.approx(end, abs=1)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from sfz_generator.sfz.parser import parse_sfz_content
+from sfz_generator.sfz.region_index import RegionIndex
+
+
+def linear_scan(regions, note, velocity=None):
+    hits = (regions.lokey <= note) & (regions.hikey >= note)
+    if velocity is not None:
+        hits &= (regions.lovel <= velocity) & (regions.hivel >= velocity)
+    return np.flatnonzero(hits)
+
+
+@pytest.fixture(scope="module")
+def random_instrument():
+    rng = np.random.default_rng(49)
+    lines = []
+    for i in range(3000):
+        lokey = int(rng.integers(0, 128))
+        hikey = min(127, lokey + int(rng.choice([0, 0, 1, 5, 30, 127])))
+        lovel = int(rng.integers(1, 128))
+        hivel = min(127, lovel + int(rng.integers(0, 64)))
+        lines.append(f"<region> sample=s{i}.wav lokey={lokey} hikey={hikey} lovel={lovel} hivel={hivel}")
+    return parse_sfz_content("\n".join(lines)).regions
+
+
+def test_matches_linear_scan(random_instrument):
+    index = RegionIndex(random_instrument)
+    for note in range(128):
+        np.testing.assert_array_equal(index.regions_for(note), linear_scan(random_instrument, note))
+        for velocity in (1, 40, 100, 127):
+            np.testing.assert_array_equal(index.regions_for(note, velocity), linear_scan(random_instrument, note, velocity))
+
+
+def test_first_region_and_key_map():
+    regions = parse_sfz_content("<region> sample=a.wav lokey=60 hikey=64 hivel=63\n<region> sample=b.wav lokey=62 hikey=70\n").regions
+    index = RegionIndex(regions)
+    assert index.first_region(61) == 0
+    assert index.first_region(62, velocity=100) == 1
+    assert index.first_region(59) is None
+    key_map = index.key_map()
+    assert key_map[59:72] == [0, 1, 1, 2, 2, 2, 1, 1, 1, 1, 1, 1, 0]
+
+
+def test_empty_instrument():
+    index = RegionIndex(parse_sfz_content("<control> default_path=samples/").regions)
+    assert len(index.regions_for(60)) == 0 and index.first_region(60) is None
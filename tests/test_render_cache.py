@@ -0,0 +1,42 @@
+import numpy as np
+
+from sfz_generator.audio.render_cache import RenderCache, sfz_text_hash
+
+
+def buffer(frames):
+    return np.zeros((frames, 2), dtype=np.float32)
+
+
+def test_hash_depends_on_text_and_folder():
+    assert sfz_text_hash("<region> sample=a.wav") == sfz_text_hash("<region> sample=a.wav")
+    assert sfz_text_hash("<region> sample=a.wav") != sfz_text_hash("<region> sample=b.wav")
+    assert sfz_text_hash("<region> sample=a.wav", "/one") != sfz_text_hash("<region> sample=a.wav", "/two")
+
+
+def test_lru_eviction_by_size():
+    cache = RenderCache(max_bytes=buffer(100).nbytes * 2)
+    cache.put("h", 60, 1.0, buffer(100))
+    cache.put("h", 61, 1.0, buffer(100))
+    assert cache.get("h", 60, 1.0) is not None  # 60 is now the most recent
+    cache.put("h", 62, 1.0, buffer(100))
+    assert cache.get("h", 61, 1.0) is None
+    assert cache.get("h", 60, 1.0) is not None and cache.get("h", 62, 1.0) is not None
+    assert cache.size == buffer(100).nbytes * 2
+
+
+def test_oversized_buffer_is_not_kept():
+    cache = RenderCache(max_bytes=100)
+    cache.put("h", 60, 1.0, buffer(1000))
+    assert cache.get("h", 60, 1.0) is None and cache.size == 0
+
+
+def test_instrument_change_drops_stale_renders():
+    cache = RenderCache()
+    assert cache.set_instrument("a")
+    cache.put("a", 60, 1.0, buffer(10))
+    assert not cache.set_instrument("a")
+    assert cache.get("a", 60, 1.0) is not None
+    assert cache.set_instrument("b")
+    assert cache.get("a", 60, 1.0) is None
+    cache.put("a", 60, 1.0, buffer(10))  # A render that finished after the switch
+    assert cache.get("a", 60, 1.0) is None and cache.size == 0
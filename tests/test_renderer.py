@@ -0,0 +1,89 @@
+import shutil
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from sfz_generator.audio import renderer as renderer_module
+from sfz_generator.audio.renderer import PARITY_MIN_SNR, Renderer, compare_with_sfizz, supports
+
+RATE = 48000
+
+
+@pytest.fixture
+def sample(tmp_path):
+    t = np.arange(RATE) / RATE
+    data = (0.5 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    sf.write(tmp_path / "C4.wav", data, RATE, subtype="FLOAT")
+    return tmp_path, data
+
+
+def test_supports_generator_opcodes_only():
+    assert supports("<control>\ndefault_path=samples/\n<global>\nloop_mode=one_shot\n<group>\n<region> sample=C4.wav key=60")
+    assert not supports("<region> sample=C4.wav cutoff=500")
+    assert not supports('#include "other.sfz"\n<region> sample=C4.wav')
+
+
+def test_keycenter_note_plays_the_sample(sample):
+    base_dir, data = sample
+    out = Renderer(RATE).render({"sample": "C4.wav", "pitch_keycenter": "60", "loop_mode": "one_shot"}, str(base_dir), 60, 0.1)
+    assert out.shape == (len(data), 1)
+    # Default preview velocity 100, squared velocity curve
+    np.testing.assert_allclose(out[:, 0], data * (100 / 127) ** 2, atol=1e-6)
+
+
+def test_octave_up_is_half_as_long(sample):
+    base_dir, data = sample
+    out = Renderer(RATE).render({"sample": "C4.wav", "pitch_keycenter": "60", "loop_mode": "one_shot"}, str(base_dir), 72, 0.1)
+    assert len(out) == len(data) // 2
+
+
+def test_crossfade_tail_is_reused(sample):
+    base_dir, _ = sample
+    renderer = Renderer(RATE)
+    opcodes = {
+        "sample": "C4.wav",
+        "loop_mode": "loop_sustain",
+        "loop_start": "12000",
+        "loop_end": "23999",
+        "loop_crossfade": "0.01",
+    }
+    first = renderer.render(opcodes, str(base_dir), 60, 0.8)
+    assert len(renderer.crossfaded) == 1
+    tail = next(iter(renderer.crossfaded.values()))[1]
+    assert len(tail) == int(0.01 * RATE)
+    second = renderer.render(opcodes, str(base_dir), 64, 0.8)
+    assert next(iter(renderer.crossfaded.values()))[1] is tail
+    assert len(first) == len(second) == int(RATE * 0.8)
+
+    renderer.render({**opcodes, "loop_crossfade": "0.02"}, str(base_dir), 60, 0.8)
+    assert len(renderer.crossfaded) == 2
+
+
+def test_only_the_reached_span_is_read(sample, monkeypatch):
+    base_dir, data = sample
+    renderer = Renderer(RATE)
+    opcodes = {"sample": "C4.wav", "pitch_keycenter": "60"}
+    # no_loop held for 0.1 s reads a tenth of the sample
+    out = renderer.render(opcodes, str(base_dir), 60, 0.1)
+    np.testing.assert_allclose(out[:, 0], data[: len(out)] * (100 / 127) ** 2, atol=1e-6)
+    assert len(renderer._span) == len(out) + 1
+
+    # Notes reaching too far into the sample are left to sfizz_render
+    monkeypatch.setattr(renderer_module, "MAX_RENDER_SPAN", 1000)
+    assert renderer.render(opcodes, str(base_dir), 60, 0.1) is None
+
+
+@pytest.mark.skipif(shutil.which("sfizz_render") is None, reason="sfizz_render is not installed")
+@pytest.mark.parametrize("loop_mode", ["one_shot", "no_loop", "loop_sustain"])
+def test_parity_with_sfizz(sample, loop_mode):
+    pytest.importorskip("midiutil")
+    base_dir, _ = sample
+    sfz_content = (
+        f"<control>\ndefault_path={base_dir}/\n<global>\nloop_mode={loop_mode}\nloop_start=12000\nloop_end=23999\n"
+        "ampeg_release=0.1\n<group>\n<region> sample=C4.wav lokey=48 hikey=72 pitch_keycenter=60\n"
+    )
+    for note in (60, 67):
+        result = compare_with_sfizz(sfz_content, str(base_dir), note, RATE)
+        assert result is not None
+        assert result[0] >= PARITY_MIN_SNR
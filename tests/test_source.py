@@ -0,0 +1,94 @@
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from sfz_generator.audio.source import AudioSource, DecodedSource, MemmapSource, open_audio_source
+
+
+@pytest.fixture
+def stereo():
+    rng = np.random.default_rng(0)
+    return rng.uniform(-0.5, 0.5, (20000, 2)).astype(np.float32)
+
+
+@pytest.mark.parametrize("name, subtype", [("sample.wav", "PCM_16"), ("sample.wav", "PCM_24"), ("sample.wav", "FLOAT"), ("sample.aiff", "PCM_16")])
+def test_pcm_matches_soundfile(tmp_path, stereo, name, subtype):
+    path = tmp_path / name
+    sf.write(path, stereo, 44100, subtype=subtype)
+    expected = sf.read(path, dtype="float32")[0].mean(axis=1)
+
+    source = open_audio_source(str(path))
+    assert source.sample_rate == 44100
+    assert len(source) == len(stereo)
+    np.testing.assert_allclose(source[:], expected, atol=1e-4)
+    np.testing.assert_allclose(source[1000:1010], expected[1000:1010], atol=1e-4)
+    assert source[-1] == pytest.approx(expected[-1], abs=1e-4)
+
+
+@pytest.mark.parametrize("name", ["sample.wav", "sample.aiff"])
+def test_pcm16_is_memory_mapped(tmp_path, stereo, name):
+    path = tmp_path / name
+    sf.write(path, stereo, 48000, subtype="PCM_16")
+    assert isinstance(open_audio_source(str(path)), MemmapSource)
+
+
+def test_compressed_file_is_decoded_in_blocks(tmp_path, stereo, monkeypatch):
+    monkeypatch.setattr(DecodedSource, "BLOCK_FRAMES", 4096)
+    monkeypatch.setattr(DecodedSource, "MAX_BLOCKS", 2)
+    path = tmp_path / "sample.flac"
+    sf.write(path, stereo, 48000)
+    expected = stereo.mean(axis=1)
+
+    source = open_audio_source(str(path))
+    assert isinstance(source, DecodedSource)
+    assert not source._blocks
+    np.testing.assert_allclose(source[5000:5010], expected[5000:5010], atol=1e-4)
+    assert list(source._blocks) == [1]
+    # The cache keeps the blocks read last
+    np.testing.assert_allclose(source[:], expected, atol=1e-4)
+    assert list(source._blocks) == [3, 4]
+    blocks = [block.copy() for _, block in source.iter_blocks(block_frames=3000, start=100)]
+    np.testing.assert_allclose(np.concatenate(blocks), expected[100:], atol=1e-4)
+
+
+def test_read_ready_only_copies_decoded_blocks(tmp_path, stereo, monkeypatch):
+    monkeypatch.setattr(DecodedSource, "BLOCK_FRAMES", 4096)
+    path = tmp_path / "sample.flac"
+    sf.write(path, stereo, 48000)
+    expected = stereo.mean(axis=1)
+    source = open_audio_source(str(path))
+
+    source.prefetch(0, 1, wait=True)
+    out = np.zeros(6000, dtype=np.float32)
+    assert source.read_ready(0, out) == 4096
+    np.testing.assert_allclose(out[:4096], expected[:4096], atol=1e-4)
+
+    # The blocks after the read are decoded in the background
+    deadline = time.monotonic() + 5
+    while source.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert {1, 2, 3} <= set(source._blocks)
+    assert source.read_ready(0, out) == len(out)
+    np.testing.assert_allclose(out, expected[:6000], atol=1e-4)
+
+
+def test_read_into_and_blocks(tmp_path, stereo):
+    path = tmp_path / "sample.wav"
+    sf.write(path, stereo[:, 0], 48000, subtype="FLOAT")
+    source = open_audio_source(str(path))
+
+    out = np.zeros(100, dtype=np.float32)
+    assert source.read_into(len(source) - 40, out) == 40
+    np.testing.assert_array_equal(out[:40], stereo[-40:, 0])
+
+    # Blocks share one buffer, each is copied before the next is read
+    blocks = [(offset, block.copy()) for offset, block in source.iter_blocks(block_frames=4096, start=10, stop=9000)]
+    assert [offset for offset, _ in blocks] == [10, 4106, 8202]
+    np.testing.assert_array_equal(np.concatenate([block for _, block in blocks]), stereo[10:9000, 0])
+
+
+def test_audio_source_is_abstract():
+    with pytest.raises(TypeError):
+        AudioSource("sample.wav", 48000, 0, 1)